@@ -1,188 +1,263 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+import json
 import os
-import requests
 import logging
 import random
-import time
 import threading
-import hashlib
+import time
+import uuid
+from functools import partial
+
+from coalescer import BurstCoalescer
+from conversation_state import STAGE_NAMES, ConversationState
+from dedup import UpdateDeduplicator
+from ingest import MailboxQueue
+from keyword_matcher import PROBLEM_TYPES, matcher
+import log_config
+from metrics import CONTENT_TYPE, REGISTRY
+from outbox import MESSAGE, Outbox
+from profiling import profiled, span
+import profiling
+from rate_limiter import RateLimiter
+from recorder import create_recorder
+from scheduler import DeliveryScheduler
+from state_store import create_state_store
+from telegram_client import TelegramClient, get_retry_after
+from typing_heartbeat import TypingHeartbeat
+from templates import TEMPLATES, render_all
 
 app = Flask(__name__)
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+log_config.setup_logging()
 logger = logging.getLogger(__name__)
 
 BOT_TOKEN = os.environ.get('BOT_TOKEN')
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN не установлен!")
 
-# Глобальные хранилища
-conversations = {}
-user_first_messages = {}
-message_history = {}
-processed_messages = set()  # Для дедупликации
-last_message_time = {}
-
-# Очищаем старые processed_messages каждые 5 минут
-def cleanup_processed_messages():
-    while True:
-        time.sleep(300)  # 5 минут
-        # Удаляем старые хеши (старше 10 минут)
-        cutoff = time.time() - 600
-        # Немного сложно, так как мы храним только хеши
-        # Вместо этого просто очищаем периодически
-        if len(processed_messages) > 1000:
-            processed_messages.clear()
-            logger.info("🧹 Очищена история processed_messages")
-
-threading.Thread(target=cleanup_processed_messages, daemon=True).start()
-
-def get_message_hash(chat_id, message_text, update_id=None):
-    """Создает уникальный хеш для сообщения"""
-    content = f"{chat_id}_{message_text}"
-    if update_id:
-        content += f"_{update_id}"
-    return hashlib.md5(content.encode()).hexdigest()
-
-def is_message_processed(message_hash):
-    """Проверяет, обрабатывалось ли уже это сообщение"""
-    return message_hash in processed_messages
-
-def mark_message_processed(message_hash):
-    """Отмечает сообщение как обработанное"""
-    processed_messages.add(message_hash)
-
-def show_typing(chat_id, duration=None):
-    """Показывает статус 'печатает'"""
-    if duration is None:
-        duration = random.uniform(2.0, 4.0)
-    
-    def typing_action():
-        try:
-            url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendChatAction"
-            payload = {'chat_id': chat_id, 'action': 'typing'}
-            requests.post(url, json=payload, timeout=5)
-            time.sleep(duration)
-        except:
-            pass
-    
-    threading.Thread(target=typing_action, daemon=True).start()
+# Состояния диалогов: SQLite или Postgres, общие для воркеров, либо память
+# процесса (STATE_BACKEND; под gunicorn по умолчанию SQLite)
+conversation_store = create_state_store()
+
+DELIVERY_WORKERS = int(os.environ.get('DELIVERY_WORKERS', 4))
+
+# Все отложенные отправки процесса живут в одной куче
+delivery_scheduler = DeliveryScheduler(workers=DELIVERY_WORKERS)
+
+# Лимиты Telegram на исходящие сообщения: ожидание слота - это задача
+# планировщика, а не сон в его потоке
+rate_limiter = RateLimiter()
+
+# Общий пул соединений к Bot API, по соединению на воркер плюс запас для webhook
+telegram = TelegramClient(BOT_TOKEN, pool_size=DELIVERY_WORKERS + 2, rate_limiter=rate_limiter)
+
+# Журнал отложенных ответов: переживает деплой, падение и засыпание инстанса
+outbox = Outbox(
+    os.environ.get('OUTBOX_PATH', 'outbox.db'),
+    commit_interval=float(os.environ.get('OUTBOX_COMMIT_INTERVAL', 0.05))
+)
+
+# Запись входящих апдейтов для replay.py (RECORD_TRAFFIC=путь, файл на процесс;
+# по умолчанию выключена)
+traffic_recorder = create_recorder()
+
+# Дедупликация по update_id, общая для всех gunicorn-воркеров
+update_dedup = UpdateDeduplicator(
+    path=os.environ.get('DEDUP_PATH'),
+    ttl=int(os.environ.get('DEDUP_TTL', 600))
+)
+
+# Метрики для /metrics: счетчики пишутся в шард своего потока,
+# gauge-значения читаются только при сборе
+webhook_latency = REGISTRY.histogram(
+    'tarot_webhook_duration_seconds',
+    'Время обработки POST /webhook',
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+updates_total = REGISTRY.counter(
+    'tarot_updates_total',
+    'Входящие апдейты по итогу: queued, skipped_duplicate, ignored, overloaded',
+    ('status',)
+)
+stage_transitions = REGISTRY.counter(
+    'tarot_stage_transitions_total',
+    'Переходы между стадиями диалога в process_user_message',
+    ('from_stage', 'to_stage')
+)
+REGISTRY.gauge('tarot_delivery_pending', 'Запланированные отложенные задачи', lambda: delivery_scheduler.pending())
+REGISTRY.gauge('tarot_threads', 'Живые потоки процесса', threading.active_count)
+# Общее хранилище все воркеры видят одинаково: его размер не суммируется
+REGISTRY.gauge(
+    'tarot_conversations',
+    'Диалогов в хранилище состояний',
+    lambda: len(conversation_store),
+    aggregate='local' if conversation_store.shared else 'sum'
+)
+
+def is_update_processed(update_id):
+    """Проверяет update_id в общем для воркеров окне и отмечает его"""
+    if update_id is None:
+        return False
+    return update_dedup.check_and_mark(update_id)
+
+def _send_typing_action(chat_id):
+    telegram.send_chat_action(chat_id)
+
+# Статус 'печатает' всех чатов обновляется одним таймером, пока ответ не отправлен
+typing_status = TypingHeartbeat(
+    _send_typing_action,
+    delivery_scheduler,
+    interval=float(os.environ.get('TYPING_INTERVAL', 4.5))
+)
+
+def show_typing(chat_id):
+    """Показывает статус 'печатает' один раз (около 5 секунд)"""
+    typing_status.begin(chat_id, duration=typing_status.interval)
+
+def _deliver_message(chat_id, text, done=None, attempt=0, reserved=False):
+    """Отправляет одно сообщение через Telegram API, затем вызывает done()
+
+    Пока лимит не пускает, поток планировщика не спит: отправка
+    переставляется в планировщик на разрешенное время. После 429 чат
+    штрафуется на retry_after, и отправка повторяется так же.
+    """
+    if not reserved:
+        wait = rate_limiter.ready_in(chat_id)
+        if wait > 0:
+            delivery_scheduler.schedule(wait, _deliver_message, chat_id, text, done, attempt)
+            return
+        delay = rate_limiter.reserve(chat_id)
+        if delay > 0:
+            delivery_scheduler.schedule(delay, _deliver_message, chat_id, text, done, attempt, True)
+            return
+    try:
+        response = telegram.send_message_once(chat_id, text)
+        if response.status_code == 429 and attempt < telegram.max_retries:
+            retry_after = get_retry_after(response)
+            logger.warning("⏳ 429 для чата %s, повтор через %s сек", chat_id, retry_after)
+            rate_limiter.penalize(chat_id, retry_after)
+            delivery_scheduler.schedule(0, _deliver_message, chat_id, text, done, attempt + 1)
+            return
+        if response.status_code != 200:
+            logger.error("❌ Ошибка отправки: %s", response.text)
+    except Exception as e:
+        logger.error("Ошибка отправки: %s", e)
+    if done is not None:
+        done()
+
+# Множитель всех человеческих задержек: в нагрузочных тестах их сжимают (например, 0.01)
+HUMAN_DELAY_SCALE = float(os.environ.get('HUMAN_DELAY_SCALE', 1))
+
+def plan_sequence(messages, first_delay=0):
+    """Расписание серии сообщений: [(когда 'печатает', когда отправить, текст)] в секундах от сейчас"""
+    plan = []
+    offset = first_delay
+    for i, msg in enumerate(messages):
+        if i > 0:
+            pause = random.randint(10, 25)
+            logger.info("⏸️ Пауза между сообщениями: %s сек", pause, extra={'event': 'delay'})
+            offset += pause
+        
+        typing_at = offset
+        offset += random.uniform(1.5, 3.0)
+        plan.append((typing_at * HUMAN_DELAY_SCALE, offset * HUMAN_DELAY_SCALE, msg))
+    return plan
+
+@profiled('delivery')
+def _deliver_queued(key, chat_id, text):
+    """Отправляет ответ из outbox ровно один раз"""
+    with span('outbox_claim'):
+        if not outbox.claim(key):
+            return
+    with span('send_message'):
+        _deliver_message(chat_id, text, partial(_delivered, key, chat_id))
+
+def _delivered(key, chat_id):
+    typing_status.end(chat_id)
+    outbox.sent(key)
+
+# Когда уйдет последний запланированный ответ чата (по time.time)
+delivery_tails = {}
+delivery_tails_lock = threading.Lock()
+
+def _reserve_delivery_window(chat_id, plan, now):
+    """Сдвигает расписание за последний ответ чата, чтобы серии не перемешивались
+
+    Возвращает сдвиг в секундах.
+    """
+    with delivery_tails_lock:
+        previous = delivery_tails.get(chat_id, 0.0)
+        shift = max(0.0, previous - now - plan[0][0])
+        delivery_tails[chat_id] = now + plan[-1][1] + shift
+        # Изредка выметаем чаты, у которых все уже отправлено
+        if len(delivery_tails) > 10000:
+            for stale in [c for c, t in delivery_tails.items() if t < now]:
+                del delivery_tails[stale]
+    return shift
+
+def _schedule_plan(chat_id, plan, key=None):
+    """Записывает расписание в outbox и ставит его в планировщик
+
+    key - ключ идемпотентности серии (update_id): повторная обработка
+    того же апдейта не запланирует ответы второй раз. Возвращает
+    ключи ответов в outbox.
+    """
+    key = key or uuid.uuid4().hex
+    now = time.time()
+    shift = _reserve_delivery_window(chat_id, plan, now)
+    keys = []
+    for i, (typing_at, send_at, text) in enumerate(plan):
+        typing_at += shift
+        send_at += shift
+        entry_key = f"{key}:{i}"
+        outbox.add(entry_key, chat_id, text, now + send_at)
+        keys.append(entry_key)
+        delivery_scheduler.schedule(typing_at, typing_status.begin, chat_id)
+        delivery_scheduler.schedule(send_at, _deliver_queued, entry_key, chat_id, text)
+    return keys
+
+def replay_outbox():
+    """Заново планирует ответы и сообщения умерших процессов, не обработанные до их смерти
+
+    Сообщения из несобранных серий снова попадают в серию чата и ждут
+    новую человеческую задержку.
+    """
+    now = time.time()
+    entries = outbox.adopt()
+    for key, chat_id, text, due, kind in entries:
+        if kind == MESSAGE:
+            user_name, message_text, update_id = json.loads(text)
+            coalescer.add(chat_id, user_name, message_text, update_id)
+            continue
+        delay = max(0.0, due - now)
+        delivery_scheduler.schedule(max(0.0, delay - 2), typing_status.begin, chat_id)
+        delivery_scheduler.schedule(delay, _deliver_queued, key, chat_id, text)
+    if entries:
+        logger.info("📬 Из outbox восстановлено записей: %d", len(entries))
+    return len(entries)
 
 def get_human_delay():
     """Задержка 60-180 секунд (1-3 минуты)"""
     return random.randint(60, 180)
 
-def send_message_with_delay(chat_id, text, delay_override=None):
-    """Отправляет сообщение с задержкой"""
-    def send():
-        if delay_override:
-            delay = delay_override
-        else:
-            delay = get_human_delay()
-        
-        logger.info(f"⏰ Задержка: {delay} сек для: {text[:40]}...")
-        time.sleep(delay)
-        
-        show_typing(chat_id, duration=random.uniform(1.5, 3.0))
-        time.sleep(random.uniform(1.5, 3.0))
-        
-        try:
-            url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-            payload = {'chat_id': chat_id, 'text': text, 'parse_mode': 'Markdown'}
-            response = requests.post(url, json=payload, timeout=10)
-            if response.status_code != 200:
-                logger.error(f"❌ Ошибка отправки: {response.text}")
-        except Exception as e:
-            logger.error(f"Ошибка: {e}")
-    
-    threading.Thread(target=send, daemon=True).start()
-
-def send_multiple_messages(chat_id, messages):
+def burst_hold():
+    """Сколько серия копится с первого сообщения: человеческая задержка ответа"""
+    return get_human_delay() * HUMAN_DELAY_SCALE
+
+def send_multiple_messages(chat_id, messages, key=None):
     """Отправляет несколько сообщений с паузами"""
-    def send_sequence():
-        for i, msg in enumerate(messages):
-            if i > 0:
-                pause = random.randint(10, 25)
-                logger.info(f"⏸️ Пауза между сообщениями: {pause} сек")
-                time.sleep(pause)
-            
-            show_typing(chat_id, duration=random.uniform(1.5, 3.0))
-            time.sleep(random.uniform(1.5, 3.0))
-            
-            try:
-                url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-                payload = {'chat_id': chat_id, 'text': msg, 'parse_mode': 'Markdown'}
-                response = requests.post(url, json=payload, timeout=10)
-                if response.status_code != 200:
-                    logger.error(f"❌ Ошибка отправки сообщения: {response.text}")
-            except Exception as e:
-                logger.error(f"Ошибка отправки: {e}")
-    
-    threading.Thread(target=send_sequence, daemon=True).start()
+    return _schedule_plan(chat_id, plan_sequence(messages), key)
 
-def get_conversation_state(chat_id):
-    """Получает или создает состояние диалога"""
-    if chat_id not in conversations:
-        conversations[chat_id] = {
-            'stage': 'awaiting_problem',  # Ждем проблему
-            'user_name': '',
-            'problem': '',
-            'problem_type': '',
-            'trust_level': 0,
-            'message_count': 0,
-            'last_message_time': time.time(),
-            'payment_offered': False,
-            'payment_link_sent': False,
-            'waiting_for_payment': False,
-            'conversation_start': time.time(),
-            'greeted': False,
-            'last_responses': [],  # Последние отправленные ответы
-            'message_queue': []  # Очередь сообщений для отправки
-        }
-    
-    conversations[chat_id]['last_message_time'] = time.time()
-    return conversations[chat_id]
-
-def add_to_response_history(chat_id, response_text):
-    """Добавляет ответ в историю"""
-    if 'last_responses' not in conversations[chat_id]:
-        conversations[chat_id]['last_responses'] = []
-    
-    conversations[chat_id]['last_responses'].append({
-        'text': response_text[:50],  # Сохраняем только начало для логов
-        'time': time.time()
-    })
-    
-    # Ограничиваем историю 10 последними ответами
-    if len(conversations[chat_id]['last_responses']) > 10:
-        conversations[chat_id]['last_responses'] = conversations[chat_id]['last_responses'][-10:]
+def new_conversation_state():
+    """Создает состояние нового диалога"""
+    return ConversationState()
 
-def is_response_recent(chat_id, response_text):
-    """Проверяет, отправлялся ли похожий ответ недавно"""
-    if chat_id not in conversations or 'last_responses' not in conversations[chat_id]:
-        return False
-    
-    current_time = time.time()
-    for resp in conversations[chat_id]['last_responses']:
-        # Если тот же ответ был отправлен менее 5 минут назад
-        if (current_time - resp['time'] < 300 and 
-            response_text[:30] == resp['text'][:30]):  # Сравниваем начало
-            return True
-    
-    return False
+def get_conversation_state(chat_id):
+    """Получает состояние диалога только для чтения (None, если чата нет)"""
+    return conversation_store.get(chat_id)
 
-def get_unique_response(responses, chat_id):
-    """Возвращает уникальный ответ, который не отправлялся недавно"""
-    if not responses:
-        return ""
-    
-    # Пытаемся найти ответ, который не отправлялся недавно
-    for attempt in range(3):  # 3 попытки
-        response = random.choice(responses)
-        if not is_response_recent(chat_id, response):
-            return response
-    
-    # Если все отправлялись недавно, берем любой
-    return random.choice(responses)
+def add_to_response_history(state, template):
+    """Отмечает вариант ответа отправленным (набор недавних, 5 минут)"""
+    state.mark_recent(template.hash)
 
 def format_message(text, is_fast=False):
     """Форматирует сообщение естественно"""
@@ -198,28 +273,21 @@ def format_message(text, is_fast=False):
     
     return text
 
-def is_problem_message(message):
+def is_problem_message(message, categories=None):
     """Определяет, является ли сообщение описанием проблемы"""
     if not message or len(message) < 10:
         return False
     
-    message_lower = message.lower()
-    
     # Игнорируем команды
-    if message_lower.startswith('/'):
+    if message.startswith('/'):
         return False
     
-    problem_keywords = [
-        'не могу', 'не знаю', 'проблем', 'ситуац', 'трудност', 'сложност', 
-        'боюсь', 'страшно', 'волнуюсь', 'переживаю', 'хочу понять', 
-        'как быть', 'что делать', 'помогите', 'совет', 'мне нужн', 'у меня',
-        'хочу узнать', 'интересно', 'скажите', 'подскажите'
-    ]
+    if categories is None:
+        categories = matcher.match(message)
     
     # Проверяем наличие ключевых слов
-    for keyword in problem_keywords:
-        if keyword in message_lower:
-            return True
+    if 'problem' in categories:
+        return True
     
     # Проверяем вопросительные предложения
     if '?' in message and len(message) > 15:
@@ -227,22 +295,27 @@ def is_problem_message(message):
     
     return False
 
-def analyze_problem_type(message):
+def analyze_problem_type(message, categories=None):
     """Анализирует тип проблемы"""
-    message_lower = message.lower()
-    
-    if any(word in message_lower for word in ['девушк', 'парн', 'мужчин', 'женщин', 'любов', 'отношен', 'семь', 'брак']):
-        return 'отношения'
-    elif any(word in message_lower for word in ['работ', 'карьер', 'начальник', 'коллег', 'зарплат', 'офис', 'проект']):
-        return 'работа'
-    elif any(word in message_lower for word in ['деньг', 'финанс', 'долг', 'кредит', 'заработ', 'бизнес', 'куп']):
-        return 'деньги'
-    elif any(word in message_lower for word in ['здоров', 'болезн', 'боль', 'врач', 'лечен', 'энерг', 'устал']):
-        return 'здоровье'
-    elif any(word in message_lower for word in ['выбор', 'решен', 'сомнен', 'не уверен', 'не знаю как']):
-        return 'выбор'
-    else:
-        return 'общая'
+    if categories is None:
+        categories = matcher.match(message)
+    
+    for problem_type in PROBLEM_TYPES:
+        if problem_type in categories:
+            return problem_type
+    return 'общая'
+
+def get_unique_response(key, user_name, state):
+    """Выбирает вариант, который не отправлялся недавно, и подставляет имя"""
+    templates = TEMPLATES[key]
+    # Случайный из еще не отправленных за 5 минут, иначе самый давний
+    template = templates[state.pick_fresh(templates.hashes, window=300)]
+    add_to_response_history(state, template)
+    return template.render(user_name)
+
+def render_random(key, user_name):
+    """Случайный вариант из таблицы без проверки повторов"""
+    return random.choice(TEMPLATES[key]).render(user_name)
 
 def generate_greeting_response(user_name, state):
     """Генерирует приветственный ответ"""
@@ -251,105 +324,24 @@ def generate_greeting_response(user_name, state):
         return []
     
     state['greeted'] = True
-    greetings = [
-        f"привет, {user_name} ✨",
-        f"здравствуй, {user_name}",
-        f"{user_name}, приветствую"
-    ]
-    
-    greeting = get_unique_response(greetings, state.get('chat_id'))
-    
-    prompts = [
-        "расскажи, что привело тебя сегодня",
-        "что на душе",
-        "чем могу помочь"
-    ]
-    
-    prompt = random.choice(prompts)
+    greeting = get_unique_response('greeting', user_name, state)
+    prompt = render_random('greeting_prompt', user_name)
     
     return [
         format_message(greeting, False),
         format_message(prompt, False)
     ]
 
-def generate_problem_response(problem_text, user_name, state):
+def generate_problem_response(problem_text, user_name, state, categories=None):
     """Генерирует ответ на проблему"""
-    problem_type = analyze_problem_type(problem_text)
+    problem_type = analyze_problem_type(problem_text, categories)
     state['problem'] = problem_text
     state['problem_type'] = problem_type
     state['stage'] = 'problem_understood'
     
-    # Эмпатичные ответы по типам
-    empathy_responses = {
-        'отношения': [
-            f"понимаю, {user_name}... сердечные вопросы всегда такие глубокие",
-            f"ой, {user_name}, отношения... это всегда про самое важное",
-            f"чувствую, {user_name}, как это важно для тебя"
-        ],
-        'работа': [
-            f"{user_name}, рабочие вопросы часто бывают очень напряженными",
-            f"понимаю, {user_name}... работа действительно может выматывать",
-            f"чувствую напряжение, {user_name}"
-        ],
-        'деньги': [
-            f"{user_name}, финансовые темы часто связаны с безопасностью",
-            f"понимаю твою озабоченность, {user_name}",
-            f"{user_name}, деньги... это всегда про свободу и возможности"
-        ],
-        'здоровье': [
-            f"{user_name}, здоровье - это основа",
-            f"чувствую твою заботу о себе, {user_name}",
-            f"понимаю, {user_name}, как это важно"
-        ],
-        'выбор': [
-            f"{user_name}, стоять на распутье... это всегда непросто",
-            f"чувствую твои сомнения, {user_name}",
-            f"{user_name}, моменты выбора часто определяют многое"
-        ],
-        'общая': [
-            f"слышу тебя, {user_name}",
-            f"понимаю, {user_name}",
-            f"чувствую, как это беспокоит тебя, {user_name}"
-        ]
-    }
-    
-    empathy = get_unique_response(empathy_responses[problem_type], state.get('chat_id'))
-    
-    # Вопросы для углубления
-    questions = {
-        'отношения': [
-            "что самое важное для тебя в этих отношениях",
-            "чего не хватает для полного счастья",
-            "что твое сердце чувствует в этой ситуации"
-        ],
-        'работа': [
-            "что самое сложное в этой ситуации",
-            "как это влияет на твое состояние каждый день",
-            "что бы ты хотел изменить в первую очередь"
-        ],
-        'деньги': [
-            "как эта ситуация влияет на твою свободу",
-            "чего ты боишься больше всего",
-            "что изменится, если деньги перестанут быть проблемой"
-        ],
-        'здоровье': [
-            "как это влияет на твою повседневную жизнь",
-            "что говорит тебе твое тело",
-            "какой поддержки тебе не хватает"
-        ],
-        'выбор': [
-            "что подсказывает твоя интуиция",
-            "чего ты боишься в каждом из вариантов",
-            "какой выбор сделало бы твое сердце, если бы не было страха"
-        ],
-        'общая': [
-            "что самое тяжелое в этом для тебя",
-            "как долго это с тобой",
-            "что бы хотелось изменить"
-        ]
-    }
-    
-    question = random.choice(questions[problem_type])
+    # Эмпатия и вопрос для углубления по типу проблемы
+    empathy = get_unique_response(f"empathy.{problem_type}", user_name, state)
+    question = render_random(f"question.{problem_type}", user_name)
     
     return [
         format_message(empathy, False),
@@ -360,21 +352,8 @@ def generate_offer_response(user_name, state):
     """Генерирует предложение помощи"""
     state['stage'] = 'offering_help'
     
-    offers = [
-        f"{user_name}, иногда полезно посмотреть на ситуацию с другой стороны\nкарты таро могут стать таким проводником",
-        f"знаешь, {user_name}, карты часто помогают увидеть то, что скрыто\nхочешь попробовать такой диалог",
-        f"{user_name}, у меня есть чувство\nчто здесь есть важные подсказки для тебя\nкарты могут помочь их расшифровать"
-    ]
-    
-    offer = get_unique_response(offers, state.get('chat_id'))
-    
-    explanations = [
-        "это не гадание, а разговор с собой через язык символов",
-        "это как посмотреть на ситуацию через чистое зеркало",
-        "карты помогают увидеть то, что мы часто не замечаем в суете"
-    ]
-    
-    explanation = random.choice(explanations)
+    offer = get_unique_response('offer', user_name, state)
+    explanation = render_random('offer_explanation', user_name)
     
     return [
         format_message(offer, False),
@@ -386,14 +365,7 @@ def generate_value_response(user_name, state):
     state['stage'] = 'discussing_value'
     state['payment_offered'] = True
     
-    responses = [
-        f"хорошо, {user_name} 💫\nтогда я создам для тебя персональный расклад",
-        "буду работать с твоей ситуацией очень внимательно",
-        f"стоимость - 1490 рублей\nно для тебя, {user_name}, сделаю за 990",
-        "это не просто оплата\nа энергообмен и твоя готовность к изменениям"
-    ]
-    
-    return [format_message(r, False) for r in responses]
+    return [format_message(r, False) for r in render_all('value', user_name)]
 
 def generate_payment_response(user_name, state):
     """Генерирует ответ с оплатой"""
@@ -401,29 +373,71 @@ def generate_payment_response(user_name, state):
         state['payment_link_sent'] = True
         state['stage'] = 'awaiting_payment'
         
-        pre_responses = [
-            f"чувствую твою решимость, {user_name} ✨",
-            "этот шаг изменит многое для тебя"
-        ]
-        
-        return [
-            format_message(random.choice(pre_responses), False),
-            "держи ссылку для оплаты",
-            "https://yoomoney.ru/to/4100111234567890"  # ЗАМЕНИТЕ!
-        ]
+        return [format_message(render_random('payment_intro', user_name), False)] + render_all('payment_link', user_name)
     
-    return [format_message("ссылка уже отправлена, проверь сообщения выше", False)]
+    return [format_message(render_random('payment_already_sent', user_name), False)]
+
+def advance_update_id(state, update_id):
+    """Отмечает апдейт примененным; False, если состояние уже видело его или более поздний
+
+    Апдейты одного чата могут прийти в разные воркеры и процессы, и
+    порядок между ними держит только общее хранилище состояний.
+    Сравнение действует только в окне дедупликации (DEDUP_TTL) от
+    последнего примененного апдейта (last_message_time ставится в той же
+    транзакции): после недели без апдейтов Telegram начинает update_id
+    заново, и старый last_update_id не должен заглушить чат.
+    """
+    if update_id is None:
+        return True
+    recent = time.time() - state['last_message_time'] < update_dedup.ttl
+    if recent and update_id <= state['last_update_id']:
+        return False
+    state['last_update_id'] = update_id
+    return True
+
+def handle_user_message(chat_id, user_name, messages):
+    """Применяет сообщения [(update_id, текст)] одним прогоном в одной транзакции
+
+    Тексты склеиваются, уже примененные апдейты пропускаются. Команды
+    идут отдельными сообщениями: /start первым сообщением здоровается,
+    остальные отбрасываются, и в склейку попадает только обычный текст.
+    Возвращает ответы и update_id последнего примененного сообщения -
+    ключ идемпотентности ответов в outbox.
+    """
+    with span('state_transaction'), conversation_store.transaction(chat_id, new_conversation_state) as state:
+        fresh = [(update_id, text) for update_id, text in messages if advance_update_id(state, update_id)]
+        if not fresh:
+            logger.info("⏭️ Чат %s: апдейты уже применены", chat_id, extra={'event': 'duplicate'})
+            return [], None
+        state['last_message_time'] = time.time()
+        commands = [text for _, text in fresh if text.startswith('/')]
+        texts = [text for _, text in fresh if not text.startswith('/')]
+        responses = []
+        # Выбранные варианты попадают в набор недавних прямо в get_unique_response
+        with span('process_user_message'):
+            for command in commands:
+                responses += process_user_message(chat_id, user_name, command, state)
+            if texts:
+                responses += process_user_message(chat_id, user_name, '\n'.join(texts), state)
+    
+    return responses, fresh[-1][0]
+
+def process_user_message(chat_id, user_name, message_text, state):
+    """Обрабатывает сообщение пользователя и считает переход стадии"""
+    stage = state['stage']
+    responses = _process_stage(chat_id, user_name, message_text, state)
+    stage_transitions.inc(stage, state['stage'])
+    return responses
 
-def process_user_message(chat_id, user_name, message_text):
+def _process_stage(chat_id, user_name, message_text, state):
     """Обрабатывает сообщение пользователя"""
-    state = get_conversation_state(chat_id)
     state['user_name'] = user_name
     state['message_count'] += 1
     
-    logger.info(f"💬 Чат {chat_id}, Стадия: {state['stage']}, Сообщение: {state['message_count']}")
+    logger.info("💬 Чат %s, Стадия: %s, Сообщение: %d", chat_id, state['stage'], state['message_count'], extra={'event': 'stage'})
     
-    # Определяем тип сообщения
-    message_lower = message_text.lower()
+    # Определяем тип сообщения: все категории ключевых слов за один проход
+    categories = matcher.match(message_text)
     
     # Игнорируем /start и другие команды как отдельные сообщения
     if message_text.startswith('/'):
@@ -434,8 +448,8 @@ def process_user_message(chat_id, user_name, message_text):
     
     # Основная логика по стадиям
     if state['stage'] == 'awaiting_problem':
-        if is_problem_message(message_text):
-            return generate_problem_response(message_text, user_name, state)
+        if is_problem_message(message_text, categories):
+            return generate_problem_response(message_text, user_name, state, categories)
         else:
             # Если не проблема, все равно переходим к диалогу
             state['stage'] = 'greeting'
@@ -446,125 +460,186 @@ def process_user_message(chat_id, user_name, message_text):
         return generate_offer_response(user_name, state)
     
     elif state['stage'] == 'offering_help':
-        positive_words = ['да', 'хочу', 'готов', 'соглас', 'интересно', 'можно', 'попробую', 'давай']
-        
-        if any(word in message_lower for word in positive_words):
+        if 'positive' in categories:
             return generate_value_response(user_name, state)
         else:
             # Если сомневается
-            comfort = [
-                f"всё в твоем ритме, {user_name}",
-                "не торопись с решением",
-                f"посиди с этим ощущением, {user_name}"
-            ]
-            return [format_message(random.choice(comfort), False)]
+            return [format_message(render_random('comfort', user_name), False)]
     
     elif state['stage'] == 'discussing_value':
-        if 'сколько' in message_lower or 'цена' in message_lower or 'стоимость' in message_lower or '990' in message_lower:
+        if 'price' in categories:
             state['stage'] = 'ready_for_payment'
-            return [format_message(f"{user_name}, готов сделать этот шаг к ясности", False)]
+            return [format_message(render_random('price_ready', user_name), False)]
         
-        elif 'готов' in message_lower or 'куплю' in message_lower or 'оплат' in message_lower:
+        elif 'purchase' in categories:
             return generate_payment_response(user_name, state)
         
         else:
-            return [format_message(f"{user_name}, как тебе такая инвестиция в себя", False)]
+            return [format_message(render_random('value_nudge', user_name), False)]
     
     elif state['stage'] == 'ready_for_payment':
-        if any(word in message_lower for word in ['готов', 'давай', 'хочу', 'куплю', 'оплат']):
+        if 'ready' in categories:
             return generate_payment_response(user_name, state)
         
         else:
-            return [format_message(f"{user_name}, всё в твоем темпе", False)]
+            return [format_message(render_random('ready_nudge', user_name), False)]
     
     elif state['stage'] == 'awaiting_payment':
-        if 'оплат' in message_lower or 'перевел' in message_lower or 'сделал' in message_lower or 'оплатил' in message_lower:
+        if 'paid' in categories:
             state['stage'] = 'working'
             state['waiting_for_payment'] = False
             
-            gratitude = [
-                f"благодарю, {user_name} 🙏",
-                "энергия пошла",
-                "начинаю работать с картами для твоего расклада",
-                "займет немного времени\nно оно того стоит\nотдохни, скоро вернусь с ответами"
-            ]
-            
-            return [format_message(r, False) for r in gratitude]
+            return [format_message(r, False) for r in render_all('gratitude', user_name)]
         
         else:
-            reminders = [
-                f"я здесь, {user_name}\nжду, когда будешь готов",
-                "всё в твоем ритме\nссылка ждет тебя"
-            ]
-            
-            return [format_message(random.choice(reminders), False)]
+            return [format_message(render_random('payment_reminder', user_name), False)]
     
     elif state['stage'] == 'working':
-        updates = [
-            "карты уже говорят...\nчто-то важное про твой путь",
-            "вижу интересные связи\nто, что было скрыто",
-            f"{user_name}, это глубже, чем кажется"
-        ]
-        
-        return [format_message(random.choice(updates), False)]
+        return [format_message(render_random('working_update', user_name), False)]
     
     # Если непонятная стадия, возвращаем к началу
     state['stage'] = 'awaiting_problem'
-    return [format_message(f"{user_name}, расскажи, что происходит", False)]
+    return [format_message(render_random('restart', user_name), False)]
+
+def send_responses(chat_id, responses, key=None):
+    """Планирует ответы; человеческую задержку серия уже отстояла в склейщике"""
+    if not responses:
+        return []
+    return send_multiple_messages(chat_id, responses, key=key)
+
+@profiled('pipeline')
+def flush_burst(chat_id, burst):
+    """Применяет серию сообщений чата одним прогоном в одной транзакции
+
+    Сообщения берутся из журнала, а не из burst: там и сообщения этого
+    чата, принятые другими воркерами. Их серии найдут журнал пустым.
+    """
+    with span('outbox_claim'):
+        claimed = outbox.claim_messages(chat_id)
+    if not claimed:
+        return
+    # [user_name, текст, update_id]; порядок задает update_id, а не порядок прихода
+    messages = sorted((json.loads(text) for _, text in claimed), key=lambda m: (m[2] is None, m[2] or 0))
+    logger.info("⏰ Чат %s: серия из %d сообщ. отстояла задержку", chat_id, len(messages), extra={'event': 'delay'})
+    
+    user_name = messages[-1][0]
+    try:
+        responses, update_id = handle_user_message(chat_id, user_name, [(m[2], m[1]) for m in messages])
+        key = str(update_id) if update_id is not None else None
+        with span('schedule'):
+            send_responses(chat_id, responses, key)
+    except Exception:
+        # Сообщения возвращаются в журнал: их подберет следующая серия чата
+        # или adopt() после рестарта. Уже примененные пропустит advance_update_id
+        outbox.release([key for key, _ in claimed])
+        raise
+    for key, _ in claimed:
+        outbox.sent(key)
+
+# Серия сообщений подряд обрабатывается один раз: через человеческую задержку
+# после первого сообщения и не раньше COALESCE_QUIET секунд после последнего
+coalescer = BurstCoalescer(
+    delivery_scheduler,
+    flush_burst,
+    hold=burst_hold,
+    quiet=float(os.environ.get('COALESCE_QUIET', 5))
+)
+
+def process_update(data):
+    """Принимает апдейт в потоке пула ingest_queue и добавляет его в серию чата"""
+    message_text = data['message']['text'].strip()
+    chat_id = data['message']['chat']['id']
+    user_name = data['message']['from'].get('first_name', 'друг')
+    
+    logger.info("👤 %s: %s", user_name, message_text, extra={'event': 'incoming'})
+    
+    # Показываем печать
+    show_typing(chat_id)
+    
+    # Пока серия копится, сообщение лежит в outbox: рестарт его не потеряет
+    update_id = data.get('update_id')
+    key = f"msg:{update_id if update_id is not None else uuid.uuid4().hex}"
+    outbox.add(key, chat_id, json.dumps([user_name, message_text, update_id], ensure_ascii=False), time.time(), MESSAGE)
+    coalescer.add(chat_id, user_name, message_text, update_id)
+
+def update_chat_id(data):
+    return data['message']['chat']['id']
+
+# Webhook только ставит апдейт в очередь, обработка идет в пуле потоков.
+# У каждого чата свой почтовый ящик: его апдейты обрабатываются по порядку
+# и одним потоком за раз, разные чаты - параллельно. Это порядок внутри
+# воркера; между воркерами его держит update_id (advance_update_id)
+ingest_queue = MailboxQueue(
+    process_update,
+    update_chat_id,
+    workers=int(os.environ.get('INGEST_WORKERS', 4)),
+    maxsize=int(os.environ.get('INGEST_QUEUE_SIZE', 1000)),
+    policy=os.environ.get('INGEST_POLICY', 'block'),
+    block_timeout=float(os.environ.get('INGEST_BLOCK_TIMEOUT', 5))
+)
+
+def accept_update(data):
+    """Дедупликация и постановка апдейта в очередь (общая для webhook и long polling)"""
+    if traffic_recorder is not None:
+        with span('record'):
+            traffic_recorder.record(data)
+    
+    # Получаем update_id для дедупликации
+    update_id = data.get('update_id')
+    
+    if 'message' not in data or 'text' not in data['message']:
+        updates_total.inc('ignored')
+        return 'ignored'
+    
+    # Проверяем и отмечаем update_id одним действием
+    with span('dedup'):
+        duplicate = is_update_processed(update_id)
+    if duplicate:
+        logger.info("⏭️ Пропускаем дубликат: %.30s...", data['message']['text'], extra={'event': 'duplicate'})
+        updates_total.inc('skipped_duplicate')
+        return 'skipped_duplicate'
+    
+    with span('submit'):
+        submitted = ingest_queue.submit(data)
+    if not submitted:
+        # Отказ: снимаем отметку, чтобы повтор от Telegram не счелся дубликатом
+        update_dedup.forget(update_id)
+        logger.warning("🚦 Очередь переполнена, отказ для update_id %s", update_id)
+        updates_total.inc('overloaded')
+        return 'overloaded'
+    
+    updates_total.inc('queued')
+    return 'queued'
+
+# Ответы, которые не успели уйти до перезапуска, планируются заново.
+# Воркер забирает только записи умерших процессов: ответы живых соседей
+# (и их статус 'печатает') остаются у них
+replay_outbox()
 
 @app.route('/webhook', methods=['POST'])
 def webhook():
-    """Основной webhook с дедупликацией"""
+    """Основной webhook: дедупликация, постановка в очередь и сразу 200"""
+    with webhook_latency.time():
+        return _webhook()
+
+@profiled('webhook')
+def _webhook():
     try:
-        data = request.get_json()
+        with span('parse_json'):
+            data = request.get_json()
         if not data:
             return jsonify({"status": "error"}), 400
         
-        # Получаем update_id для дедупликации
-        update_id = data.get('update_id')
-        
-        if 'message' in data and 'text' in data['message']:
-            message_text = data['message']['text'].strip()
-            chat_id = data['message']['chat']['id']
-            user_name = data['message']['from'].get('first_name', 'друг')
-            
-            # Создаем уникальный хеш сообщения
-            message_hash = get_message_hash(chat_id, message_text, update_id)
-            
-            # Проверяем, не обрабатывали ли уже это сообщение
-            if is_message_processed(message_hash):
-                logger.info(f"⏭️ Пропускаем дубликат: {message_text[:30]}...")
-                return jsonify({"status": "skipped_duplicate"}), 200
-            
-            # Отмечаем сообщение как обработанное
-            mark_message_processed(message_hash)
-            
-            logger.info(f"👤 {user_name}: {message_text}")
-            
-            # Показываем печать
-            show_typing(chat_id)
-            
-            # Обрабатываем сообщение
-            responses = process_user_message(chat_id, user_name, message_text)
-            
-            # Отправляем ответы
-            if responses:
-                # Добавляем ответы в историю
-                state = get_conversation_state(chat_id)
-                for resp in responses:
-                    add_to_response_history(chat_id, resp)
-                
-                if len(responses) == 1:
-                    send_message_with_delay(chat_id, responses[0])
-                else:
-                    send_multiple_messages(chat_id, responses)
-            
+        with span('accept_update'):
+            status = accept_update(data)
+        if status == 'overloaded':
+            return jsonify({"status": status}), 503
+        if status == 'ignored':
             return jsonify({"status": "success"}), 200
-        
-        return jsonify({"status": "success"}), 200
+        return jsonify({"status": status}), 200
         
     except Exception as e:
-        logger.error(f"🚨 Ошибка: {e}")
+        logger.error("🚨 Ошибка: %s", e)
         return jsonify({"status": "error"}), 400
 
 @app.route('/set_webhook', methods=['GET'])
@@ -575,8 +650,7 @@ def set_webhook():
             return jsonify({"error": "BOT_TOKEN не установлен"}), 400
         
         webhook_url = request.host_url.rstrip('/') + '/webhook'
-        telegram_url = f"https://api.telegram.org/bot{BOT_TOKEN}/setWebhook"
-        response = requests.post(telegram_url, json={'url': webhook_url})
+        response = telegram.set_webhook(webhook_url)
         
         return jsonify({
             "success": response.status_code == 200,
@@ -586,26 +660,128 @@ def set_webhook():
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
+def parse_chat_id(value):
+    """chat_id из query string или пути (в хранилищах ключи - int); None, если не число"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def conversation_summary(chat_id, state, now=None):
+    """Сводка диалога для админки вместо сырого состояния"""
+    now = time.time() if now is None else now
+    return {
+        "chat_id": chat_id,
+        "stage": state.stage,
+        "user_name": state.user_name,
+        "problem_type": state.problem_type,
+        "message_count": state.message_count,
+        "waiting_for_payment": state['waiting_for_payment'],
+        "recent_responses": len(state.recent_responses()),
+        "idle_seconds": round(now - state.last_message_time, 1),
+        "conversation_start": state.conversation_start
+    }
+
+# Админские запросы не должны мешать webhook: страница ограничена по размеру
+# и по числу просмотренных диалогов
+ADMIN_PAGE_LIMIT = int(os.environ.get('ADMIN_PAGE_LIMIT', 1000))
+ADMIN_MAX_SCAN = int(os.environ.get('ADMIN_MAX_SCAN', 10000))
+
 @app.route('/debug', methods=['GET'])
 def debug():
-    """Страница отладки"""
-    chat_id = request.args.get('chat_id')
-    
-    if chat_id and chat_id in conversations:
-        state = conversations[chat_id]
-        return jsonify({
-            "chat_id": chat_id,
-            "state": state,
-            "message_history": message_history.get(chat_id, {}),
-            "processed_messages_count": len(processed_messages)
-        })
+    """Страница отладки: только счетчики, без прохода по чатам"""
+    if request.args.get('chat_id') is not None:
+        chat_id = parse_chat_id(request.args.get('chat_id'))
+        if chat_id is None:
+            return jsonify({"error": "chat_id должен быть числом"}), 400
+        state = get_conversation_state(chat_id)
+        if state is None:
+            return jsonify({"error": "чат не найден", "chat_id": chat_id}), 404
+        return jsonify(conversation_summary(chat_id, state))
     
     return jsonify({
-        "active_chats": len(conversations),
-        "processed_messages": len(processed_messages),
-        "message_history_size": sum(len(v) for v in message_history.values())
+        "active_chats": len(conversation_store),
+        "stages": conversation_store.stage_counts(),
+        "dedup": update_dedup.stats(),
+        "ingest_queue": ingest_queue.stats(),
+        "delivery_scheduler": delivery_scheduler.stats(),
+        "outbox": outbox.stats(),
+        "coalescer": coalescer.stats(),
+        "typing": typing_status.stats(),
+        "logging": log_config.stats(),
+        "conversation_store": conversation_store.stats()
     })
 
+@app.route('/admin/conversations', methods=['GET'])
+def admin_conversations():
+    """Диалоги по возрастанию chat_id потоком NDJSON, страница за страницей
+
+    Параметры: stage, idle (молчат не меньше N секунд), cursor (next_cursor
+    прошлой страницы), limit. За запрос просматривается не больше
+    ADMIN_MAX_SCAN диалогов. Последняя строка - {"next_cursor": ...};
+    null означает, что обход закончен.
+    """
+    stage = request.args.get('stage')
+    if stage is not None and stage not in STAGE_NAMES:
+        return jsonify({"error": f"неизвестная стадия, есть: {', '.join(STAGE_NAMES)}"}), 400
+    try:
+        idle = request.args.get('idle')
+        idle = float(idle) if idle else None
+        limit = max(1, min(int(request.args.get('limit', 100)), ADMIN_PAGE_LIMIT))
+        cursor = request.args.get('cursor')
+        cursor = int(cursor) if cursor else None
+    except ValueError:
+        return jsonify({"error": "idle, limit и cursor должны быть числами"}), 400
+
+    def generate():
+        now = time.time()
+        scanned = matched = 0
+        last = None
+        finished = True
+        for chat_id, state in conversation_store.scan(after=cursor):
+            scanned += 1
+            last = chat_id
+            if (stage is None or state.stage == stage) and (idle is None or now - state.last_message_time >= idle):
+                matched += 1
+                yield json.dumps(conversation_summary(chat_id, state, now), ensure_ascii=False) + '\n'
+            if matched >= limit or scanned >= ADMIN_MAX_SCAN:
+                finished = False
+                break
+        yield json.dumps({
+            "next_cursor": None if finished else last,
+            "scanned": scanned,
+            "matched": matched
+        }) + '\n'
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+@app.route('/admin/conversations/<chat_id>', methods=['GET'])
+def admin_conversation(chat_id):
+    """Сводка одного диалога"""
+    parsed = parse_chat_id(chat_id)
+    if parsed is None:
+        return jsonify({"error": "chat_id должен быть числом"}), 400
+    state = get_conversation_state(parsed)
+    if state is None:
+        return jsonify({"error": "чат не найден", "chat_id": parsed}), 404
+    return jsonify(conversation_summary(parsed, state))
+
+@app.route('/profile', methods=['GET'])
+def profile():
+    """Профилировать следующие N вызовов этого воркера (нужен PROFILING=1)"""
+    if not profiling.ENABLED:
+        return jsonify({"error": "профилирование выключено, задайте PROFILING=1"}), 404
+    try:
+        count = int(request.args.get('next', profiling.TRIGGER_COUNT))
+    except ValueError:
+        return jsonify({"error": "next должен быть числом"}), 400
+    return jsonify({"pid": os.getpid(), "pending": profiling.trigger(count), "dir": profiling.PROFILE_DIR})
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Метрики в формате Prometheus, сумма по всем воркерам"""
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
 @app.route('/')
 def home():
     return jsonify({
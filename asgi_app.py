@@ -0,0 +1,254 @@
+"""asyncio/ASGI-режим webhook и отправки
+
+Запуск:
+    uvicorn asgi_app:app --host 0.0.0.0 --port 10000
+
+Логика диалога та же, что в app.py, но ожидание не занимает потоки:
+человеческие задержки - это таймеры event loop (loop.call_at), а запросы
+к Bot API идут через неблокирующий httpx. Один процесс держит десятки
+тысяч диалогов в ожидании ответа. Flask-версия (gunicorn app:app)
+остается режимом совместимости.
+
+Ответы пишутся в тот же outbox, что и в app.py; то, что не ушло до
+перезапуска, при импорте app проигрывает его планировщик. Вызовы outbox
+и хранилища состояний, которые ходят на диск, выполняются в отдельном
+пуле потоков, а не в event loop.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import app as core
+from metrics import CONTENT_TYPE, REGISTRY
+from telegram_client import AsyncTelegramClient
+
+logger = logging.getLogger(__name__)
+
+# SQLite outbox, SQLite/Postgres и выселение на диск блокируют поток:
+# такие вызовы идут в этот пул, чтобы event loop не ждал диска
+blocking_io = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('ASGI_IO_WORKERS', 8)),
+    thread_name_prefix='asgi-io'
+)
+
+
+async def run_blocking(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(blocking_io, func, *args)
+
+
+def plan_replies(responses):
+    """Расписание ответов: один ответ - с человеческой задержкой, серия - с паузами
+
+    Здесь сообщения не копятся в серии, так что задержку ответа
+    выбирает сам план, а не склейщик.
+    """
+    if len(responses) == 1:
+        delay = core.get_human_delay()
+        logger.info("⏰ Задержка: %s сек для: %.40s...", delay, responses[0], extra={'event': 'delay'})
+        return core.plan_sequence(responses, delay)
+    return core.plan_sequence(responses)
+
+
+REGISTRY.gauge(
+    'tarot_async_delivery_pending',
+    'Отправки на таймерах event loop',
+    lambda: delivery.pending if delivery is not None else 0
+)
+
+
+class AsyncDelivery:
+    """Отложенные отправки на таймерах event loop"""
+
+    def __init__(self, client):
+        self.client = client
+        self.pending = 0
+        self._tasks = set()
+
+    async def schedule(self, chat_id, plan, key=None):
+        """Записывает расписание из plan_replies в outbox и ставит на таймеры"""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        wall = time.time()
+        key = key or uuid.uuid4().hex
+        entries = [(f"{key}:{i}", chat_id, text, wall + send_at) for i, (_, send_at, text) in enumerate(plan)]
+        # add() только кладет в буфер, но ждет замок, пока поток outbox фиксирует пачку
+        await run_blocking(self._record, entries)
+        for (entry_key, _, _, _), (typing_at, send_at, text) in zip(entries, plan):
+            self.pending += 2
+            loop.call_at(now + typing_at, self._fire, self._send_typing, chat_id)
+            loop.call_at(now + send_at, self._fire, self._send_message, entry_key, chat_id, text)
+
+    @staticmethod
+    def _record(entries):
+        for entry in entries:
+            core.outbox.add(*entry)
+
+    def show_typing(self, chat_id):
+        self.pending += 1
+        asyncio.get_running_loop().call_soon(self._fire, self._send_typing, chat_id)
+
+    def _fire(self, func, *args):
+        # Корутина создается только в момент срабатывания таймера
+        self.pending -= 1
+        task = asyncio.ensure_future(func(*args))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send_typing(self, chat_id):
+        try:
+            await self.client.send_chat_action(chat_id)
+        except Exception:
+            pass
+
+    async def _send_message(self, key, chat_id, text):
+        if not await run_blocking(core.outbox.claim, key):
+            return
+        try:
+            response = await self.client.send_message(chat_id, text)
+            if response.status_code != 200:
+                logger.error("❌ Ошибка отправки: %s", response.text)
+        except Exception as e:
+            logger.error("Ошибка отправки: %s", e)
+        await run_blocking(core.outbox.sent, key)
+
+    def stats(self):
+        return {"pending": self.pending, "in_flight": len(self._tasks)}
+
+
+delivery = None
+
+
+async def handle_webhook(data):
+    """Дедупликация, обработка и планирование ответа без блокировок"""
+    if core.traffic_recorder is not None:
+        core.traffic_recorder.record(data)
+    update_id = data.get('update_id')
+
+    if 'message' not in data or 'text' not in data['message']:
+        core.updates_total.inc('ignored')
+        return {"status": "success"}
+
+    if core.is_update_processed(update_id):
+        logger.info("⏭️ Пропускаем дубликат: %.30s...", data['message']['text'], extra={'event': 'duplicate'})
+        core.updates_total.inc('skipped_duplicate')
+        return {"status": "skipped_duplicate"}
+
+    core.updates_total.inc('queued')
+
+    message_text = data['message']['text'].strip()
+    chat_id = data['message']['chat']['id']
+    user_name = data['message']['from'].get('first_name', 'друг')
+    logger.info("👤 %s: %s", user_name, message_text, extra={'event': 'incoming'})
+
+    delivery.show_typing(chat_id)
+
+    messages = [(update_id, message_text)]
+    if core.conversation_store.blocking:
+        responses, applied = await run_blocking(core.handle_user_message, chat_id, user_name, messages)
+    else:
+        responses, applied = core.handle_user_message(chat_id, user_name, messages)
+
+    if responses:
+        key = str(applied) if applied is not None else None
+        await delivery.schedule(chat_id, plan_replies(responses), key)
+    return {"status": "success"}
+
+
+async def send_text(send, status, text, content_type):
+    body = text.encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type.encode()), (b'content-length', str(len(body)).encode())]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def send_json(send, status, payload):
+    body = json.dumps(payload, ensure_ascii=False).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def lifespan(receive, send):
+    global delivery
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Один RateLimiter на процесс: его делят этот клиент и проигрыш outbox в потоках core
+            delivery = AsyncDelivery(AsyncTelegramClient(core.BOT_TOKEN, rate_limiter=core.rate_limiter))
+            logger.info("🚀 Бот запущен в asyncio-режиме")
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await delivery.client.aclose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI-приложение"""
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    method, path = scope['method'], scope['path']
+    try:
+        if path == '/webhook' and method == 'POST':
+            try:
+                data = json.loads(await read_body(receive) or b'null')
+            except ValueError:
+                data = None
+            if not data:
+                await send_json(send, 400, {"status": "error"})
+                return
+            with core.webhook_latency.time():
+                result = await handle_webhook(data)
+            await send_json(send, 200, result)
+
+        elif path == '/set_webhook' and method == 'GET':
+            headers = dict(scope['headers'])
+            host = headers.get(b'host', b'').decode()
+            webhook_url = f"https://{host}/webhook"
+            response = await delivery.client.set_webhook(webhook_url)
+            await send_json(send, 200, {"success": response.status_code == 200, "webhook_url": webhook_url})
+
+        elif path == '/debug' and method == 'GET':
+            await send_json(send, 200, {
+                "mode": "asyncio",
+                "active_chats": await run_blocking(len, core.conversation_store),
+                "delivery": delivery.stats(),
+                "conversation_store": await run_blocking(core.conversation_store.stats)
+            })
+
+        elif path == '/metrics' and method == 'GET':
+            # Сборка читает снимки всех воркеров с диска
+            await send_text(send, 200, await run_blocking(REGISTRY.render), CONTENT_TYPE)
+
+        elif path == '/' and method == 'GET':
+            await send_json(send, 200, {"status": "active", "bot": "@Tarotyour_bot", "mode": "asyncio"})
+
+        else:
+            await send_json(send, 404, {"status": "not_found"})
+
+    except Exception as e:
+        logger.error("🚨 Ошибка: %s", e)
+        await send_json(send, 400, {"status": "error"})
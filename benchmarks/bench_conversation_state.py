@@ -0,0 +1,76 @@
+"""Память на один чат: прежний словарь состояния против ConversationState
+
+Запуск из корня репозитория:
+    python benchmarks/bench_conversation_state.py --chats 100000
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from conversation_state import ConversationState
+
+RESPONSES = [
+    "понимаю, Аня... сердечные вопросы всегда такие глубокие",
+    "что самое важное для тебя в этих отношениях",
+    "знаешь, Аня, карты часто помогают увидеть то, что скрыто",
+]
+
+
+def legacy_state():
+    """Состояние в прежнем формате app.py"""
+    state = {
+        'stage': 'awaiting_problem',
+        'user_name': '',
+        'problem': '',
+        'problem_type': '',
+        'trust_level': 0,
+        'message_count': 0,
+        'last_message_time': time.time(),
+        'payment_offered': False,
+        'payment_link_sent': False,
+        'waiting_for_payment': False,
+        'conversation_start': time.time(),
+        'greeted': False,
+        'last_responses': [],
+        'message_queue': []
+    }
+    for text in RESPONSES:
+        state['last_responses'].append({'text': text[:50], 'time': time.time()})
+    return state
+
+
+def slotted_state():
+    state = ConversationState()
+    for text in RESPONSES:
+        state.remember_response(text)
+    return state
+
+
+def measure(factory, chats):
+    tracemalloc.start()
+    states = [factory() for _ in range(chats)]
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del states
+    return current / chats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--chats', type=int, default=100000)
+    args = parser.parse_args()
+
+    legacy = measure(legacy_state, args.chats)
+    slotted = measure(slotted_state, args.chats)
+    print(f"словарь:           {legacy:7.0f} байт/чат")
+    print(f"ConversationState: {slotted:7.0f} байт/чат")
+    print(f"экономия:          {(1 - slotted / legacy) * 100:6.1f}%")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""История раскладов SimpleDB: полный проход против индекса по пользователю
+
+Запуск из корня репозитория:
+    python benchmarks/bench_database.py --readings 1000000 --users 10000
+
+В базу записывается --readings раскладов для --users пользователей, затем
+сравниваются выборки "последние 10 раскладов пользователя": прежняя
+реализация (скопирована из database.py до индекса) проходит по всем
+раскладам и сортирует по ISO-строке, новая берет хвост списка
+пользователя. Отдельно замеряется выборка за период через bisect.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from database import SimpleDB
+
+CARD = {"name": "🌟 Звезда", "meaning": "Надежда, вдохновение, исцеление", "reversed": False}
+
+
+def legacy_get_user_readings(readings, user_id, limit=10):
+    user_readings = []
+    for reading_id, reading in readings.items():
+        if reading['user_id'] == user_id:
+            user_readings.append(reading)
+    user_readings.sort(key=lambda x: x['timestamp'], reverse=True)
+    return user_readings[:limit]
+
+
+def per_call(func, calls):
+    started = time.perf_counter()
+    for args in calls:
+        func(*args)
+    return (time.perf_counter() - started) / len(calls)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SimpleDB: полный проход против индекса")
+    parser.add_argument('--readings', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--legacy-calls', type=int, default=10)
+    parser.add_argument('--calls', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    db = SimpleDB()
+    started = time.perf_counter()
+    for _ in range(args.readings):
+        db.save_reading(rnd.randrange(args.users), "что меня ждет", CARD, "время надеяться")
+    print(f"Записано {args.readings} раскладов для {args.users} пользователей за {time.perf_counter() - started:.1f} сек")
+
+    users = [rnd.randrange(args.users) for _ in range(args.calls)]
+
+    # Проверяем, что обе версии отдают одно и то же
+    for user_id in users[:args.legacy_calls]:
+        legacy = legacy_get_user_readings(db.readings, user_id)
+        current = db.get_user_readings(user_id)
+        assert [r['ts'] for r in legacy] == [r['ts'] for r in current], user_id
+
+    legacy = per_call(lambda user_id: legacy_get_user_readings(db.readings, user_id), [(u,) for u in users[:args.legacy_calls]])
+    latest = per_call(db.get_user_readings, [(u,) for u in users])
+
+    first = min(r['ts'] for r in db.get_user_readings_between(users[0]))
+    last = max(r['ts'] for r in db.get_user_readings_between(users[0]))
+    windows = []
+    for user_id in users:
+        since = rnd.uniform(first, last)
+        windows.append((user_id, since, since + (last - first) / 10))
+    between = per_call(db.get_user_readings_between, windows)
+
+    print(f"{'выборка':<34} {'мкс/вызов':>12}")
+    print(f"{'последние 10, полный проход':<34} {legacy * 1e6:>12.1f}")
+    print(f"{'последние 10, индекс':<34} {latest * 1e6:>12.2f}")
+    print(f"{'период (10% истории), bisect':<34} {between * 1e6:>12.2f}")
+    print(f"Ускорение последних 10: {legacy / latest:.0f}x")
+
+
+if __name__ == '__main__':
+    main()
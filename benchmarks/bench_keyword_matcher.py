@@ -0,0 +1,143 @@
+"""Классификация сообщений: прежние линейные проверки против KeywordMatcher
+
+Запуск из корня репозитория:
+    python benchmarks/bench_keyword_matcher.py --rounds 2000
+
+Обе версии считают все признаки, которые нужны process_user_message:
+проблема ли это, тип проблемы и ключевые слова стадий воронки.
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from keyword_matcher import PROBLEM_TYPES, matcher
+
+CORPUS = [
+    "привет",
+    "/start",
+    "да",
+    "ну не знаю",
+    "Здравствуйте! У меня сложная ситуация на работе, начальник постоянно придирается и я не знаю что делать",
+    "Хочу узнать про отношения с парнем, мы уже 3 года вместе а он не делает предложение",
+    "Сколько стоит расклад?",
+    "Давай, я готова",
+    "оплатила, перевела только что",
+    "Меня беспокоит здоровье мамы, врачи ничего толком не говорят, я очень устала",
+    "Стоит ли брать кредит на бизнес или лучше подождать?",
+    "Не могу выбрать между двумя предложениями о работе, сомневаюсь",
+    "спасибо",
+    "а можно подробнее?",
+    "Мы с мужем постоянно ругаемся из-за денег, что делать?",
+    "интересно, а как это работает",
+    "Я боюсь, что коллеги меня подставят на проекте",
+    "ок",
+    "990 это нормально, куплю",
+    "Подскажите, когда лучше менять работу? Зарплата маленькая",
+]
+
+
+# --- Прежняя реализация (скопирована из app.py до KeywordMatcher) ---
+
+def legacy_is_problem_message(message):
+    if not message or len(message) < 10:
+        return False
+    message_lower = message.lower()
+    if message_lower.startswith('/'):
+        return False
+    problem_keywords = [
+        'не могу', 'не знаю', 'проблем', 'ситуац', 'трудност', 'сложност',
+        'боюсь', 'страшно', 'волнуюсь', 'переживаю', 'хочу понять',
+        'как быть', 'что делать', 'помогите', 'совет', 'мне нужн', 'у меня',
+        'хочу узнать', 'интересно', 'скажите', 'подскажите'
+    ]
+    for keyword in problem_keywords:
+        if keyword in message_lower:
+            return True
+    if '?' in message and len(message) > 15:
+        return True
+    return False
+
+
+def legacy_analyze_problem_type(message):
+    message_lower = message.lower()
+    if any(word in message_lower for word in ['девушк', 'парн', 'мужчин', 'женщин', 'любов', 'отношен', 'семь', 'брак']):
+        return 'отношения'
+    elif any(word in message_lower for word in ['работ', 'карьер', 'начальник', 'коллег', 'зарплат', 'офис', 'проект']):
+        return 'работа'
+    elif any(word in message_lower for word in ['деньг', 'финанс', 'долг', 'кредит', 'заработ', 'бизнес', 'куп']):
+        return 'деньги'
+    elif any(word in message_lower for word in ['здоров', 'болезн', 'боль', 'врач', 'лечен', 'энерг', 'устал']):
+        return 'здоровье'
+    elif any(word in message_lower for word in ['выбор', 'решен', 'сомнен', 'не уверен', 'не знаю как']):
+        return 'выбор'
+    else:
+        return 'общая'
+
+
+def legacy_classify(message):
+    message_lower = message.lower()
+    positive_words = ['да', 'хочу', 'готов', 'соглас', 'интересно', 'можно', 'попробую', 'давай']
+    return (
+        legacy_is_problem_message(message),
+        legacy_analyze_problem_type(message),
+        any(word in message_lower for word in positive_words),
+        'сколько' in message_lower or 'цена' in message_lower or 'стоимость' in message_lower or '990' in message_lower,
+        'готов' in message_lower or 'куплю' in message_lower or 'оплат' in message_lower,
+        any(word in message_lower for word in ['готов', 'давай', 'хочу', 'куплю', 'оплат']),
+        'оплат' in message_lower or 'перевел' in message_lower or 'сделал' in message_lower or 'оплатил' in message_lower,
+    )
+
+
+# --- Новая реализация ---
+
+def matcher_classify(message):
+    categories = matcher.match(message)
+    is_problem = False
+    if message and len(message) >= 10 and not message.startswith('/'):
+        is_problem = 'problem' in categories or ('?' in message and len(message) > 15)
+    problem_type = 'общая'
+    for candidate in PROBLEM_TYPES:
+        if candidate in categories:
+            problem_type = candidate
+            break
+    return (
+        is_problem,
+        problem_type,
+        'positive' in categories,
+        'price' in categories,
+        'purchase' in categories,
+        'ready' in categories,
+        'paid' in categories,
+    )
+
+
+def bench(classify, rounds):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for message in CORPUS:
+            classify(message)
+    elapsed = time.perf_counter() - started
+    return elapsed / (rounds * len(CORPUS)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rounds', type=int, default=2000)
+    args = parser.parse_args()
+
+    for message in CORPUS:
+        assert legacy_classify(message) == matcher_classify(message), message
+
+    legacy = bench(legacy_classify, args.rounds)
+    new = bench(matcher_classify, args.rounds)
+    print(f"линейные проверки: {legacy:6.2f} мкс/сообщение")
+    print(f"KeywordMatcher:    {new:6.2f} мкс/сообщение")
+    print(f"ускорение:         {legacy / new:6.2f}x")
+
+
+if __name__ == '__main__':
+    main()
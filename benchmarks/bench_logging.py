@@ -0,0 +1,183 @@
+"""Пропускная способность webhook при разных настройках логирования
+
+Запуск из корня репозитория:
+    python benchmarks/bench_logging.py --updates 3000 --drain-delay 20
+
+Для каждого режима бот поднимается в отдельном процессе, а его stderr
+читает этот процесс с паузой --drain-delay мс между чтениями по 4 КБ -
+так ведет себя медленный pipe stdout на Render. Апдейты отправляются в
+app.app через тестовый клиент Flask из нескольких потоков, каждый в свой
+чат; серия обрабатывается сразу (COALESCE_QUIET=0, HUMAN_DELAY_SCALE=0), Bot API заменен
+заглушкой. Измеряется время до приема всех апдейтов webhook'ом и до
+завершения их обработки.
+
+Режимы:
+    off      LOG_LEVEL=OFF
+    sync     LOG_ASYNC=0 - запись в stderr из потоков обработки, как раньше
+    async    QueueHandler/QueueListener
+    sampled  async и LOG_SAMPLE для частых событий
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    'off': {'LOG_LEVEL': 'OFF'},
+    'sync': {'LOG_ASYNC': '0'},
+    'async': {'LOG_ASYNC': '1'},
+    'sampled': {'LOG_ASYNC': '1', 'LOG_SAMPLE': 'incoming=0.05,stage=0.05,delay=0.05,duplicate=0.05'},
+}
+
+
+class NullResponse:
+    status_code = 200
+    text = '{"ok":true}'
+
+    def json(self):
+        return {"ok": True}
+
+
+class NullTelegram:
+    """Bot API без сети: время уходит только на код бота и логи"""
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: NullResponse()
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+def run_child(args):
+    """Прогон в дочернем процессе: результат - JSON в stdout"""
+    sys.path.insert(0, ROOT)
+    import app
+    app.telegram = NullTelegram()
+    client = app.app.test_client()
+
+    latencies = []
+    lock = threading.Lock()
+    per_thread = args.updates // args.threads
+
+    def sender(offset):
+        local = []
+        for i in range(per_thread):
+            update_id = offset * per_thread + i + 1
+            update = {
+                "update_id": update_id,
+                "message": {
+                    "text": "у меня проблемы на работе, начальник придирается",
+                    "chat": {"id": update_id},
+                    "from": {"first_name": "Аня"}
+                }
+            }
+            started = time.perf_counter()
+            client.post('/webhook', json=update)
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=sender, args=(n,)) for n in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    accepted = time.perf_counter() - started
+
+    total = per_thread * args.threads
+    deadline = time.monotonic() + 120
+    while app.coalescer.stats()['flushes'] < total and time.monotonic() < deadline:
+        time.sleep(0.01)
+    processed = time.perf_counter() - started
+
+    print(json.dumps({
+        "updates": total,
+        "accepted_s": accepted,
+        "processed_s": processed,
+        "flushes": app.coalescer.stats()['flushes'],
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "logging": app.log_config.stats()
+    }))
+    sys.stdout.flush()
+    # Не ждем, пока медленный читатель вычерпает остаток логов
+    os._exit(0)
+
+
+def run_mode(mode, args):
+    tmp = tempfile.mkdtemp(prefix='bench_logging_')
+    env = dict(os.environ)
+    env.update(MODES[mode])
+    env.update({
+        'BOT_TOKEN': 'bench',
+        'OUTBOX_PATH': os.path.join(tmp, 'outbox.db'),
+        'DEDUP_PATH': os.path.join(tmp, 'updates.dedup'),
+        'METRICS_DIR': os.path.join(tmp, 'metrics'),
+        'COALESCE_QUIET': '0',
+        'HUMAN_DELAY_SCALE': '0',
+        'INGEST_POLICY': 'block',
+        'INGEST_BLOCK_TIMEOUT': '60',
+    })
+    command = [sys.executable, os.path.abspath(__file__), '--child',
+               '--updates', str(args.updates), '--threads', str(args.threads)]
+    process = subprocess.Popen(command, env=env, cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    log_bytes = [0]
+
+    def drain():
+        # Медленный потребитель логов
+        while True:
+            chunk = process.stderr.read1(4096) if hasattr(process.stderr, 'read1') else process.stderr.read(4096)
+            if not chunk:
+                return
+            log_bytes[0] += len(chunk)
+            if args.drain_delay:
+                time.sleep(args.drain_delay / 1000)
+
+    reader = threading.Thread(target=drain, daemon=True)
+    reader.start()
+    output = process.stdout.read()
+    process.wait()
+    try:
+        result = json.loads(output.decode().strip().splitlines()[-1])
+    except (ValueError, IndexError):
+        raise RuntimeError(f"Режим {mode}: дочерний процесс не вернул результат")
+    result['log_kb_read'] = log_bytes[0] // 1024
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Webhook при разных настройках логирования")
+    parser.add_argument('--updates', type=int, default=3000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--drain-delay', type=float, default=20.0, help="пауза читателя stderr между чтениями по 4 КБ, мс")
+    parser.add_argument('--modes', default='off,sync,async,sampled')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    print(f"Апдейтов: {args.updates}, потоков: {args.threads}, читатель stderr: 4 КБ / {args.drain_delay} мс")
+    print(f"{'режим':<8} {'прием, ап/с':>12} {'обработка, ап/с':>16} {'p50, мс':>9} {'p99, мс':>9} {'отброшено':>10}")
+    for mode in args.modes.split(','):
+        result = run_mode(mode, args)
+        print(
+            f"{mode:<8} {result['updates'] / result['accepted_s']:>12.0f} "
+            f"{result['flushes'] / result['processed_s']:>16.0f} "
+            f"{result['p50_ms']:>9.2f} {result['p99_ms']:>9.2f} {result['logging']['dropped']:>10}"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""SqliteDB под непрерывной записью: групповой коммит против коммита на вызов
+
+Запуск из корня репозитория:
+    python benchmarks/bench_sqlite_db.py --seconds 5 --threads 8
+
+Потоки-"webhook'и" в течение --seconds секунд без пауз вызывают
+save_reading и save_conversation. Сравниваются:
+    per-call sync=FULL    INSERT и COMMIT в каждом вызове, как без буфера
+    per-call sync=NORMAL  то же в WAL без fsync на каждый коммит
+    group                 SqliteDB: буфер и поток-писатель
+Для каждого варианта - записей в секунду с учетом финального flush,
+число коммитов и задержка самого вызова на пути webhook'а (p50/p99).
+Строки в базе не считаются: история обрезается до CONVERSATION_LIMIT.
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import database
+from database import SqliteDB
+
+CARD = {"name": "🌟 Звезда", "meaning": "Надежда, вдохновение, исцеление", "reversed": False}
+
+
+class PerCallDB:
+    """Та же схема, но каждая запись - своя транзакция под общим замком"""
+
+    def __init__(self, path, synchronous):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA synchronous={synchronous}")
+        for statement in database.SCHEMA:
+            self._conn.execute(statement)
+        self._ids = iter(range(1, 1 << 62))
+        self.commits = 0
+
+    def save_reading(self, user_id, question, card, interpretation):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute(database.INSERT_READING_SQL, (
+                str(next(self._ids)), user_id, time.time(), question,
+                json.dumps(card, ensure_ascii=False), interpretation))
+            self._conn.execute("COMMIT")
+            self.commits += 1
+
+    def save_conversation(self, user_id, role, content):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute(database.INSERT_MESSAGE_SQL, (user_id, time.time(), role, content))
+            self._conn.execute(database.PRUNE_MESSAGES_SQL, (user_id, database.CONVERSATION_LIMIT))
+            self._conn.execute("COMMIT")
+            self.commits += 1
+
+    def flush(self):
+        pass
+
+    def stats(self):
+        return {"commits": self.commits}
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+def run(db, args):
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.seconds
+    calls = [0]
+
+    def webhook(seed):
+        rnd = random.Random(seed)
+        local = []
+        while time.perf_counter() < deadline:
+            user_id = rnd.randrange(args.users)
+            started = time.perf_counter()
+            db.save_conversation(user_id, 'user', "у меня проблемы на работе")
+            db.save_reading(user_id, "что меня ждет", CARD, "время надеяться")
+            db.save_conversation(user_id, 'assistant', "карта говорит о надежде")
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+            calls[0] += 3 * len(local)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=webhook, args=(n,)) for n in range(args.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    db.flush()
+    elapsed = time.perf_counter() - started
+    return {
+        "calls": calls[0],
+        "commits": db.stats()['commits'],
+        "elapsed": elapsed,
+        "p50_us": percentile(latencies, 0.5) * 1e6,
+        "p99_us": percentile(latencies, 0.99) * 1e6,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SqliteDB: групповой коммит против коммита на вызов")
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--commit-interval', type=float, default=0.05)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix='bench_sqlite_db_')
+    variants = [
+        ("per-call sync=FULL", lambda path: PerCallDB(path, 'FULL')),
+        ("per-call sync=NORMAL", lambda path: PerCallDB(path, 'NORMAL')),
+        ("group", lambda path: SqliteDB(path, commit_interval=args.commit_interval)),
+    ]
+
+    print(f"Потоков: {args.threads}, {args.seconds} сек, на апдейт 3 записи (2 сообщения и расклад)")
+    print(f"{'вариант':<22} {'вызовов/с':>10} {'коммитов':>10} {'p50, мкс':>10} {'p99, мкс':>10}")
+    for name, factory in variants:
+        path = os.path.join(tmp, name.replace(' ', '_').replace('=', '_') + '.db')
+        db = factory(path)
+        result = run(db, args)
+        print(
+            f"{name:<22} {result['calls'] / result['elapsed']:>10.0f} "
+            f"{result['commits']:>10} "
+            f"{result['p50_us']:>10.1f} {result['p99_us']:>10.1f}"
+        )
+
+
+if __name__ == '__main__':
+    main()
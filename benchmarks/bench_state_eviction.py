@@ -0,0 +1,103 @@
+"""Память процесса при 1M чатов: MemoryStateStore против EvictingStateStore
+
+Запуск из корня репозитория:
+    python benchmarks/bench_state_eviction.py --chats 1000000
+
+Каждый режим запускается в отдельном процессе, чтобы RSS не смешивался.
+Активна только доля чатов --active, остальные молчат дольше idle_ttl.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def run_mode(mode, chats, active, idle_ttl):
+    os.environ.setdefault('BOT_TOKEN', 'bench')
+    os.environ.setdefault('DEDUP_PATH', os.path.join(tempfile.gettempdir(), 'bench.dedup'))
+    from app import new_conversation_state
+    from state_store import MemoryStateStore, EvictingStateStore
+
+    if mode == 'memory':
+        store = MemoryStateStore()
+    else:
+        spill = os.path.join(tempfile.gettempdir(), f"bench_spill_{os.getpid()}.db")
+        store = EvictingStateStore(spill, idle_ttl=idle_ttl, max_hot=chats)
+
+    rng = random.Random(1)
+    baseline = rss_mb()
+    now = time.time()
+    started = time.perf_counter()
+
+    # Большинство чатов давно молчат, активна только доля active.
+    # Сообщения приходят в порядке времени, как в реальной работе
+    timeline = sorted(
+        (now if rng.random() < active else now - idle_ttl - rng.uniform(1, 86400), chat_id)
+        for chat_id in range(chats)
+    )
+    for last_time, chat_id in timeline:
+        with store.transaction(chat_id, new_conversation_state) as state:
+            state['user_name'] = 'Пользователь'
+            state['message_count'] += 1
+            state.remember_response('понимаю, Пользователь... сердечные вопросы', last_time)
+            state['last_message_time'] = last_time
+    del timeline
+
+    fill_seconds = time.perf_counter() - started
+    result = {
+        "mode": mode,
+        "chats": chats,
+        "fill_seconds": round(fill_seconds, 1),
+        "rss_mb": round(rss_mb() - baseline, 1),
+        "store": store.stats()
+    }
+
+    # Сколько стоит поднять выселенный чат обратно
+    sample = [rng.randrange(chats) for _ in range(1000)]
+    started = time.perf_counter()
+    for chat_id in sample:
+        with store.transaction(chat_id, new_conversation_state) as state:
+            state['last_message_time'] = time.time()
+    result["rehydrate_us"] = round((time.perf_counter() - started) / len(sample) * 1e6, 1)
+    result["store_after_sample"] = store.stats()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--chats', type=int, default=1000000)
+    parser.add_argument('--active', type=float, default=0.01)
+    parser.add_argument('--idle-ttl', type=int, default=1800)
+    parser.add_argument('--mode', choices=['memory', 'evicting'])
+    args = parser.parse_args()
+
+    if args.mode:
+        print(json.dumps(run_mode(args.mode, args.chats, args.active, args.idle_ttl)))
+        return
+
+    for mode in ('memory', 'evicting'):
+        out = subprocess.run(
+            [sys.executable, __file__, '--mode', mode, '--chats', str(args.chats),
+             '--active', str(args.active), '--idle-ttl', str(args.idle_ttl)],
+            capture_output=True, text=True, check=True
+        ).stdout
+        print(out.strip().splitlines()[-1])
+
+
+if __name__ == '__main__':
+    main()
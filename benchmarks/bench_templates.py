@@ -0,0 +1,210 @@
+"""Генерация ответов: прежние словари f-строк против таблиц шаблонов
+
+Запуск из корня репозитория:
+    python benchmarks/bench_templates.py --rounds 20000
+
+Прогоняются генераторы ответов для всех стадий воронки, которые
+строили наборы вариантов на каждый вызов. Прежняя версия скопирована
+из app.py до templates.py; новая - сами функции app.py.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# app.py читает настройки из окружения при импорте
+TMP = tempfile.mkdtemp(prefix='bench_templates_')
+os.environ.setdefault('BOT_TOKEN', 'bench')
+os.environ['OUTBOX_PATH'] = os.path.join(TMP, 'outbox.db')
+os.environ['DEDUP_PATH'] = os.path.join(TMP, 'updates.dedup')
+
+import logging
+logging.disable(logging.INFO)
+
+import app
+from conversation_state import ConversationState, response_hash
+
+PROBLEMS = [
+    "у меня проблемы с парнем, не знаю что делать",
+    "начальник постоянно придирается на работе",
+    "не могу выбрать между двумя вариантами",
+    "меня беспокоит мое здоровье",
+    "хочу понять, что будет дальше",
+]
+NAMES = ["Аня", "Максим", "Ольга", "друг"]
+
+
+# --- Прежняя реализация (скопирована из app.py до таблиц шаблонов) ---
+
+def legacy_get_unique_response(responses, state):
+    if not responses:
+        return ""
+    for attempt in range(3):
+        response = random.choice(responses)
+        if not state.is_recent(response_hash(response), window=300):
+            return response
+    return random.choice(responses)
+
+
+def legacy_problem_response(problem_type, user_name, state):
+    empathy_responses = {
+        'отношения': [
+            f"понимаю, {user_name}... сердечные вопросы всегда такие глубокие",
+            f"ой, {user_name}, отношения... это всегда про самое важное",
+            f"чувствую, {user_name}, как это важно для тебя"
+        ],
+        'работа': [
+            f"{user_name}, рабочие вопросы часто бывают очень напряженными",
+            f"понимаю, {user_name}... работа действительно может выматывать",
+            f"чувствую напряжение, {user_name}"
+        ],
+        'деньги': [
+            f"{user_name}, финансовые темы часто связаны с безопасностью",
+            f"понимаю твою озабоченность, {user_name}",
+            f"{user_name}, деньги... это всегда про свободу и возможности"
+        ],
+        'здоровье': [
+            f"{user_name}, здоровье - это основа",
+            f"чувствую твою заботу о себе, {user_name}",
+            f"понимаю, {user_name}, как это важно"
+        ],
+        'выбор': [
+            f"{user_name}, стоять на распутье... это всегда непросто",
+            f"чувствую твои сомнения, {user_name}",
+            f"{user_name}, моменты выбора часто определяют многое"
+        ],
+        'общая': [
+            f"слышу тебя, {user_name}",
+            f"понимаю, {user_name}",
+            f"чувствую, как это беспокоит тебя, {user_name}"
+        ]
+    }
+    empathy = legacy_get_unique_response(empathy_responses[problem_type], state)
+    questions = {
+        'отношения': [
+            "что самое важное для тебя в этих отношениях",
+            "чего не хватает для полного счастья",
+            "что твое сердце чувствует в этой ситуации"
+        ],
+        'работа': [
+            "что самое сложное в этой ситуации",
+            "как это влияет на твое состояние каждый день",
+            "что бы ты хотел изменить в первую очередь"
+        ],
+        'деньги': [
+            "как эта ситуация влияет на твою свободу",
+            "чего ты боишься больше всего",
+            "что изменится, если деньги перестанут быть проблемой"
+        ],
+        'здоровье': [
+            "как это влияет на твою повседневную жизнь",
+            "что говорит тебе твое тело",
+            "какой поддержки тебе не хватает"
+        ],
+        'выбор': [
+            "что подсказывает твоя интуиция",
+            "чего ты боишься в каждом из вариантов",
+            "какой выбор сделало бы твое сердце, если бы не было страха"
+        ],
+        'общая': [
+            "что самое тяжелое в этом для тебя",
+            "как долго это с тобой",
+            "что бы хотелось изменить"
+        ]
+    }
+    question = random.choice(questions[problem_type])
+    return [app.format_message(empathy, False), app.format_message(question, False)]
+
+
+def legacy_offer_response(user_name, state):
+    offers = [
+        f"{user_name}, иногда полезно посмотреть на ситуацию с другой стороны\nкарты таро могут стать таким проводником",
+        f"знаешь, {user_name}, карты часто помогают увидеть то, что скрыто\nхочешь попробовать такой диалог",
+        f"{user_name}, у меня есть чувство\nчто здесь есть важные подсказки для тебя\nкарты могут помочь их расшифровать"
+    ]
+    offer = legacy_get_unique_response(offers, state)
+    explanations = [
+        "это не гадание, а разговор с собой через язык символов",
+        "это как посмотреть на ситуацию через чистое зеркало",
+        "карты помогают увидеть то, что мы часто не замечаем в суете"
+    ]
+    explanation = random.choice(explanations)
+    return [app.format_message(offer, False), app.format_message(explanation, False)]
+
+
+def legacy_value_response(user_name, state):
+    responses = [
+        f"хорошо, {user_name} 💫\nтогда я создам для тебя персональный расклад",
+        "буду работать с твоей ситуацией очень внимательно",
+        f"стоимость - 1490 рублей\nно для тебя, {user_name}, сделаю за 990",
+        "это не просто оплата\nа энергообмен и твоя готовность к изменениям"
+    ]
+    return [app.format_message(r, False) for r in responses]
+
+
+def legacy_comfort(user_name, state):
+    comfort = [
+        f"всё в твоем ритме, {user_name}",
+        "не торопись с решением",
+        f"посиди с этим ощущением, {user_name}"
+    ]
+    return [app.format_message(random.choice(comfort), False)]
+
+
+def legacy_round(user_name, problem_type, state):
+    responses = (
+        legacy_problem_response(problem_type, user_name, state)
+        + legacy_offer_response(user_name, state)
+        + legacy_comfort(user_name, state)
+        + legacy_value_response(user_name, state)
+    )
+    # Прежний handle_user_message запоминал каждый отправленный текст
+    for response in responses:
+        state.remember_response(response)
+
+
+# --- Новая реализация ---
+
+def new_round(user_name, problem_type, state):
+    app.get_unique_response(f"empathy.{problem_type}", user_name, state)
+    app.render_random(f"question.{problem_type}", user_name)
+    app.generate_offer_response(user_name, state)
+    app.render_random('comfort', user_name)
+    app.generate_value_response(user_name, state)
+
+
+def bench(generate, rounds):
+    cases = [
+        (NAMES[i % len(NAMES)], app.analyze_problem_type(PROBLEMS[i % len(PROBLEMS)]))
+        for i in range(len(NAMES) * len(PROBLEMS))
+    ]
+    random.seed(1)
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for user_name, problem_type in cases:
+            # Каждый раунд - новый диалог, как у настоящего чата
+            generate(user_name, problem_type, ConversationState())
+    elapsed = time.perf_counter() - started
+    # В одном раунде 4 ответа: проблема, предложение, сомнение, ценность
+    return rounds * len(cases) * 4 / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rounds', type=int, default=20000)
+    args = parser.parse_args()
+
+    legacy = bench(legacy_round, args.rounds // 20)
+    new = bench(new_round, args.rounds // 20)
+    print(f"словари f-строк:  {legacy:10.0f} ответов/с")
+    print(f"таблицы шаблонов: {new:10.0f} ответов/с")
+    print(f"ускорение:        {new / legacy:10.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""Локальная заглушка Telegram Bot API для нагрузочных тестов
+
+Запуск отдельно:
+    python benchmarks/fake_telegram.py --port 8081 --latency 30
+
+Бот направляется на нее через TELEGRAM_API_URL=http://127.0.0.1:8081.
+Заглушка отвечает на любой метод {"ok": true}, по желанию добавляет
+задержку и долю ответов 429, и записывает каждый вызов sendMessage и
+sendChatAction с временем прихода.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+class QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Бот закрывает keep-alive соединения при остановке - это не ошибка
+        pass
+
+
+class FakeTelegram:
+    """Заглушка Bot API в фоновом потоке"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, error_rate=0.0, retry_after=1):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        # (время прихода по time.time, метод, chat_id, текст)
+        self.calls = []
+        self.rate_limited = 0
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                try:
+                    payload = json.loads(body) if body else {}
+                except ValueError:
+                    payload = {}
+                query = dict(parse_qsl(urlsplit(self.path).query))
+                fake.handle(self, urlsplit(self.path).path.rsplit('/', 1)[-1], {**query, **payload})
+
+            do_GET = do_POST
+
+            def log_message(self, *args):
+                pass
+
+        self.server = QuietServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name='fake-telegram', daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, request, method, payload):
+        if self.latency:
+            time.sleep(self.latency)
+
+        if method == 'getUpdates':
+            # Long polling без апдейтов: держим соединение недолго
+            time.sleep(min(float(payload.get('timeout') or 0), 1.0))
+            self.reply(request, 200, {"ok": True, "result": []})
+            return
+
+        if method == 'sendMessage' and self.error_rate and random.random() < self.error_rate:
+            with self.lock:
+                self.rate_limited += 1
+            self.reply(request, 429, {
+                "ok": False,
+                "error_code": 429,
+                "description": "Too Many Requests",
+                "parameters": {"retry_after": self.retry_after}
+            })
+            return
+
+        if method in ('sendMessage', 'sendChatAction'):
+            with self.lock:
+                self.calls.append((time.time(), method, payload.get('chat_id'), payload.get('text')))
+        self.reply(request, 200, {"ok": True, "result": True})
+
+    @staticmethod
+    def reply(request, status, data):
+        body = json.dumps(data).encode()
+        request.send_response(status)
+        request.send_header('Content-Type', 'application/json')
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def snapshot(self):
+        """Копия журнала вызовов"""
+        with self.lock:
+            return list(self.calls)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Заглушка Telegram Bot API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help="задержка ответа, мс")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="доля ответов 429 на sendMessage")
+    args = parser.parse_args()
+
+    fake = FakeTelegram(args.host, args.port, latency=args.latency / 1000, error_rate=args.error_rate)
+    print(f"📡 Заглушка Bot API: {fake.url}")
+    fake.start()
+    try:
+        while True:
+            time.sleep(5)
+            calls = fake.snapshot()
+            sent = sum(1 for call in calls if call[1] == 'sendMessage')
+            print(f"sendMessage: {sent}, sendChatAction: {len(calls) - sent}, 429: {fake.rate_limited}")
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+"""Сквозной нагрузочный тест бота на локальной заглушке Bot API
+
+Запуск из корня репозитория:
+    python benchmarks/loadtest.py --rate 50 --chats 500 --duration 60
+    python benchmarks/loadtest.py --server uvicorn --label asyncio
+
+Тест поднимает заглушку Telegram (fake_telegram.py), запускает бота
+отдельным процессом с TELEGRAM_API_URL на нее и сжатыми человеческими
+задержками (HUMAN_DELAY_SCALE), и шлет синтетические апдейты на /webhook
+с заданной частотой по заданному числу чатов. Снимаются:
+  - задержка ответа webhook (p50/p90/p99);
+  - сквозная задержка от апдейта до sendMessage в заглушке;
+  - исходящие вызовы в секунду;
+  - число потоков и RSS процесса бота (с воркерами) раз в секунду.
+Результат пишется в JSON (по умолчанию benchmarks/results/), чтобы
+сравнивать прогоны разных версий.
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_telegram import FakeTelegram
+
+# Реплики одного диалога: чат проходит их по кругу
+SCRIPT = [
+    "привет",
+    "у меня проблемы на работе, не знаю что делать",
+    "начальник постоянно придирается",
+    "да, интересно",
+    "сколько стоит?",
+    "готов, давай",
+    "оплатил",
+]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(values, scale=1.0, digits=2):
+    return {
+        "count": len(values),
+        "p50": round(percentile(values, 50) * scale, digits) if values else None,
+        "p90": round(percentile(values, 90) * scale, digits) if values else None,
+        "p99": round(percentile(values, 99) * scale, digits) if values else None,
+        "max": round(max(values) * scale, digits) if values else None,
+    }
+
+
+def server_command(args, port):
+    if args.server == 'gunicorn':
+        return [sys.executable, '-m', 'gunicorn', 'app:app', '-b', f'127.0.0.1:{port}',
+                '-w', str(args.workers), '--threads', str(args.threads), '--log-level', 'warning']
+    if args.server == 'uvicorn':
+        return [sys.executable, '-m', 'uvicorn', 'asgi_app:app', '--port', str(port), '--log-level', 'warning']
+    return [sys.executable, '-c', f"import app; app.app.run(host='127.0.0.1', port={port}, threaded=True)"]
+
+
+def process_tree(pid):
+    """pid и все его потомки (через /proc)"""
+    pids = [pid]
+    for current in pids:
+        try:
+            with open(f'/proc/{current}/task/{current}/children') as f:
+                pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def sample_process(pid):
+    """Суммарные потоки и RSS (МБ) дерева процессов бота"""
+    threads = 0
+    rss_kb = 0
+    for current in process_tree(pid):
+        try:
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('Threads:'):
+                        threads += int(line.split()[1])
+                    elif line.startswith('VmRSS:'):
+                        rss_kb += int(line.split()[1])
+        except OSError:
+            pass
+    return threads, round(rss_kb / 1024, 1)
+
+
+def wait_ready(url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Бот не поднялся за {timeout} сек")
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class LoadGenerator:
+    """Открытая модель нагрузки: апдейты уходят по расписанию, не дожидаясь ответов"""
+
+    def __init__(self, webhook_url, rate, chats, concurrency):
+        self.webhook_url = webhook_url
+        self.rate = rate
+        self.chats = chats
+        self.pool = ThreadPoolExecutor(max_workers=concurrency)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        # (chat_id, когда отправлен по time.time, латентность, статус)
+        self.results = []
+        # chat_id -> времена отправки апдейтов
+        self.sent_at = {}
+        self.update_id = int(time.time()) * 1000
+
+    def session(self):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = requests.Session()
+        return session
+
+    def post(self, chat_id, update):
+        started = time.time()
+        try:
+            status = self.session().post(self.webhook_url, json=update, timeout=30).status_code
+        except requests.RequestException:
+            status = None
+        latency = time.time() - started
+        with self.lock:
+            self.results.append((chat_id, started, latency, status))
+
+    def run(self, duration):
+        interval = 1.0 / self.rate
+        turns = [0] * self.chats
+        started = time.monotonic()
+        n = 0
+        while True:
+            due = started + n * interval
+            if due - started >= duration:
+                break
+            wait = due - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+
+            chat_index = n % self.chats
+            chat_id = 100000 + chat_index
+            text = SCRIPT[turns[chat_index] % len(SCRIPT)]
+            turns[chat_index] += 1
+            self.update_id += 1
+            update = {
+                "update_id": self.update_id,
+                "message": {
+                    "message_id": n,
+                    "date": int(time.time()),
+                    "text": text,
+                    "chat": {"id": chat_id, "type": "private"},
+                    "from": {"id": chat_id, "first_name": f"Чат{chat_index}"}
+                }
+            }
+            with self.lock:
+                self.sent_at.setdefault(chat_id, []).append(time.time())
+            self.pool.submit(self.post, chat_id, update)
+            n += 1
+        self.pool.shutdown(wait=True)
+        return n
+
+
+def delivery_delays(sent_at, calls):
+    """Для каждого sendMessage - время от последнего апдейта этого чата до него"""
+    delays = []
+    for at, method, chat_id, _ in calls:
+        if method != 'sendMessage':
+            continue
+        previous = [t for t in sent_at.get(chat_id, ()) if t <= at]
+        if previous:
+            delays.append(at - previous[-1])
+    return delays
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rate', type=float, default=20, help="апдейтов в секунду")
+    parser.add_argument('--chats', type=int, default=200, help="число одновременных чатов")
+    parser.add_argument('--duration', type=float, default=30, help="длительность подачи нагрузки, сек")
+    parser.add_argument('--drain', type=float, default=10, help="ожидание доставки после нагрузки, сек")
+    parser.add_argument('--server', choices=['flask', 'gunicorn', 'uvicorn'], default='gunicorn')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--concurrency', type=int, default=64, help="одновременных запросов к webhook")
+    parser.add_argument('--delay-scale', type=float, default=0.01, help="HUMAN_DELAY_SCALE для бота")
+    parser.add_argument('--quiet', type=float, default=None, help="COALESCE_QUIET для бота (по умолчанию 5 * delay-scale)")
+    parser.add_argument('--api-latency', type=float, default=30, help="задержка заглушки Bot API, мс")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="доля ответов 429 на sendMessage")
+    parser.add_argument('--label', default='')
+    parser.add_argument('--output', default=None, help="файл с результатами (JSON)")
+    args = parser.parse_args()
+
+    fake = FakeTelegram(latency=args.api_latency / 1000, error_rate=args.error_rate).start()
+    port = free_port()
+    tmp = tempfile.mkdtemp(prefix='loadtest_')
+    quiet = args.quiet if args.quiet is not None else 5 * args.delay_scale
+    env = dict(
+        os.environ,
+        BOT_TOKEN='loadtest',
+        TELEGRAM_API_URL=fake.url,
+        HUMAN_DELAY_SCALE=str(args.delay_scale),
+        COALESCE_QUIET=str(quiet),
+        OUTBOX_PATH=os.path.join(tmp, 'outbox.db'),
+        STATE_DB_PATH=os.path.join(tmp, 'conversations.db'),
+        DEDUP_PATH=os.path.join(tmp, 'updates.dedup'),
+        POLLING_OFFSET_PATH=os.path.join(tmp, 'polling.offset'),
+    )
+    log_path = os.path.join(tmp, 'server.log')
+    with open(log_path, 'w') as log:
+        server = subprocess.Popen(server_command(args, port), cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    samples = []
+    sampling = threading.Event()
+
+    def sampler():
+        started = time.monotonic()
+        while not sampling.wait(1.0):
+            threads, rss = sample_process(server.pid)
+            samples.append({"t": round(time.monotonic() - started, 1), "threads": threads, "rss_mb": rss})
+
+    try:
+        wait_ready(f"http://127.0.0.1:{port}/")
+        print(f"🚀 {args.server} на порту {port}, заглушка {fake.url}, лог {log_path}")
+        threading.Thread(target=sampler, daemon=True).start()
+
+        generator = LoadGenerator(f"http://127.0.0.1:{port}/webhook", args.rate, args.chats, args.concurrency)
+        load_started = time.time()
+        updates = generator.run(args.duration)
+        load_finished = time.time()
+        print(f"📨 Отправлено апдейтов: {updates}, ждем доставку {args.drain} сек")
+        time.sleep(args.drain)
+    finally:
+        sampling.set()
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        fake.stop()
+
+    calls = fake.snapshot()
+    latencies = [latency for _, _, latency, status in generator.results if status == 200]
+    statuses = {}
+    for _, _, _, status in generator.results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    elapsed = max(calls[-1][0], load_finished) - load_started if calls else load_finished - load_started
+    per_second = {}
+    for at, _, _, _ in calls:
+        second = int(at - load_started)
+        per_second[second] = per_second.get(second, 0) + 1
+
+    result = {
+        "label": args.label,
+        "revision": git_revision(),
+        "started_at": time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(load_started)),
+        "config": vars(args) | {"quiet": quiet},
+        "webhook": {
+            "updates": updates,
+            "statuses": statuses,
+            "latency_ms": summarize(latencies, scale=1000),
+        },
+        "delivery": {
+            "messages": sum(1 for call in calls if call[1] == 'sendMessage'),
+            "delay_s": summarize(delivery_delays(generator.sent_at, calls), digits=3),
+        },
+        "outbound": {
+            "calls": len(calls),
+            "send_message": sum(1 for call in calls if call[1] == 'sendMessage'),
+            "send_chat_action": sum(1 for call in calls if call[1] == 'sendChatAction'),
+            "rate_limited": fake.rate_limited,
+            "calls_per_s": round(len(calls) / elapsed, 1) if elapsed > 0 else None,
+            "peak_per_s": max(per_second.values()) if per_second else 0,
+        },
+        "process": {
+            "threads_max": max((s["threads"] for s in samples), default=None),
+            "rss_mb_max": max((s["rss_mb"] for s in samples), default=None),
+            "samples": samples,
+        },
+    }
+
+    output = args.output or os.path.join(
+        ROOT, 'benchmarks', 'results',
+        f"loadtest-{time.strftime('%Y%m%d-%H%M%S')}{'-' + args.label if args.label else ''}.json"
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+    webhook = result["webhook"]["latency_ms"]
+    delivery = result["delivery"]["delay_s"]
+    print(f"webhook:   p50 {webhook['p50']} мс, p99 {webhook['p99']} мс, статусы {statuses}")
+    print(f"доставка:  {result['delivery']['messages']} сообщений, p50 {delivery['p50']} с, p99 {delivery['p99']} с")
+    print(f"исходящие: {result['outbound']['calls_per_s']} вызовов/с, пик {result['outbound']['peak_per_s']}/с")
+    print(f"процесс:   до {result['process']['threads_max']} потоков, до {result['process']['rss_mb_max']} МБ RSS")
+    print(f"💾 {output}")
+
+
+if __name__ == '__main__':
+    main()
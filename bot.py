@@ -1,11 +1,13 @@
 from flask import Flask, request, jsonify
 import os
-import requests
 import logging
 import random
 
+import log_config
+from telegram_client import TelegramClient
+
 app = Flask(__name__)
-logging.basicConfig(level=logging.INFO)
+log_config.setup_logging()
 logger = logging.getLogger(__name__)
 
 # Конфигурация
@@ -13,7 +15,9 @@ BOT_TOKEN = os.environ.get('BOT_TOKEN')
 if not BOT_TOKEN:
     logger.error("❌ BOT_TOKEN не установлен!")
 else:
-    logger.info(f"✅ BOT_TOKEN установлен, длина: {len(BOT_TOKEN)}")
+    logger.info("✅ BOT_TOKEN установлен, длина: %d", len(BOT_TOKEN))
+
+telegram = TelegramClient(BOT_TOKEN)
 
 # Колода Таро
 TAROT_CARDS = [
@@ -43,24 +47,17 @@ TAROT_CARDS = [
 def send_message(chat_id, text, parse_mode='Markdown'):
     """Отправляет сообщение через Telegram API"""
     try:
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-        payload = {
-            'chat_id': chat_id,
-            'text': text,
-            'parse_mode': parse_mode
-        }
-        
-        logger.info(f"📤 Отправляю сообщение в chat_id {chat_id}: {text[:50]}...")
-        response = requests.post(url, json=payload, timeout=10)
+        logger.info("📤 Отправляю сообщение в chat_id %s: %.50s...", chat_id, text, extra={'event': 'outgoing'})
+        response = telegram.send_message(chat_id, text, parse_mode)
         
         if response.status_code != 200:
-            logger.error(f"❌ Ошибка отправки: {response.text}")
+            logger.error("❌ Ошибка отправки: %s", response.text)
         else:
-            logger.info(f"✅ Сообщение отправлено успешно")
+            logger.info("✅ Сообщение отправлено успешно", extra={'event': 'sent'})
         
         return response.json()
     except Exception as e:
-        logger.error(f"🚨 Ошибка при отправке: {e}")
+        logger.error("🚨 Ошибка при отправке: %s", e)
         return None
 
 def generate_tarot_reading(question):
@@ -83,27 +80,21 @@ def generate_tarot_reading(question):
     
     return interpretation
 
-@app.route('/webhook', methods=['POST'])
-def webhook():
-    """Основной webhook от Telegram"""
-    try:
-        data = request.get_json()
-        logger.info(f"📥 Получен webhook от пользователя")
-        
-        if not data:
-            return jsonify({"status": "error", "message": "No data"}), 400
-        
-        # Проверяем разные типы обновлений
-        if 'message' in data and 'text' in data['message']:
-            message_text = data['message']['text'].strip()
-            chat_id = data['message']['chat']['id']
-            user_name = data['message']['from'].get('first_name', 'друг')
-            
-            logger.info(f"👤 {user_name} ({chat_id}): {message_text}")
-            
-            # Обработка команд
-            if message_text.startswith('/start'):
-                response_text = f"""🔮 *Привет, {user_name}!*
+def handle_update(data):
+    """Обрабатывает один апдейт Telegram (из webhook или long polling)"""
+    # Проверяем разные типы обновлений
+    if 'message' not in data or 'text' not in data['message']:
+        return False
+    
+    message_text = data['message']['text'].strip()
+    chat_id = data['message']['chat']['id']
+    user_name = data['message']['from'].get('first_name', 'друг')
+    
+    logger.info("👤 %s (%s): %s", user_name, chat_id, message_text, extra={'event': 'incoming'})
+    
+    # Обработка команд
+    if message_text.startswith('/start'):
+        response_text = f"""🔮 *Привет, {user_name}!*
 
 Я - бот-таролог *@Tarotyour_bot*!
 
@@ -115,12 +106,12 @@ def webhook():
 💫 Напиши /tarot для расклада!
 
 *Бот работает для всех пользователей!* 🎉"""
-                
-                result = send_message(chat_id, response_text)
-                logger.info(f"✅ Отправлен ответ на /start")
-                
-            elif message_text.startswith('/tarot'):
-                response_text = f"""🌀 *{user_name}, отлично!* 
+        
+        result = send_message(chat_id, response_text)
+        logger.info("✅ Отправлен ответ на /start")
+        
+    elif message_text.startswith('/tarot'):
+        response_text = f"""🌀 *{user_name}, отлично!* 
 
 Напиши свой вопрос для расклада Таро.
 
@@ -128,10 +119,10 @@ def webhook():
 • Что меня ждет в отношениях?
 • Какой выбор сделать?
 • Что важного произойдет в ближайшее время?"""
-                send_message(chat_id, response_text)
-                
-            elif message_text.startswith('/help'):
-                response_text = """🔮 *Помощь:*
+        send_message(chat_id, response_text)
+        
+    elif message_text.startswith('/help'):
+        response_text = """🔮 *Помощь:*
 
 • /start - начать общение
 • /tarot - сделать расклад
@@ -143,15 +134,15 @@ def webhook():
 3. Даю интерпретацию расклада
 
 💖 Бот абсолютно бесплатный!"""
-                send_message(chat_id, response_text)
-                
-            else:
-                # Если это не команда, делаем расклад на произвольный вопрос
-                if len(message_text) > 3:  # Игнорируем слишком короткие сообщения
-                    reading = generate_tarot_reading(message_text)
-                    send_message(chat_id, reading)
-                else:
-                    response_text = f"""✨ *{user_name}, задай вопрос подробнее!*
+        send_message(chat_id, response_text)
+        
+    else:
+        # Если это не команда, делаем расклад на произвольный вопрос
+        if len(message_text) > 3:  # Игнорируем слишком короткие сообщения
+            reading = generate_tarot_reading(message_text)
+            send_message(chat_id, reading)
+        else:
+            response_text = f"""✨ *{user_name}, задай вопрос подробнее!*
 
 💭 Напиши что-то вроде:
 • "Что ждет меня на работе?"
@@ -159,14 +150,25 @@ def webhook():
 • "Стоит ли мне менять профессию?"
 
 Или используй команду /tarot для подсказок!"""
-                    send_message(chat_id, response_text)
-            
-            return jsonify({"status": "success", "processed": True}), 200
+            send_message(chat_id, response_text)
+    
+    return True
+
+@app.route('/webhook', methods=['POST'])
+def webhook():
+    """Основной webhook от Telegram"""
+    try:
+        data = request.get_json()
+        logger.info("📥 Получен webhook от пользователя", extra={'event': 'webhook'})
+        
+        if not data:
+            return jsonify({"status": "error", "message": "No data"}), 400
         
-        return jsonify({"status": "success", "processed": False}), 200
+        processed = handle_update(data)
+        return jsonify({"status": "success", "processed": processed}), 200
         
     except Exception as e:
-        logger.error(f"🚨 Ошибка в webhook: {e}")
+        logger.error("🚨 Ошибка в webhook: %s", e)
         return jsonify({"status": "error", "message": str(e)}), 400
 
 @app.route('/set_webhook', methods=['GET'])
@@ -178,11 +180,10 @@ def set_webhook():
         
         # Получаем URL для webhook
         webhook_url = request.host_url.rstrip('/') + '/webhook'
-        logger.info(f"🔗 Устанавливаю webhook на: {webhook_url}")
+        logger.info("🔗 Устанавливаю webhook на: %s", webhook_url)
         
         # Устанавливаем через Telegram API
-        telegram_url = f"https://api.telegram.org/bot{BOT_TOKEN}/setWebhook"
-        response = requests.post(telegram_url, json={'url': webhook_url}, timeout=10)
+        response = telegram.set_webhook(webhook_url)
         
         result = {
             "success": response.status_code == 200,
@@ -191,11 +192,11 @@ def set_webhook():
             "telegram_response": response.json() if response.status_code == 200 else response.text
         }
         
-        logger.info(f"🌐 Webhook установлен: {result}")
+        logger.info("🌐 Webhook установлен: %s", result)
         return jsonify(result), 200
         
     except Exception as e:
-        logger.error(f"🚨 Ошибка установки webhook: {e}")
+        logger.error("🚨 Ошибка установки webhook: %s", e)
         return jsonify({"error": str(e)}), 400
 
 @app.route('/test_all', methods=['GET'])
@@ -251,8 +252,7 @@ def bot_info():
             return jsonify({"error": "BOT_TOKEN не установлен"}), 400
         
         # Получаем информацию о боте
-        telegram_url = f"https://api.telegram.org/bot{BOT_TOKEN}/getMe"
-        response = requests.get(telegram_url, timeout=10)
+        response = telegram.get_me()
         
         return jsonify({
             "bot_token_exists": bool(BOT_TOKEN),
@@ -306,5 +306,5 @@ def home():
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 10000))
-    logger.info(f"🚀 Запуск универсального бота на порту {port}")
+    logger.info("🚀 Запуск универсального бота на порту %s", port)
     app.run(host='0.0.0.0', port=port, debug=False)
@@ -1,11 +1,13 @@
 from flask import Flask, request, jsonify
 import os
-import requests
 import logging
 import random
 
+import log_config
+from telegram_client import TelegramClient
+
 app = Flask(__name__)
-logging.basicConfig(level=logging.INFO)
+log_config.setup_logging()
 logger = logging.getLogger(__name__)
 
 # Конфигурация
@@ -13,7 +15,9 @@ BOT_TOKEN = os.environ.get('BOT_TOKEN')
 if not BOT_TOKEN:
     logger.error("❌ BOT_TOKEN не установлен!")
 else:
-    logger.info(f"✅ BOT_TOKEN установлен, длина: {len(BOT_TOKEN)}")
+    logger.info("✅ BOT_TOKEN установлен, длина: %d", len(BOT_TOKEN))
+
+telegram = TelegramClient(BOT_TOKEN)
 
 # Колода Таро
 TAROT_CARDS = [
@@ -43,24 +47,17 @@ TAROT_CARDS = [
 def send_message(chat_id, text, parse_mode='Markdown'):
     """Отправляет сообщение через Telegram API"""
     try:
-        url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-        payload = {
-            'chat_id': chat_id,
-            'text': text,
-            'parse_mode': parse_mode
-        }
-        
-        logger.info(f"📤 Отправляю сообщение в chat_id {chat_id}")
-        response = requests.post(url, json=payload, timeout=10)
+        logger.info("📤 Отправляю сообщение в chat_id %s", chat_id, extra={'event': 'outgoing'})
+        response = telegram.send_message(chat_id, text, parse_mode)
         
         if response.status_code != 200:
-            logger.error(f"❌ Ошибка отправки: {response.text}")
+            logger.error("❌ Ошибка отправки: %s", response.text)
         else:
-            logger.info(f"✅ Сообщение отправлено")
+            logger.info("✅ Сообщение отправлено", extra={'event': 'sent'})
         
         return response.json()
     except Exception as e:
-        logger.error(f"🚨 Ошибка при отправке: {e}")
+        logger.error("🚨 Ошибка при отправке: %s", e)
         return None
 
 def generate_tarot_reading(question, user_name):
@@ -90,27 +87,21 @@ def generate_tarot_reading(question, user_name):
     
     return interpretation
 
-@app.route('/webhook', methods=['POST'])
-def webhook():
-    """Основной webhook от Telegram"""
-    try:
-        data = request.get_json()
-        logger.info(f"📥 Получен webhook от пользователя")
-        
-        if not data:
-            return jsonify({"status": "error", "message": "No data"}), 400
-        
-        # Проверяем разные типы обновлений
-        if 'message' in data and 'text' in data['message']:
-            message_text = data['message']['text'].strip()
-            chat_id = data['message']['chat']['id']
-            user_name = data['message']['from'].get('first_name', 'друг')
-            
-            logger.info(f"👤 {user_name} ({chat_id}): {message_text}")
-            
-            # Обработка команд
-            if message_text.startswith('/start'):
-                response_text = f"""🔮 *Привет, {user_name}!*
+def handle_update(data):
+    """Обрабатывает один апдейт Telegram (из webhook или long polling)"""
+    # Проверяем разные типы обновлений
+    if 'message' not in data or 'text' not in data['message']:
+        return False
+    
+    message_text = data['message']['text'].strip()
+    chat_id = data['message']['chat']['id']
+    user_name = data['message']['from'].get('first_name', 'друг')
+    
+    logger.info("👤 %s (%s): %s", user_name, chat_id, message_text, extra={'event': 'incoming'})
+    
+    # Обработка команд
+    if message_text.startswith('/start'):
+        response_text = f"""🔮 *Привет, {user_name}!*
 
 Я - бот-таролог *@Tarotyour_bot*!
 
@@ -124,12 +115,12 @@ def webhook():
 /help - помощь
 
 *Задай свой вопрос прямо сейчас!* ✨"""
-                
-                result = send_message(chat_id, response_text)
-                logger.info(f"✅ Отправлен ответ на /start")
-                
-            elif message_text.startswith('/tarot'):
-                response_text = f"""🌀 *{user_name}, давай сделаем расклад!* 
+        
+        result = send_message(chat_id, response_text)
+        logger.info("✅ Отправлен ответ на /start")
+        
+    elif message_text.startswith('/tarot'):
+        response_text = f"""🌀 *{user_name}, давай сделаем расклад!* 
 
 Напиши свой вопрос для расклада Таро.
 
@@ -141,10 +132,10 @@ def webhook():
 • Стоит ли мне менять профессию?
 
 *Или просто напиши свой вопрос сразу!*"""
-                send_message(chat_id, response_text)
-                
-            elif message_text.startswith('/help'):
-                response_text = f"""🔮 *Помощь, {user_name}!*
+        send_message(chat_id, response_text)
+        
+    elif message_text.startswith('/help'):
+        response_text = f"""🔮 *Помощь, {user_name}!*
 
 • Просто напиши вопрос - и я сделаю расклад
 • /tarot - подсказки по вопросам
@@ -156,39 +147,39 @@ def webhook():
 💖 *Бот абсолютно бесплатный для всех!*
 
 *Попробуй прямо сейчас - напиши любой вопрос!*"""
-                send_message(chat_id, response_text)
-                
-            else:
-                # ВАЖНО: Если это не команда - ДЕЛАЕМ РАСКЛАД!
-                if len(message_text) > 2:  # Игнорируем слишком короткие сообщения
-                    logger.info(f"🎴 Генерирую расклад Таро для вопроса: {message_text}")
-                    
-                    # Добавляем небольшую задержку для "магии"
-                    thinking_text = f"""🌀 *{user_name}, концентрируюсь на твоем вопросе...*
+        send_message(chat_id, response_text)
+        
+    else:
+        # ВАЖНО: Если это не команда - ДЕЛАЕМ РАСКЛАД!
+        if len(message_text) > 2:  # Игнорируем слишком короткие сообщения
+            logger.info("🎴 Генерирую расклад Таро для вопроса: %s", message_text)
+            
+            # Добавляем небольшую задержку для "магии"
+            thinking_text = f"""🌀 *{user_name}, концентрируюсь на твоем вопросе...*
 
 "*{message_text}*"
 
 🎴 Выбираю карты Таро...
 ✨ Интерпретирую расклад...
 🔮 Готовлю ответ..."""
-                    send_message(chat_id, thinking_text)
-                    
-                    # Генерируем расклад
-                    reading = generate_tarot_reading(message_text, user_name)
-                    send_message(chat_id, reading)
-                    
-                    # Добавляем финальное сообщение
-                    follow_up = f"""💫 *{user_name}, как тебе расклад?*
+            send_message(chat_id, thinking_text)
+            
+            # Генерируем расклад
+            reading = generate_tarot_reading(message_text, user_name)
+            send_message(chat_id, reading)
+            
+            # Добавляем финальное сообщение
+            follow_up = f"""💫 *{user_name}, как тебе расклад?*
 
 Хочешь еще один расклад? Просто напиши новый вопрос!
 
 ✨ *Совет:* Задавай конкретные вопросы для более точных ответов.
 
 Или используй /help для помощи."""
-                    send_message(chat_id, follow_up)
-                    
-                else:
-                    response_text = f"""✨ *{user_name}, задай вопрос подробнее!*
+            send_message(chat_id, follow_up)
+            
+        else:
+            response_text = f"""✨ *{user_name}, задай вопрос подробнее!*
 
 💭 *Например:*
 • "Что ждет меня на работе?"
@@ -196,14 +187,25 @@ def webhook():
 • "Стоит ли мне менять профессию?"
 
 *Или используй команду* /tarot *для подсказок!*"""
-                    send_message(chat_id, response_text)
-            
-            return jsonify({"status": "success", "processed": True}), 200
+            send_message(chat_id, response_text)
+    
+    return True
+
+@app.route('/webhook', methods=['POST'])
+def webhook():
+    """Основной webhook от Telegram"""
+    try:
+        data = request.get_json()
+        logger.info("📥 Получен webhook от пользователя", extra={'event': 'webhook'})
+        
+        if not data:
+            return jsonify({"status": "error", "message": "No data"}), 400
         
-        return jsonify({"status": "success", "processed": False}), 200
+        processed = handle_update(data)
+        return jsonify({"status": "success", "processed": processed}), 200
         
     except Exception as e:
-        logger.error(f"🚨 Ошибка в webhook: {e}")
+        logger.error("🚨 Ошибка в webhook: %s", e)
         return jsonify({"status": "error", "message": str(e)}), 400
 
 @app.route('/set_webhook', methods=['GET'])
@@ -214,10 +216,9 @@ def set_webhook():
             return jsonify({"error": "BOT_TOKEN не установлен"}), 400
         
         webhook_url = request.host_url.rstrip('/') + '/webhook'
-        logger.info(f"🔗 Устанавливаю webhook на: {webhook_url}")
+        logger.info("🔗 Устанавливаю webhook на: %s", webhook_url)
         
-        telegram_url = f"https://api.telegram.org/bot{BOT_TOKEN}/setWebhook"
-        response = requests.post(telegram_url, json={'url': webhook_url}, timeout=10)
+        response = telegram.set_webhook(webhook_url)
         
         return jsonify({
             "success": response.status_code == 200,
@@ -227,7 +228,7 @@ def set_webhook():
         }), 200
         
     except Exception as e:
-        logger.error(f"🚨 Ошибка установки webhook: {e}")
+        logger.error("🚨 Ошибка установки webhook: %s", e)
         return jsonify({"error": str(e)}), 400
 
 @app.route('/')
@@ -241,5 +242,5 @@ def home():
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 10000))
-    logger.info(f"🚀 Запуск бота с исправленной логикой на порту {port}")
+    logger.info("🚀 Запуск бота с исправленной логикой на порту %s", port)
     app.run(host='0.0.0.0', port=port, debug=False)
@@ -0,0 +1,93 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Burst:
+    """Серия сообщений одного чата, еще не примененная к состоянию"""
+    __slots__ = ('messages', 'user_name', 'due', 'timer')
+
+    def __init__(self, user_name, due):
+        # [(update_id, текст)] в порядке прихода
+        self.messages = []
+        self.user_name = user_name
+        # Раньше этого (по monotonic) серия не обрабатывается
+        self.due = due
+        self.timer = None
+
+
+class BurstCoalescer:
+    """Склейка серии сообщений одного чата до того, как они применены
+
+    Пользователи часто пишут 3-5 коротких сообщений подряд. Сообщение
+    не обрабатывается сразу: оно копится в серии чата. Серия ждет hold
+    секунд с первого сообщения (человеческая задержка ответа) и не меньше
+    quiet секунд после последнего, затем flush(chat_id, burst) один раз
+    прогоняет все ее сообщения. Ничего уже примененного не откатывается:
+    сообщение, пришедшее после того, как серия ушла в обработку,
+    открывает новую серию.
+
+    Под замком склейщика только словарь серий и таймеры планировщика
+    в памяти; flush вызывается вне замка.
+    """
+
+    def __init__(self, scheduler, flush, hold=0.0, quiet=5.0):
+        self.scheduler = scheduler
+        self.flush = flush
+        # Число секунд или функция, которая выбирает их для новой серии
+        self.hold = hold
+        self.quiet = quiet
+        self._bursts = {}
+        self._lock = threading.Lock()
+
+        # Метрики
+        self.messages = 0
+        self.flushes = 0
+        self.rescheduled = 0
+
+    def _hold(self):
+        return self.hold() if callable(self.hold) else self.hold
+
+    def add(self, chat_id, user_name, text, update_id=None):
+        """Добавляет сообщение в серию чата; обработка переносится не раньше чем на quiet"""
+        now = time.monotonic()
+        with self._lock:
+            self.messages += 1
+            burst = self._bursts.get(chat_id)
+            if burst is None:
+                burst = self._bursts[chat_id] = Burst(user_name, now + self._hold())
+            burst.messages.append((update_id, text))
+            burst.user_name = user_name
+
+            due = max(burst.due, now + self.quiet)
+            if burst.timer is not None:
+                if due <= burst.timer.due:
+                    return
+                self.scheduler.cancel(burst.timer)
+                self.rescheduled += 1
+            burst.timer = self.scheduler.schedule_at(due, self._fire, chat_id, burst)
+
+    def pending(self):
+        with self._lock:
+            return len(self._bursts)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "quiet": self.quiet,
+                "open_bursts": len(self._bursts),
+                "messages": self.messages,
+                "flushes": self.flushes,
+                "rescheduled": self.rescheduled
+            }
+
+    def _fire(self, chat_id, burst):
+        with self._lock:
+            if self._bursts.get(chat_id) is not burst:
+                return
+            # С этого момента новые сообщения чата идут в следующую серию
+            del self._bursts[chat_id]
+            self.flushes += 1
+        self.flush(chat_id, burst)
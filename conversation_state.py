@@ -0,0 +1,233 @@
+import random
+import time
+import zlib
+from enum import IntEnum
+
+
+class Stage(IntEnum):
+    """Стадии воронки диалога"""
+    AWAITING_PROBLEM = 0
+    GREETING = 1
+    PROBLEM_UNDERSTOOD = 2
+    OFFERING_HELP = 3
+    DISCUSSING_VALUE = 4
+    READY_FOR_PAYMENT = 5
+    AWAITING_PAYMENT = 6
+    WORKING = 7
+
+
+STAGE_NAMES = tuple(stage.name.lower() for stage in Stage)
+STAGE_IDS = {name: stage_id for stage_id, name in enumerate(STAGE_NAMES)}
+
+# Булевы поля упакованы в один int
+FLAG_BITS = {
+    'payment_offered': 1,
+    'payment_link_sent': 2,
+    'waiting_for_payment': 4,
+    'greeted': 8,
+}
+
+PLAIN_FIELDS = (
+    'user_name',
+    'problem',
+    'problem_type',
+    'trust_level',
+    'message_count',
+    'last_message_time',
+    'conversation_start',
+    'last_update_id',
+)
+
+KEYS = frozenset(PLAIN_FIELDS) | frozenset(FLAG_BITS) | {'stage', 'last_responses'}
+
+# Сколько секунд ответ считается недавним
+RECENT_WINDOW = 300
+
+# Истекшие записи выметаются, когда набор дорастает до кратного этому числу
+RECENT_SWEEP = 16
+
+
+def response_hash(text):
+    """Стабильный между процессами хеш начала ответа"""
+    return zlib.crc32(text[:30].encode())
+
+
+class ConversationState:
+    """Компактное состояние одного диалога
+
+    Стадия хранится как номер из Stage, флаги упакованы в биты, а
+    недавние ответы - словарь {хеш шаблона: когда отправлен}, так что
+    проверка повтора - один поиск по хешу.
+    Доступ по ключам как у словаря (state['stage'], state.get(...))
+    сохранен для совместимости со старым кодом.
+    """
+    __slots__ = (
+        'stage_id', 'flags',
+        'user_name', 'problem', 'problem_type', 'trust_level', 'message_count',
+        'last_message_time', 'conversation_start',
+        'last_update_id',
+        '_recent',
+    )
+
+    def __init__(self):
+        now = time.time()
+        self.stage_id = int(Stage.AWAITING_PROBLEM)
+        self.flags = 0
+        self.user_name = ''
+        self.problem = ''
+        self.problem_type = ''
+        self.trust_level = 0
+        self.message_count = 0
+        self.last_message_time = now
+        self.conversation_start = now
+        # Последний примененный апдейт: более ранние уже устарели
+        self.last_update_id = 0
+        # Набор недавних ответов создается при первом ответе
+        self._recent = None
+
+    @property
+    def stage(self):
+        return STAGE_NAMES[self.stage_id]
+
+    @stage.setter
+    def stage(self, name):
+        self.stage_id = STAGE_IDS[name]
+
+    # --- Недавние ответы ---
+
+    def mark_recent(self, value, at=None):
+        """Отмечает ответ с хешем value отправленным"""
+        now = time.time() if at is None else at
+        recent = self._recent
+        if recent is None:
+            recent = self._recent = {}
+        elif value not in recent and len(recent) % RECENT_SWEEP == 0:
+            # Выметаем редко: только когда набор дорос до очередного кратного RECENT_SWEEP
+            cutoff = now - RECENT_WINDOW
+            for stale in [h for h, t in recent.items() if t <= cutoff]:
+                del recent[stale]
+        recent[value] = now
+
+    def remember_response(self, text, at=None):
+        """Отмечает отправленным ответ по его тексту"""
+        self.mark_recent(response_hash(text), at)
+
+    def is_recent(self, value, window=RECENT_WINDOW):
+        """Отправлялся ли ответ с хешем value за последние window секунд"""
+        if self._recent is None:
+            return False
+        return self._recent.get(value, 0.0) > time.time() - window
+
+    def pick_fresh(self, hashes, window=RECENT_WINDOW):
+        """Индекс варианта, не отправлявшегося за window секунд
+
+        Выбор равновероятен среди свежих вариантов за один шаг; если
+        свежих нет, возвращается вариант, отправленный раньше всех.
+        """
+        recent = self._recent
+        if not recent:
+            return random.randrange(len(hashes))
+        cutoff = time.time() - window
+        get = recent.get
+        fresh = [i for i, value in enumerate(hashes) if get(value, 0.0) <= cutoff]
+        if fresh:
+            return random.choice(fresh)
+        return min(range(len(hashes)), key=lambda i: get(hashes[i], 0.0))
+
+    def recent_responses(self):
+        """Пары (хеш, время) от старых к новым"""
+        if self._recent is None:
+            return []
+        return sorted(self._recent.items(), key=lambda item: item[1])
+
+    # --- Совместимость со словарем ---
+
+    def __getitem__(self, key):
+        if key == 'stage':
+            return STAGE_NAMES[self.stage_id]
+        bit = FLAG_BITS.get(key)
+        if bit is not None:
+            return bool(self.flags & bit)
+        if key == 'last_responses':
+            return [{'hash': h, 'time': t} for h, t in self.recent_responses()]
+        if key in PLAIN_FIELDS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key == 'stage':
+            self.stage_id = STAGE_IDS[value]
+            return
+        bit = FLAG_BITS.get(key)
+        if bit is not None:
+            if value:
+                self.flags |= bit
+            else:
+                self.flags &= ~bit
+            return
+        if key in PLAIN_FIELDS:
+            setattr(self, key, value)
+            return
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in KEYS
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    # --- Сериализация ---
+
+    def to_dict(self):
+        """Состояние в виде JSON-совместимого словаря"""
+        data = {key: getattr(self, key) for key in PLAIN_FIELDS}
+        data['stage'] = self.stage
+        for key, bit in FLAG_BITS.items():
+            data[key] = bool(self.flags & bit)
+        data['last_responses'] = [[h, t] for h, t in self.recent_responses()]
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls()
+        for key in PLAIN_FIELDS:
+            if key in data:
+                setattr(state, key, data[key])
+        state.stage_id = STAGE_IDS.get(data.get('stage'), int(Stage.AWAITING_PROBLEM))
+        for key, bit in FLAG_BITS.items():
+            if data.get(key):
+                state.flags |= bit
+        for item in data.get('last_responses', ()):
+            # Старый формат хранил словари с началом текста
+            if isinstance(item, dict):
+                state.remember_response(item.get('text', ''), item.get('time'))
+            else:
+                state.mark_recent(*item)
+        return state
+
+    def to_tuple(self):
+        """Плоский кортеж для marshal"""
+        return (
+            self.stage_id, self.flags,
+            self.user_name, self.problem, self.problem_type, self.trust_level, self.message_count,
+            self.last_message_time, self.conversation_start,
+            self.last_update_id,
+            self._recent,
+        )
+
+    @classmethod
+    def from_tuple(cls, values):
+        state = cls.__new__(cls)
+        (state.stage_id, state.flags,
+         state.user_name, state.problem, state.problem_type, state.trust_level, state.message_count,
+         state.last_message_time, state.conversation_start,
+         state.last_update_id,
+         recent) = values
+        state._recent = dict(recent) if recent is not None else None
+        return state
+
+    def __repr__(self):
+        return f"ConversationState(stage={self.stage!r}, messages={self.message_count})"
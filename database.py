@@ -1,77 +1,412 @@
 import os
 import json
+import atexit
+import bisect
+import itertools
 import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+# Сколько сообщений истории храним на пользователя
+CONVERSATION_LIMIT = 20
+
+
+class UserReadings:
+    """Расклады одного пользователя по времени: числовые ts и сами записи
+
+    Записи приходят почти всегда по возрастанию времени, поэтому вставка -
+    это append; bisect нужен только если часы сдвинулись назад.
+    """
+    __slots__ = ('ts', 'items')
+
+    def __init__(self):
+        self.ts = []
+        self.items = []
+
+    def add(self, ts, reading):
+        if not self.ts or ts >= self.ts[-1]:
+            self.ts.append(ts)
+            self.items.append(reading)
+        else:
+            i = bisect.bisect_right(self.ts, ts)
+            self.ts.insert(i, ts)
+            self.items.insert(i, reading)
+
+    def latest(self, limit):
+        """Последние limit записей, новые сначала - O(limit)"""
+        if limit <= 0:
+            return []
+        return self.items[:-limit - 1:-1]
+
+    def between(self, since=None, until=None):
+        """Записи с since <= ts <= until по возрастанию времени"""
+        lo = 0 if since is None else bisect.bisect_left(self.ts, since)
+        hi = len(self.ts) if until is None else bisect.bisect_right(self.ts, until)
+        return self.items[lo:hi]
+
+
 # Простая in-memory база для старта
 class SimpleDB:
     def __init__(self):
         self.users = {}
         self.readings = {}
         self.conversations = {}
-    
+        # Вторичный индекс: user_id -> UserReadings
+        self._user_readings = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
     def save_reading(self, user_id, question, card, interpretation):
         """Сохраняет расклад"""
         try:
-            reading_id = f"{user_id}_{datetime.now().timestamp()}"
-            self.readings[reading_id] = {
+            ts = time.time()
+            reading = {
                 'user_id': user_id,
                 'question': question,
                 'card': card,
                 'interpretation': interpretation,
-                'timestamp': datetime.now().isoformat()
+                'ts': ts,
+                'timestamp': datetime.fromtimestamp(ts).isoformat()
             }
+            with self._lock:
+                # Порядковый номер не совпадает у двух раскладов одной секунды, в отличие от времени
+                reading_id = f"{user_id}_{next(self._ids)}"
+                self.readings[reading_id] = reading
+                index = self._user_readings.get(user_id)
+                if index is None:
+                    index = self._user_readings[user_id] = UserReadings()
+                index.add(ts, reading)
             return reading_id
         except Exception as e:
-            logger.error(f"Error saving reading: {e}")
+            logger.error("Error saving reading: %s", e)
             return None
-    
+
     def get_user_readings(self, user_id, limit=10):
-        """Получает расклады пользователя"""
+        """Получает последние расклады пользователя (новые сначала)"""
+        try:
+            index = self._user_readings.get(user_id)
+            if index is None:
+                return []
+            with self._lock:
+                return index.latest(limit)
+        except Exception as e:
+            logger.error("Error getting readings: %s", e)
+            return []
+
+    def get_user_readings_between(self, user_id, since=None, until=None):
+        """Расклады пользователя за период (unix-время, границы включительно), старые сначала"""
         try:
-            user_readings = []
-            for reading_id, reading in self.readings.items():
-                if reading['user_id'] == user_id:
-                    user_readings.append(reading)
-            
-            # Сортируем по времени (новые сначала)
-            user_readings.sort(key=lambda x: x['timestamp'], reverse=True)
-            return user_readings[:limit]
+            index = self._user_readings.get(user_id)
+            if index is None:
+                return []
+            with self._lock:
+                return index.between(since, until)
         except Exception as e:
-            logger.error(f"Error getting readings: {e}")
+            logger.error("Error getting readings: %s", e)
             return []
-    
+
     def save_conversation(self, user_id, role, content):
         """Сохраняет сообщение в историю"""
         try:
-            if user_id not in self.conversations:
-                self.conversations[user_id] = []
-            
-            # Ограничиваем историю до 20 сообщений
-            if len(self.conversations[user_id]) >= 20:
-                self.conversations[user_id].pop(0)
-            
-            self.conversations[user_id].append({
+            history = self.conversations.get(user_id)
+            if history is None:
+                # Ограничиваем историю до 20 сообщений: старые вытесняются сами
+                history = self.conversations.setdefault(user_id, deque(maxlen=CONVERSATION_LIMIT))
+
+            history.append({
                 'role': role,
                 'content': content,
                 'timestamp': datetime.now().isoformat()
             })
             return True
         except Exception as e:
-            logger.error(f"Error saving conversation: {e}")
+            logger.error("Error saving conversation: %s", e)
             return False
-    
+
     def get_conversation_history(self, user_id, limit=10):
         """Получает историю разговоров"""
         try:
-            if user_id in self.conversations:
-                return self.conversations[user_id][-limit:]
+            history = self.conversations.get(user_id)
+            if history is None or limit <= 0:
+                return []
+            return list(history)[-limit:]
+        except Exception as e:
+            logger.error("Error getting conversation history: %s", e)
             return []
+
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS readings ("
+    "id TEXT PRIMARY KEY, user_id INTEGER NOT NULL, ts REAL NOT NULL, "
+    "question TEXT, card TEXT, interpretation TEXT)",
+    "CREATE INDEX IF NOT EXISTS readings_user_ts ON readings (user_id, ts)",
+    "CREATE TABLE IF NOT EXISTS conversations ("
+    "id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, ts REAL NOT NULL, "
+    "role TEXT NOT NULL, content TEXT NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS conversations_user_ts ON conversations (user_id, ts)",
+)
+
+# SQL-тексты постоянные: sqlite3 держит их скомпилированными в кэше соединения
+INSERT_READING_SQL = "INSERT OR IGNORE INTO readings (id, user_id, ts, question, card, interpretation) VALUES (?, ?, ?, ?, ?, ?)"
+INSERT_MESSAGE_SQL = "INSERT INTO conversations (user_id, ts, role, content) VALUES (?, ?, ?, ?)"
+PRUNE_MESSAGES_SQL = (
+    "DELETE FROM conversations WHERE id IN ("
+    "SELECT id FROM conversations WHERE user_id = ? ORDER BY ts DESC, id DESC LIMIT -1 OFFSET ?)"
+)
+LATEST_READINGS_SQL = (
+    "SELECT id, user_id, ts, question, card, interpretation FROM readings "
+    "WHERE user_id = ? ORDER BY ts DESC LIMIT ?"
+)
+READINGS_BETWEEN_SQL = (
+    "SELECT id, user_id, ts, question, card, interpretation FROM readings "
+    "WHERE user_id = ? AND ts >= ? AND ts <= ? ORDER BY ts"
+)
+LATEST_MESSAGES_SQL = (
+    "SELECT ts, role, content FROM conversations "
+    "WHERE user_id = ? ORDER BY ts DESC, id DESC LIMIT ?"
+)
+
+
+def _reading(row):
+    reading_id, user_id, ts, question, card, interpretation = row
+    return {
+        'id': reading_id,
+        'user_id': user_id,
+        'question': question,
+        'card': json.loads(card) if card is not None else None,
+        'interpretation': interpretation,
+        'ts': ts,
+        'timestamp': datetime.fromtimestamp(ts).isoformat()
+    }
+
+
+class SqliteDB:
+    """Те же методы, что у SimpleDB, но данные в SQLite и переживают деплой
+
+    save_reading и save_conversation только кладут строку в буфер: поток-
+    писатель раз в commit_interval фиксирует все накопленное одной
+    транзакцией (WAL, synchronous=NORMAL), так что webhook не ждет диска.
+    Цена - окно commit_interval, в которое запись может потеряться при
+    падении процесса.
+
+    Чтение видит и зафиксированные строки, и еще лежащие в буфере.
+    Буфер с фиксацией согласованы через счетчик коммитов (seqlock):
+    если коммит прошел, пока шел запрос, чтение повторяется, поэтому
+    строка не попадет в ответ дважды и не потеряется.
+    """
+
+    def __init__(self, path, commit_interval=0.05):
+        self.path = path
+        self.commit_interval = commit_interval
+        self._lock = threading.Lock()
+        self._commit_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._local = threading.local()
+        # Буфер и пачка, которая фиксируется прямо сейчас
+        self._readings = []
+        self._messages = []
+        self._inflight_readings = []
+        self._inflight_messages = []
+        # Нечетное значение - идет COMMIT
+        self._seq = 0
+        self._writer = None
+        self.commits = 0
+        self.committed_rows = 0
+
+    def _conn(self):
+        # Соединения и поток-писатель создаются лениво, уже после fork() в gunicorn
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, cached_statements=64)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in SCHEMA:
+                conn.execute(statement)
+            self._local.conn = conn
+        return conn
+
+    def _ensure_writer(self):
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._run, name='db-writer', daemon=True)
+                    self._writer.start()
+                    atexit.register(self.flush)
+
+    def save_reading(self, user_id, question, card, interpretation):
+        """Сохраняет расклад (фиксируется групповым коммитом)"""
+        try:
+            self._ensure_writer()
+            reading_id = uuid.uuid4().hex
+            row = (reading_id, user_id, time.time(), question, json.dumps(card, ensure_ascii=False), interpretation)
+            with self._lock:
+                self._readings.append(row)
+            self._wake.set()
+            return reading_id
+        except Exception as e:
+            logger.error("Error saving reading: %s", e)
+            return None
+
+    def save_conversation(self, user_id, role, content):
+        """Сохраняет сообщение в историю (фиксируется групповым коммитом)"""
+        try:
+            self._ensure_writer()
+            with self._lock:
+                self._messages.append((user_id, time.time(), role, content))
+            self._wake.set()
+            return True
+        except Exception as e:
+            logger.error("Error saving conversation: %s", e)
+            return False
+
+    def _read(self, query, pick):
+        """Запрос к базе плюс подходящие строки буфера, без дублей и пропусков"""
+        while True:
+            with self._lock:
+                seq = self._seq
+                if seq % 2 == 0:
+                    buffered = pick(self._inflight_readings + self._readings, self._inflight_messages + self._messages)
+            if seq % 2:
+                # Идет COMMIT: через мгновение строки будут уже в базе
+                time.sleep(0.001)
+                continue
+            rows = query(self._conn())
+            with self._lock:
+                if self._seq == seq:
+                    return buffered, rows
+
+    def get_user_readings(self, user_id, limit=10):
+        """Получает последние расклады пользователя (новые сначала)"""
+        try:
+            if limit <= 0:
+                return []
+            buffered, rows = self._read(
+                lambda conn: conn.execute(LATEST_READINGS_SQL, (user_id, limit)).fetchall(),
+                lambda readings, messages: [row for row in readings if row[1] == user_id]
+            )
+            # Буфер всегда новее базы
+            buffered.sort(key=lambda row: row[2], reverse=True)
+            return [_reading(row) for row in (buffered + rows)[:limit]]
+        except Exception as e:
+            logger.error("Error getting readings: %s", e)
+            return []
+
+    def get_user_readings_between(self, user_id, since=None, until=None):
+        """Расклады пользователя за период (unix-время, границы включительно), старые сначала"""
+        try:
+            low = float('-inf') if since is None else since
+            high = float('inf') if until is None else until
+            buffered, rows = self._read(
+                lambda conn: conn.execute(READINGS_BETWEEN_SQL, (user_id, low, high)).fetchall(),
+                lambda readings, messages: [row for row in readings if row[1] == user_id and low <= row[2] <= high]
+            )
+            buffered.sort(key=lambda row: row[2])
+            return [_reading(row) for row in rows + buffered]
         except Exception as e:
-            logger.error(f"Error getting conversation history: {e}")
+            logger.error("Error getting readings: %s", e)
             return []
 
+    def get_conversation_history(self, user_id, limit=10):
+        """Получает историю разговоров"""
+        try:
+            limit = min(limit, CONVERSATION_LIMIT)
+            if limit <= 0:
+                return []
+            buffered, rows = self._read(
+                lambda conn: conn.execute(LATEST_MESSAGES_SQL, (user_id, limit)).fetchall(),
+                lambda readings, messages: [row[1:] for row in messages if row[0] == user_id]
+            )
+            history = rows[::-1] + buffered
+            return [
+                {'role': role, 'content': content, 'timestamp': datetime.fromtimestamp(ts).isoformat()}
+                for ts, role, content in history[-limit:]
+            ]
+        except Exception as e:
+            logger.error("Error getting conversation history: %s", e)
+            return []
+
+    def flush(self):
+        """Синхронно фиксирует буфер (при остановке процесса)"""
+        self._commit()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "buffered": len(self._readings) + len(self._messages),
+                "commits": self.commits,
+                "committed_rows": self.committed_rows
+            }
+
+    def _commit(self):
+        with self._commit_lock:
+            with self._lock:
+                if not self._readings and not self._messages:
+                    return
+                readings, self._readings = self._readings, []
+                messages, self._messages = self._messages, []
+                self._inflight_readings, self._inflight_messages = readings, messages
+
+            conn = self._conn()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    if readings:
+                        conn.executemany(INSERT_READING_SQL, readings)
+                    if messages:
+                        conn.executemany(INSERT_MESSAGE_SQL, messages)
+                        # Храним не больше CONVERSATION_LIMIT сообщений на пользователя
+                        conn.executemany(
+                            PRUNE_MESSAGES_SQL,
+                            [(user_id, CONVERSATION_LIMIT) for user_id in {row[0] for row in messages}]
+                        )
+                    with self._lock:
+                        self._seq += 1
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+            except BaseException:
+                # Пачка не записалась: возвращаем ее в начало буфера до следующей попытки
+                with self._lock:
+                    self._readings = readings + self._readings
+                    self._messages = messages + self._messages
+                    self._inflight_readings, self._inflight_messages = [], []
+                    if self._seq % 2:
+                        self._seq += 1
+                raise
+
+            with self._lock:
+                self._inflight_readings, self._inflight_messages = [], []
+                self._seq += 1
+                self.commits += 1
+                self.committed_rows += len(readings) + len(messages)
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            # Даем буферу набраться: одна транзакция на все, что пришло за интервал
+            time.sleep(self.commit_interval)
+            self._wake.clear()
+            try:
+                self._commit()
+            except Exception as e:
+                logger.error("🚨 Ошибка записи в базу: %s", e)
+
+
+def create_db():
+    """База по DB_BACKEND: memory (по умолчанию) или sqlite (DB_PATH)"""
+    if os.environ.get('DB_BACKEND', 'memory') == 'sqlite':
+        return SqliteDB(
+            os.environ.get('DB_PATH', 'tarot.db'),
+            commit_interval=float(os.environ.get('DB_COMMIT_INTERVAL', 0.05))
+        )
+    return SimpleDB()
+
 # Глобальная база данных
-db = SimpleDB()
+db = create_db()
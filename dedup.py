@@ -0,0 +1,81 @@
+import fcntl
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+# Слот окна: update_id и время, когда он был отмечен
+SLOT = struct.Struct('<qd')
+
+
+class UpdateDeduplicator:
+    """Скользящее окно по update_id в общей для всех воркеров памяти
+
+    update_id от Telegram монотонно растет, поэтому окно - это кольцевой
+    массив фиксированного размера в mmap-файле: слот update_id % size
+    хранит сам update_id и время отметки. Проверка и отметка - O(1),
+    память ограничена размером окна, а запись старше ttl считается
+    истекшей. Все gunicorn-воркеры открывают один и тот же файл, а
+    проверка-с-отметкой атомарна за счет flock.
+    """
+
+    def __init__(self, path=None, size=65536, ttl=600):
+        self.path = path or os.path.join(tempfile.gettempdir(), 'tarot_bot_updates.dedup')
+        self.size = size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+        length = size * SLOT.size
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size != length:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(self._fd).st_size != length:
+                    os.ftruncate(self._fd, 0)
+                    os.ftruncate(self._fd, length)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, length)
+        # Счетчики этого процесса для /debug: без прохода по окну
+        self.marked = 0
+        self.duplicates = 0
+
+    def check_and_mark(self, update_id):
+        """Отмечает update_id и возвращает True, если он уже был обработан"""
+        offset = (update_id % self.size) * SLOT.size
+        now = time.time()
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                seen_id, seen_at = SLOT.unpack_from(self._map, offset)
+                if seen_id == update_id and now - seen_at < self.ttl:
+                    self.duplicates += 1
+                    return True
+                SLOT.pack_into(self._map, offset, update_id, now)
+                self.marked += 1
+                return False
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def forget(self, update_id):
+        """Снимает отметку, если апдейт так и не был принят в обработку"""
+        if update_id is None:
+            return
+        offset = (update_id % self.size) * SLOT.size
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                seen_id, _ = SLOT.unpack_from(self._map, offset)
+                if seen_id == update_id:
+                    SLOT.pack_into(self._map, offset, 0, 0.0)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def stats(self):
+        return {"window": self.size, "ttl": self.ttl, "marked": self.marked, "duplicates": self.duplicates}
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
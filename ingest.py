@@ -0,0 +1,220 @@
+import logging
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ('block', 'shed_oldest', 'reject')
+
+
+class IngestQueue:
+    """Ограниченная очередь входящих апдейтов с пулом обработчиков
+
+    webhook только кладет апдейт в очередь и сразу отвечает Telegram,
+    а обработку выполняют workers потоков. Что делать при переполнении,
+    задает policy:
+      block       - ждать свободного места до block_timeout, затем отказ;
+      shed_oldest - выбросить самый старый апдейт и принять новый;
+      reject      - сразу отказать (webhook вернет 503, Telegram повторит).
+    """
+
+    def __init__(self, handler, workers=4, maxsize=1000, policy='block', block_timeout=5.0, name='ingest'):
+        if policy not in POLICIES:
+            raise ValueError(f"Неизвестная политика очереди: {policy}")
+        self.handler = handler
+        self.maxsize = maxsize
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self._workers = workers
+        self._name = name
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._threads = []
+
+        # Метрики
+        self.accepted = 0
+        self.processed = 0
+        self.failed = 0
+        self.shed = 0
+        self.rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _ensure_started(self):
+        # Потоки стартуют лениво, чтобы не создавать их до fork() в gunicorn
+        if self._threads:
+            return
+        for i in range(self._workers):
+            thread = threading.Thread(target=self._run, name=f"{self._name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, item):
+        """Кладет апдейт в очередь; False, если он не принят"""
+        with self._cond:
+            self._ensure_started()
+
+            if self._size() >= self.maxsize:
+                if self.policy == 'shed_oldest':
+                    self._drop_oldest()
+                    self.shed += 1
+                elif self.policy == 'block':
+                    deadline = time.monotonic() + self.block_timeout
+                    while self._size() >= self.maxsize:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.rejected += 1
+                            return False
+                        self._cond.wait(remaining)
+                else:
+                    self.rejected += 1
+                    return False
+
+            self._push(time.monotonic(), item)
+            self.accepted += 1
+            self._cond.notify_all()
+            return True
+
+    def depth(self):
+        return self._size()
+
+    def stats(self):
+        with self._cond:
+            done = self.processed + self.failed
+            return {
+                "depth": self._size(),
+                "capacity": self.maxsize,
+                "policy": self.policy,
+                "workers": len(self._threads),
+                "accepted": self.accepted,
+                "processed": self.processed,
+                "failed": self.failed,
+                "shed": self.shed,
+                "rejected": self.rejected,
+                "wait_avg": self._wait_total / done if done else 0.0,
+                "wait_max": self._wait_max
+            }
+
+    # Хранилище очереди; все методы ниже вызываются под self._cond
+
+    def _size(self):
+        return len(self._items)
+
+    def _push(self, enqueued_at, item):
+        self._items.append((enqueued_at, item))
+
+    def _drop_oldest(self):
+        self._items.popleft()
+
+    def _has_ready(self):
+        return bool(self._items)
+
+    def _take(self):
+        return self._items.popleft()
+
+    def _release(self, item):
+        pass
+
+    def _next(self):
+        with self._cond:
+            while not self._has_ready():
+                self._cond.wait()
+            enqueued_at, item = self._take()
+            # Освободилось место: будим тех, кто ждет в submit()
+            self._cond.notify_all()
+        return time.monotonic() - enqueued_at, item
+
+    def _run(self):
+        while True:
+            wait, item = self._next()
+            try:
+                self.handler(item)
+                ok = True
+            except Exception as e:
+                logger.error("🚨 Ошибка обработки апдейта: %s", e)
+                ok = False
+
+            with self._cond:
+                if ok:
+                    self.processed += 1
+                else:
+                    self.failed += 1
+                self._wait_total += wait
+                if wait > self._wait_max:
+                    self._wait_max = wait
+                self._release(item)
+
+
+class MailboxQueue(IngestQueue):
+    """Очередь с почтовым ящиком на каждый чат
+
+    Апдейты одного чата (key(item)) обрабатываются строго по порядку и
+    никогда одновременно, а разные чаты идут параллельно на всех workers.
+    В общей очереди готовности стоят чаты, а не апдейты: воркер берет
+    чат, обрабатывает один его апдейт и, если в ящике есть еще, ставит
+    чат в конец очереди, чтобы болтливый чат не занимал воркера целиком.
+    Ящик создается при первом апдейте и удаляется, как только опустел.
+
+    Порядок держится только внутри процесса: апдейты одного чата, которые
+    Telegram прислал разным gunicorn-воркерам, упорядочивает update_id
+    в состоянии диалога (ConversationState.last_update_id).
+    """
+
+    def __init__(self, handler, key, **kwargs):
+        super().__init__(handler, **kwargs)
+        self.key = key
+        self._mailboxes = {}
+        self._ready = deque()
+        self._owned = set()
+        self._count = 0
+
+    def _size(self):
+        return self._count
+
+    def _push(self, enqueued_at, item):
+        key = self.key(item)
+        mailbox = self._mailboxes.get(key)
+        if mailbox is None:
+            mailbox = self._mailboxes[key] = deque()
+            self._ready.append(key)
+        mailbox.append((enqueued_at, item))
+        self._count += 1
+
+    def _drop_oldest(self):
+        # Самый давно ждущий чат стоит в начале очереди готовности
+        if self._ready:
+            key = self._ready[0]
+        else:
+            key = next(key for key, mailbox in self._mailboxes.items() if mailbox)
+        mailbox = self._mailboxes[key]
+        mailbox.popleft()
+        self._count -= 1
+        if not mailbox and key not in self._owned:
+            del self._mailboxes[key]
+            self._ready.remove(key)
+
+    def _has_ready(self):
+        return bool(self._ready)
+
+    def _take(self):
+        key = self._ready.popleft()
+        self._owned.add(key)
+        self._count -= 1
+        return self._mailboxes[key].popleft()
+
+    def _release(self, item):
+        key = self.key(item)
+        self._owned.discard(key)
+        if self._mailboxes[key]:
+            self._ready.append(key)
+            self._cond.notify()
+        else:
+            del self._mailboxes[key]
+
+    def stats(self):
+        stats = super().stats()
+        with self._cond:
+            stats["mailboxes"] = len(self._mailboxes)
+            stats["busy_chats"] = len(self._owned)
+        return stats
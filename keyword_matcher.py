@@ -0,0 +1,84 @@
+import re
+
+# Ключевые слова классификаторов: категория -> подстроки (в нижнем регистре).
+# Совпадение ищется как подстрока, как и раньше ('да' найдется и в 'когда').
+KEYWORDS = {
+    'problem': (
+        'не могу', 'не знаю', 'проблем', 'ситуац', 'трудност', 'сложност',
+        'боюсь', 'страшно', 'волнуюсь', 'переживаю', 'хочу понять',
+        'как быть', 'что делать', 'помогите', 'совет', 'мне нужн', 'у меня',
+        'хочу узнать', 'интересно', 'скажите', 'подскажите'
+    ),
+    'отношения': ('девушк', 'парн', 'мужчин', 'женщин', 'любов', 'отношен', 'семь', 'брак'),
+    'работа': ('работ', 'карьер', 'начальник', 'коллег', 'зарплат', 'офис', 'проект'),
+    'деньги': ('деньг', 'финанс', 'долг', 'кредит', 'заработ', 'бизнес', 'куп'),
+    'здоровье': ('здоров', 'болезн', 'боль', 'врач', 'лечен', 'энерг', 'устал'),
+    'выбор': ('выбор', 'решен', 'сомнен', 'не уверен', 'не знаю как'),
+    'positive': ('да', 'хочу', 'готов', 'соглас', 'интересно', 'можно', 'попробую', 'давай'),
+    'price': ('сколько', 'цена', 'стоимость', '990'),
+    'purchase': ('готов', 'куплю', 'оплат'),
+    'ready': ('готов', 'давай', 'хочу', 'куплю', 'оплат'),
+    'paid': ('оплат', 'перевел', 'сделал', 'оплатил'),
+}
+
+# Типы проблем в порядке приоритета analyze_problem_type
+PROBLEM_TYPES = ('отношения', 'работа', 'деньги', 'здоровье', 'выбор')
+
+
+def _trie_pattern(words):
+    """Собирает из слов регулярку в виде префиксного дерева"""
+    root = {}
+    for word in words:
+        node = root
+        for ch in word:
+            node = node.setdefault(ch, {})
+        node[''] = True
+
+    def build(node):
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if '' in node:
+            # Слово кончается здесь, но жадный ? сначала пробует более длинное
+            return '(?:' + body + ')?'
+        return body
+
+    return build(root)
+
+
+class KeywordMatcher:
+    """Один проход по сообщению для всех классификаторов
+
+    Все ключевые слова собраны в одну регулярку-дерево, которая на
+    каждой позиции находит самое длинное слово. Каждому слову заранее
+    приписаны категории всех слов, которые в него входят, поэтому
+    вложенные совпадения ('оплат' внутри 'оплатил') не теряются.
+    """
+
+    def __init__(self, keywords):
+        words = {word for group in keywords.values() for word in group}
+        self._categories = {}
+        for word in words:
+            self._categories[word] = frozenset(
+                category
+                for category, group in keywords.items()
+                for other in group
+                if other in word
+            )
+        self._search = re.compile(_trie_pattern(words)).search
+
+    def match(self, text):
+        """Возвращает множество категорий, чьи слова встречаются в тексте"""
+        text = text.lower()
+        search = self._search
+        categories = self._categories
+        found = frozenset()
+        m = search(text)
+        while m is not None:
+            found |= categories[m.group()]
+            m = search(text, m.start() + 1)
+        return found
+
+
+matcher = KeywordMatcher(KEYWORDS)
@@ -0,0 +1,147 @@
+"""Настройка логирования: запись в отдельном потоке и выборка частых событий
+
+Потоки webhook, пула и доставки только кладут LogRecord в очередь, а
+форматирование и запись в stdout делает поток QueueListener. Поэтому
+медленный вывод (pipe на Render) не задерживает обработку. Если очередь
+переполнена, запись отбрасывается и учитывается в stats(), а не
+блокирует поток.
+
+Переменные окружения:
+    LOG_LEVEL=INFO          уровень корневого логгера (OFF - выключить логи)
+    LOG_FORMAT=...          формат строки, как в basicConfig
+    LOG_FILE=path           писать в файл вместо stderr
+    LOG_CONFIG=path.json    своя конфигурация logging.config.dictConfig;
+                            ее обработчики тоже переводятся за очередь
+    LOG_ASYNC=1             0 - писать синхронно, как раньше
+    LOG_QUEUE_SIZE=10000    размер очереди записей
+    LOG_SAMPLE=incoming=0.1,stage=0.1
+                            доля записей, которые пишутся для события;
+                            событие задается через extra={'event': ...}
+"""
+import atexit
+import json
+import logging
+import logging.config
+import logging.handlers
+import os
+import queue
+import random
+
+DEFAULT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listener = None
+_queue_handler = None
+_sampler = None
+_configured = False
+
+
+def parse_rates(spec):
+    """'incoming=0.1,stage=0.5' -> {'incoming': 0.1, 'stage': 0.5}"""
+    rates = {}
+    for item in (spec or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        event, _, rate = item.partition('=')
+        try:
+            rates[event.strip()] = float(rate)
+        except ValueError:
+            raise ValueError(f"Неверная доля в LOG_SAMPLE: {item!r}")
+    return rates
+
+
+class EventSampler(logging.Filter):
+    """Пропускает долю записей событий из rates, остальные записи - все"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+        self.suppressed = {}
+        # Свой генератор: выборка не сдвигает общий random (replay.py засевает его)
+        self._random = random.Random()
+
+    def filter(self, record):
+        event = record.__dict__.get('event')
+        if event is None:
+            return True
+        rate = self.rates.get(event)
+        if rate is None or rate >= 1 or self._random.random() < rate:
+            return True
+        self.suppressed[event] = self.suppressed.get(event, 0) + 1
+        return False
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который не форматирует запись в вызывающем потоке
+
+    Сообщение собирается из msg и args уже в потоке QueueListener.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging():
+    """Настраивает корневой логгер по переменным окружения (один раз на процесс)"""
+    global _listener, _queue_handler, _sampler, _configured
+    if _configured:
+        return
+    _configured = True
+
+    level = os.environ.get('LOG_LEVEL', 'INFO').upper()
+    if level == 'OFF':
+        logging.disable(logging.CRITICAL)
+        return
+
+    config_path = os.environ.get('LOG_CONFIG')
+    if config_path:
+        with open(config_path, encoding='utf-8') as f:
+            logging.config.dictConfig(json.load(f))
+    else:
+        log_file = os.environ.get('LOG_FILE')
+        logging.basicConfig(
+            level=level,
+            format=os.environ.get('LOG_FORMAT', DEFAULT_FORMAT),
+            **({'filename': log_file} if log_file else {})
+        )
+
+    root = logging.getLogger()
+    _sampler = EventSampler(parse_rates(os.environ.get('LOG_SAMPLE')))
+
+    if os.environ.get('LOG_ASYNC', '1').lower() in ('0', 'false', 'no'):
+        for handler in root.handlers:
+            handler.addFilter(_sampler)
+        return
+
+    handlers = list(root.handlers)
+    log_queue = queue.Queue(maxsize=int(os.environ.get('LOG_QUEUE_SIZE', 10000)))
+    _queue_handler = DroppingQueueHandler(log_queue)
+    _queue_handler.addFilter(_sampler)
+    for handler in handlers:
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+
+    # Поток записи стартует в каждом gunicorn-воркере при импорте приложения
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def stats():
+    """Состояние логирования для /debug"""
+    return {
+        "async": _queue_handler is not None,
+        "queued": _queue_handler.queue.qsize() if _queue_handler is not None else 0,
+        "dropped": _queue_handler.dropped if _queue_handler is not None else 0,
+        "suppressed": dict(_sampler.suppressed) if _sampler is not None else {}
+    }
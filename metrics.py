@@ -0,0 +1,409 @@
+"""Метрики в формате Prometheus (text exposition 0.0.4)
+
+Счетчики и гистограммы пишутся без блокировок: у каждого потока свой
+шард (словарь в threading.local), и горячий путь - это одно сложение в
+словаре своего потока. Шарды суммируются только при сборе; шарды
+завершившихся потоков при этом сворачиваются в общий итог.
+
+Каждый процесс раз в METRICS_FLUSH_INTERVAL секунд (и при каждом
+запросе /metrics) сохраняет свой снимок в METRICS_DIR/<pid>.json, а
+/metrics суммирует снимки всех процессов, поэтому любой gunicorn-воркер
+отдает общую картину. Gauge-значение суммируется по процессам, только
+если оно свое у каждого процесса (aggregate='sum'); значение общего
+ресурса (aggregate='local') берется у процесса, который отдает /metrics.
+Счетчики умерших воркеров сохраняются (счетчик не должен уменьшаться):
+их снимки сворачиваются в retired.json и удаляются, gauge-значения
+отбрасываются. По умолчанию каталог свой у каждого gunicorn-мастера
+(по pid родителя), так что прошлые запуски не подмешиваются.
+"""
+import bisect
+import fcntl
+import glob
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Итог счетчиков умерших процессов
+RETIRED_FILE = 'retired.json'
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _ShardedMetric:
+    """Общая часть счетчика и гистограммы: шард на поток"""
+    type = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._registry = registry
+        self._local = threading.local()
+        # [(поток, шард)] живых потоков и итог завершившихся
+        self._shards = []
+        self._retired = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+            self._registry.start()
+        return shard
+
+    def _merge(self, total, values):
+        raise NotImplementedError
+
+    def collect(self):
+        """Сумма по всем шардам: {значения меток: значение}"""
+        total = {}
+        with self._lock:
+            alive = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, shard))
+                else:
+                    # Поток завершился: его шард больше не меняется
+                    self._merge(self._retired, shard)
+            self._shards = alive
+            self._merge(total, self._retired)
+            shards = [shard for _, shard in alive]
+        for shard in shards:
+            self._merge(total, dict(shard))
+        return total
+
+
+class Counter(_ShardedMetric):
+    type = 'counter'
+
+    def inc(self, *labelvalues, amount=1):
+        shard = self._local.__dict__.get('shard') or self._shard()
+        shard[labelvalues] = shard.get(labelvalues, 0) + amount
+
+    def _merge(self, total, values):
+        for key, value in values.items():
+            total[key] = total.get(key, 0) + value
+
+    def snapshot(self):
+        return [[list(key), value] for key, value in self.collect().items()]
+
+
+class Histogram(_ShardedMetric):
+    type = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(registry, name, documentation, labelnames)
+
+    def observe(self, value, *labelvalues):
+        shard = self._local.__dict__.get('shard') or self._shard()
+        cells = shard.get(labelvalues)
+        if cells is None:
+            # Корзины без накопления, затем сумма и количество
+            cells = shard[labelvalues] = [0] * (len(self.buckets) + 3)
+        cells[bisect.bisect_left(self.buckets, value)] += 1
+        cells[-2] += value
+        cells[-1] += 1
+
+    def time(self, *labelvalues):
+        return _Timer(self, labelvalues)
+
+    def _merge(self, total, values):
+        for key, cells in values.items():
+            current = total.get(key)
+            if current is None:
+                total[key] = list(cells)
+            else:
+                for i, value in enumerate(cells):
+                    current[i] += value
+
+    def snapshot(self):
+        return [[list(key), cells] for key, cells in self.collect().items()]
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labelvalues', 'started')
+
+    def __init__(self, histogram, labelvalues):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labelvalues)
+
+
+class Gauge:
+    """Значение, которое читается из callback в момент сбора
+
+    aggregate - как сводить значения процессов: 'sum' для своих у каждого
+    процесса (очереди, потоки), 'local' для общего ресурса (хранилище
+    на диске) - тогда берется значение процесса, который отдает /metrics.
+    """
+    type = 'gauge'
+
+    def __init__(self, registry, name, documentation, callback, aggregate='sum'):
+        if aggregate not in ('sum', 'local'):
+            raise ValueError(f"Неизвестный способ сведения gauge: {aggregate}")
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = ()
+        self.callback = callback
+        self.aggregate = aggregate
+        registry.register(self)
+
+    def snapshot(self):
+        try:
+            return [[[], float(self.callback())]]
+        except Exception as e:
+            logger.error("Ошибка метрики %s: %s", self.name, e)
+            return []
+
+
+class Registry:
+    """Метрики процесса и их сборка по всем воркерам"""
+
+    def __init__(self, directory=None, flush_interval=5.0):
+        self.directory = directory or os.environ.get('METRICS_DIR') or os.path.join(
+            tempfile.gettempdir(), f"tarot_bot_metrics_{os.getppid()}"
+        )
+        self.flush_interval = flush_interval
+        self._metrics = []
+        self._lock = threading.Lock()
+        self._flusher = None
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return Counter(self, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), **kwargs):
+        return Histogram(self, name, documentation, labelnames, **kwargs)
+
+    def gauge(self, name, documentation, callback, aggregate='sum'):
+        return Gauge(self, name, documentation, callback, aggregate)
+
+    def start(self):
+        # Поток сброса стартует при первом событии, уже после fork() в gunicorn
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run, name='metrics-flush', daemon=True)
+                self._flusher.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.write_snapshot()
+            except Exception as e:
+                logger.error("Ошибка сохранения метрик: %s", e)
+
+    def snapshot(self):
+        """Снимок метрик этого процесса"""
+        with self._lock:
+            metrics = list(self._metrics)
+        return {
+            "pid": os.getpid(),
+            "metrics": {
+                metric.name: {
+                    "type": metric.type,
+                    "help": metric.documentation,
+                    "labels": list(metric.labelnames),
+                    "buckets": list(getattr(metric, 'buckets', ())),
+                    "aggregate": getattr(metric, 'aggregate', 'sum'),
+                    "values": metric.snapshot()
+                }
+                for metric in metrics
+            }
+        }
+
+    def write_snapshot(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def _read_snapshots(self):
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            snapshot = _load(path)
+            if snapshot is not None:
+                snapshots.append(snapshot)
+        return snapshots
+
+    def retire_dead(self):
+        """Сворачивает снимки умерших процессов в retired.json и удаляет их
+
+        Возвращает число свернутых снимков. Воркеры сворачивают под
+        flock, так что каждый снимок попадает в итог один раз.
+        """
+        dead = []
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            pid = os.path.basename(path)[:-len('.json')]
+            if pid.isdigit() and not _pid_alive(int(pid)):
+                dead.append(path)
+        if not dead:
+            return 0
+
+        retired_path = os.path.join(self.directory, RETIRED_FILE)
+        with open(os.path.join(self.directory, 'retired.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            merged = {}
+            retired = _load(retired_path)
+            if retired is not None:
+                _merge_snapshot(merged, retired, gauges=False)
+            folded = []
+            for path in dead:
+                # Снимок мог уже свернуть другой воркер
+                snapshot = _load(path)
+                if snapshot is not None:
+                    _merge_snapshot(merged, snapshot, gauges=False)
+                    folded.append(path)
+            if not folded:
+                return 0
+            metrics = {
+                name: {**metric, "values": [[list(key), value] for key, value in metric["values"].items()]}
+                for name, metric in merged.items()
+            }
+            tmp_path = retired_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({"pid": None, "metrics": metrics}, f)
+            os.replace(tmp_path, retired_path)
+            for path in folded:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        return len(folded)
+
+    def render(self):
+        """Текст для /metrics: сумма по всем процессам"""
+        try:
+            self.write_snapshot()
+            self.retire_dead()
+            snapshots = self._read_snapshots()
+        except OSError as e:
+            logger.error("Ошибка сборки метрик между воркерами: %s", e)
+            snapshots = [self.snapshot()]
+
+        merged = {}
+        for snapshot in snapshots:
+            pid = snapshot["pid"]
+            _merge_snapshot(
+                merged, snapshot,
+                gauges=pid is not None and _pid_alive(pid),
+                local=pid == os.getpid()
+            )
+
+        lines = []
+        for name, metric in merged.items():
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['type']}")
+            labelnames = metric["labels"]
+            for key, value in metric["values"].items():
+                if metric["type"] != 'histogram':
+                    lines.append(f"{name}{_format_labels(labelnames, key)} {_format_value(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric["buckets"] + [float('inf')], value[:-2]):
+                    cumulative += count
+                    le = _format_value(float(bound))
+                    lines.append(f"{name}_bucket{_format_labels(labelnames, key, ('le', le))} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(labelnames, key)} {_format_value(value[-2])}")
+                lines.append(f"{name}_count{_format_labels(labelnames, key)} {value[-1]}")
+        return '\n'.join(lines) + '\n'
+
+
+def _load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _merge_snapshot(merged, snapshot, gauges=True, local=False):
+    """Добавляет снимок процесса в merged: {имя: метрика с values {метки: значение}}
+
+    gauges=False отбрасывает gauge-значения (процесс умер); значения
+    с aggregate='local' берутся, только если local - снимок этого процесса.
+    """
+    for name, metric in snapshot["metrics"].items():
+        if metric["type"] == 'gauge':
+            if not gauges or (metric.get("aggregate") == 'local' and not local):
+                continue
+        target = merged.setdefault(name, {**metric, "values": {}})
+        for labelvalues, value in metric["values"]:
+            key = tuple(labelvalues)
+            if isinstance(value, list):
+                current = target["values"].get(key)
+                target["values"][key] = list(value) if current is None else [a + b for a, b in zip(current, value)]
+            else:
+                target["values"][key] = target["values"].get(key, 0) + value
+
+
+def _pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+REGISTRY = Registry(flush_interval=float(os.environ.get('METRICS_FLUSH_INTERVAL', 5)))
+
+# Метрики модулей без зависимостей от app.py
+TELEGRAM_LATENCY = REGISTRY.histogram(
+    'tarot_telegram_request_duration_seconds',
+    'Длительность запросов к Bot API',
+    ('method',),
+    buckets=(0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+TELEGRAM_RESPONSES = REGISTRY.counter(
+    'tarot_telegram_responses_total',
+    'Ответы Bot API по результату: ok, rate_limited, error, exception',
+    ('method', 'result')
+)
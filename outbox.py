@@ -0,0 +1,298 @@
+import fcntl
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+PENDING = 0
+CLAIMED = 1
+SENT = 2
+
+# Что лежит в записи: ответ бота или входящее сообщение, еще не примененное к диалогу
+REPLY = 0
+MESSAGE = 1
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS outbox (
+    key TEXT PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    due REAL NOT NULL,
+    status INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL,
+    owner TEXT,
+    kind INTEGER NOT NULL DEFAULT 0
+)
+'''
+INDEX = 'CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (status, due)'
+
+INSERT_SQL = 'INSERT OR IGNORE INTO outbox (key, chat_id, text, due, status, updated, owner, kind) VALUES (?, ?, ?, ?, 0, ?, ?, ?)'
+CLAIM_SQL = 'UPDATE outbox SET status = 1, updated = ? WHERE key = ? AND status = 0'
+RELEASE_SQL = 'UPDATE outbox SET status = 0, updated = ? WHERE key = ? AND status = 1'
+SENT_SQL = 'UPDATE outbox SET status = 2, updated = ? WHERE key = ?'
+OWNERS_SQL = 'SELECT DISTINCT owner FROM outbox WHERE status = 0 AND owner IS NOT ?'
+MESSAGES_SQL = 'SELECT key, text FROM outbox WHERE chat_id = ? AND kind = 1 AND status = 0 ORDER BY due'
+ORPHANS_SQL = 'SELECT key, chat_id, text, due, kind FROM outbox WHERE status = 0 AND owner IS ? ORDER BY due'
+ADOPT_SQL = 'UPDATE outbox SET owner = ? WHERE status = 0 AND owner IS ?'
+PURGE_SQL = 'DELETE FROM outbox WHERE status = 2 AND updated < ?'
+
+
+class Outbox:
+    """Журнал отложенных ответов в SQLite, переживающий перезапуск
+
+    Каждый запланированный ответ записывается с ключом идемпотентности
+    и временем отправки (по часам, а не monotonic - его нужно сравнить
+    после рестарта). Вставки копятся в буфере и фиксируются одной
+    транзакцией раз в commit_interval, поэтому webhook не ждет диска;
+    ценой этого окна ответ может потеряться при падении в пределах
+    commit_interval.
+
+    Перед отправкой запись захватывается claim(): переход 0 -> 1 атомарен,
+    и ответ с данным ключом отправит только один поток и только один
+    gunicorn-воркер, даже если все они проиграли журнал при старте.
+    Запись, захваченная, но не подтвержденная sent() до падения, при
+    рестарте не отправляется повторно: дубль хуже пропуска.
+
+    Так же (kind=MESSAGE) журналируются входящие сообщения, пока серия
+    копится в BurstCoalescer: перед обработкой серия захватывает
+    через claim_messages() все сообщения своего чата, в том числе
+    принятые другими воркерами, а после рестарта их подбирает adopt().
+
+    У каждой записи есть владелец - процесс, который ее запланировал.
+    Пока процесс жив, он держит flock на файле path.owners/<владелец>;
+    adopt() забирает себе только записи владельцев, чей замок свободен,
+    поэтому перезапущенный воркер не трогает ответы живых соседей.
+    Владелец - случайный id, а не pid: pid в контейнере после рестарта
+    повторяются.
+    """
+
+    def __init__(self, path, commit_interval=0.05, retention=86400):
+        self.path = path
+        self.commit_interval = commit_interval
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._inserts = []
+        self._sent = []
+        self._conn = None
+        self._writer = None
+        self._purged_at = 0.0
+        self.owner = None
+        self._owner_fd = None
+        # Счетчики этого процесса: stats() не считает строки журнала
+        self.added = 0
+        self.claimed = 0
+        self.sent_count = 0
+
+    def _connection(self):
+        # Соединение и поток-писатель создаются лениво, уже после fork() в gunicorn
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(SCHEMA)
+            conn.execute(INDEX)
+            self._take_ownership()
+            self._conn = conn
+            self._writer = threading.Thread(target=self._run, name='outbox-writer', daemon=True)
+            self._writer.start()
+        return self._conn
+
+    def _owners_dir(self):
+        return self.path + '.owners'
+
+    def _take_ownership(self):
+        # Замок держится открытым дескриптором до конца процесса и снимается ядром при его смерти
+        os.makedirs(self._owners_dir(), exist_ok=True)
+        owner = uuid.uuid4().hex
+        # Файл запирается под временным именем и только потом появляется под своим:
+        # иначе чужая проба могла бы успеть взять замок между созданием и flock и удалить его
+        tmp_path = os.path.join(self._owners_dir(), '.' + owner)
+        fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        os.rename(tmp_path, os.path.join(self._owners_dir(), owner))
+        self.owner, self._owner_fd = owner, fd
+
+    def _owner_alive(self, owner):
+        """Держит ли кто-то замок владельца; мертвому владельцу удаляет файл"""
+        if owner is None:
+            return False
+        path = os.path.join(self._owners_dir(), owner)
+        try:
+            fd = os.open(path, os.O_RDWR)
+        except FileNotFoundError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        finally:
+            os.close(fd)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return False
+
+    def add(self, key, chat_id, text, due, kind=REPLY):
+        """Записывает ответ (или сообщение) в буфер ближайшего группового коммита"""
+        with self._lock:
+            self._connection()
+            self._inserts.append((key, chat_id, text, due, time.time(), self.owner, kind))
+            self.added += 1
+        self._wake.set()
+
+    def claim(self, key):
+        """Захватывает ответ перед отправкой; False, если его уже отправил другой"""
+        with self._lock:
+            conn = self._connection()
+            # Ответ мог еще не попасть на диск: фиксируем буфер вместе с захватом
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._flush(conn)
+                claimed = conn.execute(CLAIM_SQL, (time.time(), key)).rowcount == 1
+                conn.execute('COMMIT')
+                self._clear()
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            self.claimed += claimed
+        return claimed
+
+    def claim_messages(self, chat_id):
+        """Захватывает все необработанные сообщения чата: [(key, text)] по времени прихода"""
+        with self._lock:
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._flush(conn)
+                now = time.time()
+                claimed = conn.execute(MESSAGES_SQL, (chat_id,)).fetchall()
+                conn.executemany(CLAIM_SQL, [(now, key) for key, _ in claimed])
+                conn.execute('COMMIT')
+                self._clear()
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            self.claimed += len(claimed)
+        return claimed
+
+    def release(self, keys):
+        """Возвращает захваченные записи в журнал, если их не удалось обработать"""
+        with self._lock:
+            conn = self._connection()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._flush(conn)
+                now = time.time()
+                conn.executemany(RELEASE_SQL, [(now, key) for key in keys])
+                conn.execute('COMMIT')
+                self._clear()
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            self.claimed -= len(keys)
+
+    def sent(self, key):
+        """Отмечает ответ отправленным (фиксируется групповым коммитом)"""
+        with self._lock:
+            self._sent.append((time.time(), key))
+            self.sent_count += 1
+        self._wake.set()
+
+    def adopt(self):
+        """Забирает неотправленные записи умерших процессов: [(key, chat_id, text, due, kind)]
+
+        Проверка владельцев и передача записей идут в одной транзакции,
+        так что каждую осиротевшую запись забирает ровно один процесс.
+        """
+        with self._lock:
+            conn = self._connection()
+            self._commit(conn)
+            adopted = []
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for owner, in conn.execute(OWNERS_SQL, (self.owner,)).fetchall():
+                    if self._owner_alive(owner):
+                        continue
+                    adopted.extend(conn.execute(ORPHANS_SQL, (owner,)).fetchall())
+                    conn.execute(ADOPT_SQL, (self.owner, owner))
+                # Чужие замки пробуются только внутри этой транзакции: иначе проба
+                # одного процесса показалась бы другому живым владельцем
+                self._sweep_owners()
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+        adopted.sort(key=lambda entry: entry[3])
+        return adopted
+
+    def _sweep_owners(self):
+        # Файлы владельцев, умерших без неотправленных записей
+        try:
+            owners = os.listdir(self._owners_dir())
+        except FileNotFoundError:
+            return
+        for owner in owners:
+            # Временные имена принадлежат процессам, которые еще не взяли замок
+            if owner != self.owner and not owner.startswith('.'):
+                self._owner_alive(owner)
+
+    def flush(self):
+        """Синхронно фиксирует буфер (при остановке процесса)"""
+        with self._lock:
+            if self._conn is not None:
+                self._commit(self._conn)
+
+    def stats(self):
+        """Счетчики этого процесса; журнал целиком не читается"""
+        with self._lock:
+            return {
+                "buffered": len(self._inserts) + len(self._sent),
+                "added": self.added,
+                "claimed": self.claimed,
+                "sent": self.sent_count
+            }
+
+    def _flush(self, conn):
+        if self._inserts:
+            conn.executemany(INSERT_SQL, self._inserts)
+        if self._sent:
+            conn.executemany(SENT_SQL, self._sent)
+
+    def _clear(self):
+        # Буфер очищается только после COMMIT: при ошибке запись повторится
+        self._inserts = []
+        self._sent = []
+
+    def _commit(self, conn):
+        if not self._inserts and not self._sent:
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            self._flush(conn)
+            conn.execute('COMMIT')
+            self._clear()
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            # Даем буферу набраться: одна транзакция на все, что пришло за интервал
+            time.sleep(self.commit_interval)
+            self._wake.clear()
+            try:
+                with self._lock:
+                    self._commit(self._conn)
+                    now = time.time()
+                    if now - self._purged_at > 3600:
+                        self._conn.execute(PURGE_SQL, (now - self.retention,))
+                        self._purged_at = now
+            except Exception as e:
+                logger.error("🚨 Ошибка записи outbox: %s", e)
@@ -23,7 +23,7 @@ class SimplePayment:
                 'message': f"Тестовый платеж создан. ID: {payment_id}"
             }
         except Exception as e:
-            logger.error(f"Error creating payment: {e}")
+            logger.error("Error creating payment: %s", e)
             return {'success': False, 'error': str(e)}
 
 # Глобальный экземпляр
@@ -0,0 +1,123 @@
+"""Long polling вместо webhook: для узлов без публичного HTTPS
+
+Запуск:
+    python polling.py app        # диалоговый бот из app.py
+    python polling.py bot        # бот-таролог из bot.py
+
+Апдейты забираются через getUpdates большими пачками и отдаются в тот же
+обработчик, что и webhook. Offset сохраняется в файл один раз на пачку,
+поэтому после перезапуска уже обработанные апдейты не запрашиваются.
+"""
+import argparse
+import importlib
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class LongPoller:
+    """Цикл getUpdates с пакетной фиксацией offset
+
+    handler(update) возвращает False, если апдейт сейчас принять нельзя
+    (например, очередь переполнена): тогда пачка обрывается на нем,
+    и он будет запрошен снова.
+    """
+
+    def __init__(self, client, handler, offset_path=None, limit=100, timeout=50, retry_delay=5):
+        self.client = client
+        self.handler = handler
+        self.offset_path = offset_path or os.environ.get('POLLING_OFFSET_PATH', 'polling.offset')
+        self.limit = limit
+        self.timeout = timeout
+        self.retry_delay = retry_delay
+        self.offset = self.load_offset()
+        self._running = False
+
+    def load_offset(self):
+        """Читает сохраненный offset (None, если файла нет)"""
+        try:
+            with open(self.offset_path) as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save_offset(self):
+        """Атомарно записывает offset: временный файл и rename"""
+        tmp_path = self.offset_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(str(self.offset))
+        os.replace(tmp_path, self.offset_path)
+
+    def poll_once(self):
+        """Забирает и обрабатывает одну пачку; возвращает число принятых апдейтов"""
+        response = self.client.get_updates(offset=self.offset, limit=self.limit, timeout=self.timeout)
+        data = response.json()
+        if not data.get('ok'):
+            raise RuntimeError(f"getUpdates вернул ошибку: {data.get('description')}")
+
+        accepted = 0
+        for update in data['result']:
+            if self.handler(update) is False:
+                break
+            self.offset = update['update_id'] + 1
+            accepted += 1
+
+        if accepted:
+            self.save_offset()
+        if accepted < len(data['result']):
+            # Обработчик перегружен: даем ему время и повторим с того же места
+            time.sleep(self.retry_delay)
+        return accepted
+
+    def run(self):
+        """Крутит цикл, пока не вызван stop()"""
+        self._running = True
+        logger.info("📡 Long polling запущен, offset: %s", self.offset)
+        while self._running:
+            try:
+                self.poll_once()
+            except Exception as e:
+                logger.error("🚨 Ошибка long polling: %s", e)
+                time.sleep(self.retry_delay)
+
+    def stop(self):
+        self._running = False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Long polling для бота")
+    parser.add_argument('target', choices=['app', 'bot', 'bot_fixed'], nargs='?', default='app')
+    parser.add_argument('--offset-file', default=None)
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--timeout', type=int, default=50)
+    args = parser.parse_args()
+
+    module = importlib.import_module(args.target)
+
+    def handler(update):
+        if args.target == 'app':
+            return module.accept_update(update) != 'overloaded'
+        # bot.py отвечает синхронно: ошибка одного апдейта не должна стопорить цикл
+        try:
+            module.handle_update(update)
+        except Exception as e:
+            logger.error("🚨 Ошибка обработки апдейта %s: %s", update.get('update_id'), e)
+        return True
+
+    # getUpdates не работает, пока установлен webhook
+    module.telegram.delete_webhook()
+
+    poller = LongPoller(
+        module.telegram,
+        handler,
+        offset_path=args.offset_file,
+        limit=args.limit,
+        timeout=args.timeout
+    )
+    poller.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""Выборочное профилирование webhook и доставки
+
+Включается переменными окружения:
+    PROFILING=1                 хуки активны (иначе декораторы возвращают
+                                исходные функции и накладных расходов нет)
+    PROFILE_SAMPLE_RATE=0.01    доля профилируемых вызовов
+    PROFILE_DIR=profiles        куда писать результаты
+    PROFILE_TRIGGER_COUNT=20    сколько вызовов профилировать по SIGUSR2
+
+Профиль вызова пишется в PROFILE_DIR/<вид>-<pid>-<номер>.collapsed в
+формате collapsed stacks ("a;b;c микросекунды"), который понимают
+flamegraph.pl и speedscope. Стеки снимает sys.setprofile только в потоке
+профилируемого вызова, поэтому время точное, а остальные потоки не
+замедляются. Фазы (span) каждого профилируемого вызова дописываются в
+PROFILE_DIR/spans-<pid>.ndjson.
+
+Следующие N вызовов работающего процесса профилируются по
+GET /profile?next=N (тот воркер, который принял запрос; его pid в ответе)
+или по сигналу конкретному воркеру:
+    pgrep -P <pid мастера gunicorn>     # pid воркеров
+    kill -USR2 <pid воркера>
+
+SIGUSR2 нельзя посылать мастеру gunicorn: для него это команда на
+горячую замену бинарника, и он запустит второй мастер со своими воркерами.
+Поэтому не используйте pkill по имени процесса: без setproctitle у
+мастера и воркеров одинаковая командная строка.
+"""
+import functools
+import itertools
+import json
+import logging
+import os
+import random
+import signal
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+ENABLED = os.environ.get('PROFILING', '').lower() in ('1', 'true', 'yes') or SAMPLE_RATE > 0
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+TRIGGER_COUNT = int(os.environ.get('PROFILE_TRIGGER_COUNT', 20))
+
+_local = threading.local()
+# RLock: trigger() вызывается и из обработчика сигнала в главном потоке
+_lock = threading.RLock()
+_forced = 0
+_sequence = itertools.count(1)
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('trace', 'name', 'started', 'depth')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.depth = self.trace.depth
+        self.trace.depth += 1
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        finished = time.perf_counter()
+        self.trace.depth -= 1
+        self.trace.spans.append({
+            "name": self.name,
+            "depth": self.depth,
+            "start_ms": round((self.started - self.trace.started) * 1000, 3),
+            "duration_ms": round((finished - self.started) * 1000, 3)
+        })
+        return False
+
+
+class _Trace:
+    """Профиль одного вызова: стеки через sys.setprofile и фазы"""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.spans = []
+        self.depth = 0
+        # Собственное время каждого стека: {"a;b;c": секунды}
+        self.stacks = {}
+        self._keys = []
+        self._last = 0.0
+        self.started = time.perf_counter()
+
+    def _profile(self, frame, event, arg):
+        now = time.perf_counter()
+        keys = self._keys
+        if keys:
+            key = keys[-1]
+            self.stacks[key] = self.stacks.get(key, 0.0) + now - self._last
+        if event == 'call':
+            code = frame.f_code
+            name = f"{os.path.basename(code.co_filename)}:{code.co_qualname}"
+            keys.append(f"{keys[-1]};{name}" if keys else name)
+        elif event == 'c_call':
+            name = getattr(arg, '__qualname__', None) or getattr(arg, '__name__', '?')
+            keys.append(f"{keys[-1]};<{name}>" if keys else f"<{name}>")
+        elif keys:
+            # return, c_return, c_exception
+            keys.pop()
+        self._last = time.perf_counter()
+
+    def start(self):
+        self._last = time.perf_counter()
+        sys.setprofile(self._profile)
+
+    def stop(self):
+        sys.setprofile(None)
+        self.duration = time.perf_counter() - self.started
+
+    def write(self):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        number = next(_sequence)
+        path = os.path.join(PROFILE_DIR, f"{self.kind}-{os.getpid()}-{number}.collapsed")
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, seconds in sorted(self.stacks.items()):
+                micros = int(seconds * 1_000_000)
+                if micros:
+                    f.write(f"{stack} {micros}\n")
+        line = json.dumps({
+            "kind": self.kind,
+            "t": time.time(),
+            "duration_ms": round(self.duration * 1000, 3),
+            "stacks": os.path.basename(path),
+            "spans": sorted(self.spans, key=lambda span: span["start_ms"])
+        }, ensure_ascii=False)
+        with _lock:
+            with open(os.path.join(PROFILE_DIR, f"spans-{os.getpid()}.ndjson"), 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+
+
+def trigger(count=TRIGGER_COUNT):
+    """Профилировать следующие count вызовов этого процесса"""
+    global _forced
+    with _lock:
+        _forced += count
+    logger.info("🔬 Профилируем следующие %d вызовов (pid %d)", count, os.getpid())
+    return _forced
+
+
+def _should_profile():
+    global _forced
+    if _forced:
+        with _lock:
+            if _forced:
+                _forced -= 1
+                return True
+    return SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE
+
+
+def profiled(kind):
+    """Декоратор: выборочно профилирует вызовы функции как вызовы вида kind"""
+    def decorate(func):
+        if not ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # Вложенный профилируемый вызов идет в профиль внешнего
+            if getattr(_local, 'trace', None) is not None or not _should_profile():
+                return func(*args, **kwargs)
+
+            trace = _local.trace = _Trace(kind)
+            trace.start()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                trace.stop()
+                _local.trace = None
+                try:
+                    trace.write()
+                except OSError as e:
+                    logger.error("Ошибка записи профиля: %s", e)
+        return wrapper
+    return decorate
+
+
+def span(name):
+    """Фаза профилируемого вызова; вне профиля ничего не делает"""
+    if not ENABLED:
+        return _NULL_SPAN
+    trace = getattr(_local, 'trace', None)
+    if trace is None:
+        return _NULL_SPAN
+    return _Span(trace, name)
+
+
+def _on_signal(signum, frame):
+    trigger()
+
+
+if ENABLED and threading.current_thread() is threading.main_thread() and hasattr(signal, 'SIGUSR2'):
+    signal.signal(signal.SIGUSR2, _on_signal)
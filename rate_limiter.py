@@ -0,0 +1,124 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """Токен-бакет в форме GCRA: хранит только теоретическое время следующей отправки"""
+    __slots__ = ('interval', 'tolerance', 'tat')
+
+    def __init__(self, rate, burst=1):
+        self.interval = 1.0 / rate
+        self.tolerance = (burst - 1) * self.interval
+        self.tat = 0.0
+
+    def earliest(self, now):
+        """Самый ранний момент, когда бакет пропустит отправку"""
+        return max(now, self.tat - self.tolerance)
+
+    def consume(self, at):
+        """Забирает токен на момент at"""
+        self.tat = max(self.tat, at) + self.interval
+
+    def block_until(self, until):
+        """Ничего не пропускать до момента until (после 429 retry_after)"""
+        self.tat = max(self.tat, until + self.tolerance)
+
+    def idle(self, now):
+        """Бакет полностью восстановился и неотличим от нового"""
+        return self.tat <= now
+
+
+class RateLimiter:
+    """Ограничитель исходящих сообщений по лимитам Telegram
+
+    Один глобальный бакет (около 30 сообщений в секунду на бота)
+    и отдельный бакет на каждый чат. Ничего не блокирует: отправитель
+    сначала ждет ready_in() своего чата (вне лимитера, например переставив
+    отправку в планировщик), затем reserve() бронирует слот в обоих
+    бакетах на один и тот же момент и возвращает, сколько до него
+    осталось. Бронь берется, только когда чат уже готов, поэтому чат,
+    молчащий после 429, не держит будущий слот глобального бакета.
+    Бакеты простаивающих чатов периодически удаляются.
+    """
+
+    def __init__(self, global_rate=30, global_burst=30, chat_rate=1, chat_burst=1, idle_ttl=60, flood_window=1.0):
+        self._global = TokenBucket(global_rate, global_burst)
+        self._chat_rate = chat_rate
+        self._chat_burst = chat_burst
+        self._chats = {}
+        self._idle_ttl = idle_ttl
+        self._next_sweep = time.monotonic() + idle_ttl
+        self._flood_window = flood_window
+        # Последний 429: (чат, когда)
+        self._last_penalty = None
+        self._lock = threading.Lock()
+
+    def _bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = self._chats[chat_id] = TokenBucket(self._chat_rate, self._chat_burst)
+        return bucket
+
+    def ready_in(self, chat_id):
+        """Через сколько секунд чат сможет отправить (ничего не бронирует)"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._chats.get(chat_id)
+            return 0.0 if bucket is None else bucket.earliest(now) - now
+
+    def reserve(self, chat_id):
+        """Бронирует отправку в чат и возвращает задержку в секундах
+
+        Оба бакета учитывают отправку в момент, когда она действительно
+        уйдет: now плюс возвращенная задержка.
+        """
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._bucket(chat_id)
+            at = max(self._global.earliest(now), bucket.earliest(now))
+            self._global.consume(at)
+            bucket.consume(at)
+
+            if now >= self._next_sweep:
+                self._sweep(now)
+        return at - now
+
+    def acquire(self, chat_id):
+        """Блокирует поток, пока отправку в чат нельзя выполнить
+
+        Только для синхронных ботов, где ждет сам обработчик запроса;
+        потоки планировщика так не ждут.
+        """
+        wait = self.ready_in(chat_id)
+        if wait > 0:
+            time.sleep(wait)
+        delay = self.reserve(chat_id)
+        if delay > 0:
+            time.sleep(delay)
+
+    def penalize(self, chat_id, retry_after):
+        """Учитывает retry_after из ответа 429: чат молчит указанное время
+
+        Telegram не говорит, какой лимит превышен. Если 429 за
+        flood_window секунд пришли в разные чаты, упираемся в общий лимит
+        бота, и молчит глобальный бакет тоже.
+        """
+        now = time.monotonic()
+        until = now + retry_after
+        with self._lock:
+            self._bucket(chat_id).block_until(until)
+            last = self._last_penalty
+            if last is not None and last[0] != chat_id and now - last[1] <= self._flood_window:
+                self._global.block_until(until)
+            self._last_penalty = (chat_id, now)
+
+    def tracked_chats(self):
+        """Сколько чатов сейчас имеют свой бакет"""
+        return len(self._chats)
+
+    def _sweep(self, now):
+        # Восстановившийся бакет можно удалить без потери информации
+        idle = [chat_id for chat_id, bucket in self._chats.items() if bucket.idle(now)]
+        for chat_id in idle:
+            del self._chats[chat_id]
+        self._next_sweep = now + self._idle_ttl
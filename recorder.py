@@ -0,0 +1,83 @@
+import json
+import os
+import threading
+import time
+
+
+class TrafficRecorder:
+    """Запись входящих апдейтов в NDJSON для последующего replay.py
+
+    Каждая строка - {"t": время прихода, "update": апдейт как есть},
+    включая дубликаты и повторы от Telegram: именно их тайминг
+    воспроизводит инциденты. Файл ротируется по размеру, как логи
+    (path, path.1 ... path.N); {pid} в пути заменяется на pid процесса,
+    чтобы gunicorn-воркеры писали каждый в свой файл. Запись не зависит
+    от настроек logging.
+    """
+
+    def __init__(self, path, max_bytes=50 * 1024 * 1024, backups=5):
+        self.path = path.replace('{pid}', str(os.getpid()))
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._lock = threading.Lock()
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self.recorded = 0
+
+    def record(self, update, at=None):
+        line = json.dumps({"t": time.time() if at is None else at, "update": update}, ensure_ascii=False) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+            self.recorded += 1
+            if self.max_bytes and self._file.tell() >= self.max_bytes:
+                self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backups - 1, 0, -1):
+            source = f"{self.path}.{i}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{i + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def create_recorder():
+    """Рекордер по RECORD_TRAFFIC (путь к файлу) или None, если запись выключена
+
+    Если в пути нет {pid}, pid вставляется перед расширением
+    (traffic.ndjson -> traffic.{pid}.ndjson): иначе gunicorn-воркеры
+    пишут в один файл и ротируют его друг у друга.
+    """
+    path = os.environ.get('RECORD_TRAFFIC')
+    if not path:
+        return None
+    if '{pid}' not in path:
+        root, ext = os.path.splitext(path)
+        path = f"{root}.{{pid}}{ext}"
+    return TrafficRecorder(
+        path,
+        max_bytes=int(os.environ.get('RECORD_MAX_BYTES', 50 * 1024 * 1024)),
+        backups=int(os.environ.get('RECORD_BACKUPS', 5))
+    )
+
+
+def read_recording(paths):
+    """Апдейты из файлов записи по порядку: [(время прихода, апдейт)]"""
+    events = []
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    item = json.loads(line)
+                    events.append((item['t'], item['update']))
+    events.sort(key=lambda event: event[0])
+    return events
@@ -0,0 +1,245 @@
+"""Воспроизведение записанного трафика (RECORD_TRAFFIC) на локальном боте
+
+Запуск:
+    python replay.py traffic.*.ndjson                    # все воркеры, максимально быстро
+    python replay.py traffic.123.ndjson.1 traffic.123.ndjson --speed 10
+    python replay.py traffic.123.ndjson --output sends.ndjson --profile replay.prof
+    python replay.py traffic.123.ndjson --url http://127.0.0.1:10000/webhook --speed 1
+
+Без --url апдейты проигрываются внутри процесса на виртуальных часах:
+time.time/time.monotonic подменяются, отложенные задачи выполняет
+VirtualScheduler в одном потоке строго по времени срабатывания, а
+random засеян --seed. Поэтому process_user_message, склейка серий и
+доставка дают одинаковый результат при каждом прогоне, а реальное
+время уходит только на сам код. --speed N растягивает прогон до
+записанного тайминга, ускоренного в N раз (0 - без пауз). Отправки
+в Telegram не уходят: они пишутся в --output.
+
+С --url апдейты отправляются на работающий webhook с записанным
+таймингом; детерминизма в этом режиме нет.
+"""
+import argparse
+import cProfile
+import heapq
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from recorder import read_recording
+
+_real_time = time.time
+_real_monotonic = time.monotonic
+_real_sleep = time.sleep
+
+
+class VirtualClock:
+    """Часы, которые двигает только проигрыватель"""
+
+    def __init__(self, start):
+        self.now = start
+
+    def time(self):
+        return self.now
+
+    def advance(self, to):
+        if to > self.now:
+            self.now = to
+
+
+class ReplayResponse:
+    status_code = 200
+    text = '{"ok":true,"result":true}'
+
+    def json(self):
+        return {"ok": True, "result": True}
+
+
+class ReplayTelegram:
+    """Подмена TelegramClient: записывает исходящие вызовы вместо отправки"""
+
+    def __init__(self, clock, started_at):
+        self.clock = clock
+        self.started_at = started_at
+        self.calls = []
+
+    def _record(self, method, chat_id, text=None):
+        self.calls.append({
+            "t": round(self.clock.now - self.started_at, 6),
+            "method": method,
+            "chat_id": chat_id,
+            "text": text
+        })
+        return ReplayResponse()
+
+    def send_message(self, chat_id, text, **kwargs):
+        return self._record('sendMessage', chat_id, text)
+
+    def send_message_once(self, chat_id, text, **kwargs):
+        return self._record('sendMessage', chat_id, text)
+
+    def send_chat_action(self, chat_id, action='typing'):
+        return self._record('sendChatAction', chat_id)
+
+    def __getattr__(self, name):
+        # Остальные методы (setWebhook и т.п.) при воспроизведении не нужны
+        return lambda *args, **kwargs: ReplayResponse()
+
+
+def install_virtual_time(start):
+    """Подменяет часы и планировщик до импорта app"""
+    clock = VirtualClock(start)
+    time.time = clock.time
+    time.monotonic = clock.time
+
+    import scheduler
+
+    class VirtualScheduler(scheduler.DeliveryScheduler):
+        """Планировщик без потоков: задачи выполняет run_until()"""
+
+        def _ensure_started(self):
+            pass
+
+        def run_until(self, until):
+            while True:
+                with self._cond:
+                    if not self._heap:
+                        return
+                    due, _, entry = self._heap[0]
+                    if entry.cancelled:
+                        heapq.heappop(self._heap)
+                        self._cancelled -= 1
+                        continue
+                    if due > until:
+                        return
+                    heapq.heappop(self._heap)
+                    func, args = entry.func, entry.args
+                    entry.func = entry.args = None
+                clock.advance(due)
+                try:
+                    func(*args)
+                except Exception as e:
+                    scheduler.logger.error("🚨 Ошибка в отложенной задаче: %s", e)
+
+    scheduler.DeliveryScheduler = VirtualScheduler
+    return clock
+
+
+def replay_in_process(events, args):
+    started_at = events[0][0]
+    clock = install_virtual_time(started_at)
+    random.seed(args.seed)
+
+    # Свежие служебные файлы, чтобы не задеть рабочие outbox, окно дедупликации
+    # и диалоги: состояние только в памяти, даже если в окружении задан SQLite или Postgres
+    tmp = tempfile.mkdtemp(prefix='replay_')
+    os.environ.setdefault('BOT_TOKEN', 'replay')
+    os.environ['OUTBOX_PATH'] = os.path.join(tmp, 'outbox.db')
+    os.environ['DEDUP_PATH'] = os.path.join(tmp, 'updates.dedup')
+    os.environ['STATE_BACKEND'] = 'memory'
+    os.environ['STATE_DB_PATH'] = os.path.join(tmp, 'conversations.db')
+    os.environ['STATE_SPILL_PATH'] = os.path.join(tmp, 'spill.db')
+    os.environ['METRICS_DIR'] = os.path.join(tmp, 'metrics')
+    os.environ.pop('RECORD_TRAFFIC', None)
+
+    import app
+    telegram = ReplayTelegram(clock, started_at)
+    app.telegram = telegram
+    scheduler = app.delivery_scheduler
+
+    def handle(update):
+        # То же, что accept_update, но без очереди и ее потоков
+        if 'message' not in update or 'text' not in update['message']:
+            return
+        if app.is_update_processed(update.get('update_id')):
+            return
+        app.process_update(update)
+
+    wall_started = _real_monotonic()
+    for at, update in events:
+        scheduler.run_until(at)
+        if args.speed:
+            lag = (at - started_at) / args.speed - (_real_monotonic() - wall_started)
+            if lag > 0:
+                _real_sleep(lag)
+        clock.advance(at)
+        handle(update)
+
+    # Дожидаемся всех отложенных ответов
+    while True:
+        due = scheduler.next_due()
+        if due is None:
+            break
+        if args.speed:
+            lag = (due - started_at) / args.speed - (_real_monotonic() - wall_started)
+            if lag > 0:
+                _real_sleep(lag)
+        scheduler.run_until(due)
+    app.outbox.flush()
+    return telegram.calls, _real_monotonic() - wall_started
+
+
+def replay_to_url(events, args):
+    import requests
+
+    session = requests.Session()
+    started_at = events[0][0]
+    wall_started = _real_monotonic()
+    statuses = {}
+    for at, update in events:
+        if args.speed:
+            lag = (at - started_at) / args.speed - (_real_monotonic() - wall_started)
+            if lag > 0:
+                _real_sleep(lag)
+        try:
+            status = session.post(args.url, json=update, timeout=30).status_code
+        except requests.RequestException:
+            status = None
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    return statuses, _real_monotonic() - wall_started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='+', help="файлы записи (старые ротации первыми)")
+    parser.add_argument('--speed', type=float, default=0, help="ускорение относительно записи (0 - без пауз)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--url', default=None, help="отправлять на работающий webhook вместо локального прогона")
+    parser.add_argument('--output', default=None, help="куда записать исходящие вызовы (NDJSON)")
+    parser.add_argument('--profile', default=None, help="сохранить профиль cProfile в файл")
+    args = parser.parse_args()
+
+    events = read_recording(args.files)
+    if not events:
+        print("Запись пуста")
+        return
+    span = events[-1][0] - events[0][0]
+    print(f"▶️ Апдейтов: {len(events)}, записано за {span:.1f} сек")
+
+    profiler = cProfile.Profile() if args.profile else None
+    if profiler:
+        profiler.enable()
+
+    if args.url:
+        statuses, elapsed = replay_to_url(events, args)
+        print(f"✅ Отправлено за {elapsed:.1f} сек, статусы: {statuses}")
+    else:
+        calls, elapsed = replay_in_process(events, args)
+        sent = sum(1 for call in calls if call['method'] == 'sendMessage')
+        print(f"✅ Проиграно за {elapsed:.2f} сек: sendMessage {sent}, sendChatAction {len(calls) - sent}")
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                for call in calls:
+                    f.write(json.dumps(call, ensure_ascii=False) + '\n')
+            print(f"💾 {args.output}")
+
+    if profiler:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+        print(f"📊 Профиль: {args.profile}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,136 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduledDelivery:
+    """Отложенная задача в очереди планировщика"""
+    __slots__ = ('due', 'func', 'args', 'cancelled')
+
+    def __init__(self, due, func, args):
+        self.due = due
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+
+class DeliveryScheduler:
+    """Один планировщик отложенных отправок на процесс
+
+    Все ожидающие отправки лежат в куче по времени срабатывания,
+    а выполняет их небольшой пул потоков. Количество потоков не зависит
+    от того, сколько чатов сейчас ждут ответа.
+    """
+
+    def __init__(self, workers=4, name='delivery'):
+        self._workers = workers
+        self._name = name
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._cancelled = 0
+        self._threads = []
+        self._stopped = False
+
+    def _ensure_started(self):
+        # Потоки стартуют лениво, чтобы не создавать их до fork() в gunicorn
+        if self._threads:
+            return
+        for i in range(self._workers):
+            thread = threading.Thread(target=self._run, name=f"{self._name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def schedule(self, delay, func, *args):
+        """Планирует вызов func(*args) через delay секунд"""
+        return self.schedule_at(time.monotonic() + max(0.0, delay), func, *args)
+
+    def schedule_at(self, due, func, *args):
+        """Планирует вызов func(*args) на момент due (по time.monotonic)"""
+        entry = ScheduledDelivery(due, func, args)
+        with self._cond:
+            self._ensure_started()
+            heapq.heappush(self._heap, (due, next(self._seq), entry))
+            # Будим воркеров, только если новая задача стала ближайшей
+            if self._heap[0][2] is entry:
+                self._cond.notify()
+        return entry
+
+    def cancel(self, entry):
+        """Отменяет задачу, если она еще не выполнена"""
+        with self._cond:
+            if entry.cancelled or entry.func is None:
+                return False
+            entry.cancelled = True
+            self._cancelled += 1
+            return True
+
+    def pending(self):
+        """Глубина очереди: число ожидающих задач"""
+        with self._cond:
+            return len(self._heap) - self._cancelled
+
+    def next_due(self):
+        """Когда сработает ближайшая задача (по time.monotonic) или None"""
+        with self._cond:
+            # Отмененные задачи с вершины кучи выбрасываем, как это делают воркеры
+            while self._heap and self._heap[0][2].cancelled:
+                heapq.heappop(self._heap)
+                self._cancelled -= 1
+            return self._heap[0][0] if self._heap else None
+
+    def stats(self):
+        """Сводка для отладки"""
+        due = self.next_due()
+        return {
+            "pending": self.pending(),
+            "workers": len(self._threads),
+            "next_due_in": max(0.0, due - time.monotonic()) if due is not None else None
+        }
+
+    def shutdown(self):
+        """Останавливает воркеров; невыполненные задачи отбрасываются"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def _next_entry(self):
+        with self._cond:
+            while not self._stopped:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+
+                due, _, entry = self._heap[0]
+                if entry.cancelled:
+                    heapq.heappop(self._heap)
+                    self._cancelled -= 1
+                    continue
+
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self._cond.wait(wait)
+                    continue
+
+                heapq.heappop(self._heap)
+                # Если в куче есть еще созревшие задачи, будим следующего воркера
+                if self._heap:
+                    self._cond.notify()
+                func, args = entry.func, entry.args
+                entry.func = entry.args = None
+                return func, args
+        return None, None
+
+    def _run(self):
+        while True:
+            func, args = self._next_entry()
+            if func is None:
+                return
+            try:
+                func(*args)
+            except Exception as e:
+                logger.error("🚨 Ошибка в отложенной задаче: %s", e)
@@ -0,0 +1,750 @@
+import heapq
+import itertools
+import json
+import logging
+import marshal
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from conversation_state import STAGE_NAMES, ConversationState
+
+logger = logging.getLogger(__name__)
+
+# before в _put(): стадия до записи неизвестна, ее нужно узнать у хранилища
+UNKNOWN = object()
+
+# Нижняя граница chat_id для первой страницы scan() в SQL
+MIN_CHAT_ID = -(1 << 63)
+
+
+def ascending_after(keys, after):
+    """chat_id из снимка keys строго больше after (None - с начала), по возрастанию
+
+    Порядок строится при чтении, а не при записи: куча собирается за
+    O(n), каждый следующий ключ - O(log n), так что одна страница обхода
+    не сортирует все ключи, а новый чат ничего не сдвигает.
+    """
+    heap = [key for key in keys if after is None or key > after]
+    heapq.heapify(heap)
+    while heap:
+        yield heapq.heappop(heap)
+
+
+class StateStore:
+    """Хранилище состояний диалогов
+
+    get() читает состояние без блокировки (для отладки и статистики),
+    transaction() захватывает чат, отдает изменяемое состояние и
+    сохраняет его на выходе. Разные чаты обрабатываются параллельно.
+
+    Число диалогов по стадиям поддерживается при каждой записи, поэтому
+    len() и stage_counts() не обходят чаты. scan() отдает диалоги по
+    возрастанию chat_id порциями - для постраничного обхода по курсору.
+    """
+
+    lock_stripes = 64
+    # Ходит ли хранилище на диск или в сеть: asyncio-режим уводит такие вызовы в потоки
+    blocking = True
+    # Видят ли все воркеры одни и те же диалоги
+    shared = False
+
+    def __init__(self):
+        self._locks = [threading.Lock() for _ in range(self.lock_stripes)]
+        self._stage_counts = dict.fromkeys(STAGE_NAMES, 0)
+        self._counts_lock = threading.Lock()
+
+    def _chat_lock(self, chat_id):
+        return self._locks[hash(chat_id) % self.lock_stripes]
+
+    def _count(self, before, after):
+        """Переносит чат из стадии before в after (None - чата нет)"""
+        if before == after:
+            return
+        with self._counts_lock:
+            if before is not None:
+                self._stage_counts[before] -= 1
+            if after is not None:
+                self._stage_counts[after] += 1
+
+    def get(self, chat_id):
+        raise NotImplementedError
+
+    def put(self, chat_id, state):
+        """Сохраняет состояние вне transaction()"""
+        self._put(chat_id, state, UNKNOWN)
+
+    def _put(self, chat_id, state, before):
+        raise NotImplementedError
+
+    def delete(self, chat_id):
+        raise NotImplementedError
+
+    def items(self):
+        raise NotImplementedError
+
+    def scan(self, after=None, batch=256):
+        """Пары (chat_id, состояние) с chat_id больше after, по возрастанию"""
+        raise NotImplementedError
+
+    def stage_counts(self):
+        """Число диалогов на каждой стадии"""
+        with self._counts_lock:
+            return dict(self._stage_counts)
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def __contains__(self, chat_id):
+        return self.get(chat_id) is not None
+
+    def stats(self):
+        return {"size": len(self), "stages": self.stage_counts()}
+
+    @contextmanager
+    def transaction(self, chat_id, factory):
+        """Захватывает чат и отдает его состояние (создает через factory)"""
+        with self._chat_lock(chat_id):
+            state = self.get(chat_id)
+            before = None if state is None else state.stage
+            if state is None:
+                state = factory()
+            yield state
+            self._put(chat_id, state, before)
+
+
+class MemoryStateStore(StateStore):
+    """Состояния в словаре процесса (как раньше)"""
+
+    blocking = False
+
+    def __init__(self):
+        super().__init__()
+        self._states = {}
+
+    def get(self, chat_id):
+        return self._states.get(chat_id)
+
+    def _put(self, chat_id, state, before):
+        if before is UNKNOWN:
+            old = self._states.get(chat_id)
+            before = None if old is None else old.stage
+        self._states[chat_id] = state
+        self._count(before, state.stage)
+
+    def delete(self, chat_id):
+        old = self._states.pop(chat_id, None)
+        if old is not None:
+            self._count(old.stage, None)
+
+    def items(self):
+        return list(self._states.items())
+
+    def scan(self, after=None, batch=256):
+        # Снимок ключей: чаты, созданные во время обхода, в него не попадут
+        for chat_id in ascending_after(list(self._states), after):
+            state = self._states.get(chat_id)
+            if state is not None:
+                yield chat_id, state
+
+    def __len__(self):
+        return len(self._states)
+
+
+class SpillFile:
+    """Компактное хранилище выселенных состояний на диске (SQLite + marshal)
+
+    Файл живет не дольше процесса, поэтому хватает marshal без журнала
+    и fsync: это в разы дешевле json и zlib на каждый выселенный чат.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS spill (chat_id INTEGER PRIMARY KEY, data BLOB NOT NULL)"
+        )
+        self.count = self._conn().execute("SELECT COUNT(*) FROM spill").fetchone()[0]
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=OFF")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+        return conn
+
+    def write_many(self, items):
+        rows = [(chat_id, marshal.dumps(state.to_tuple())) for chat_id, state in items]
+        conn = self._conn()
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO spill (chat_id, data) VALUES (?, ?)", rows)
+        self.count += len(rows)
+
+    def take(self, chat_id):
+        """Достает состояние и удаляет его с диска"""
+        conn = self._conn()
+        with conn:
+            row = conn.execute("SELECT data FROM spill WHERE chat_id = ?", (chat_id,)).fetchone()
+            if row is None:
+                return None
+            conn.execute("DELETE FROM spill WHERE chat_id = ?", (chat_id,))
+        self.count -= 1
+        return ConversationState.from_tuple(marshal.loads(row[0]))
+
+    def ids_after(self, after):
+        """chat_id по возрастанию строго больше after, порциями по первичному ключу"""
+        after = MIN_CHAT_ID if after is None else after
+        while True:
+            ids = [row[0] for row in self._conn().execute(
+                "SELECT chat_id FROM spill WHERE chat_id > ? ORDER BY chat_id LIMIT 256", (after,)
+            )]
+            yield from ids
+            if len(ids) < 256:
+                return
+            after = ids[-1]
+
+    def peek_many(self, chat_ids):
+        """Состояния без выгрузки с диска: {chat_id: состояние}"""
+        if not chat_ids:
+            return {}
+        placeholders = ','.join('?' * len(chat_ids))
+        rows = self._conn().execute(
+            f"SELECT chat_id, data FROM spill WHERE chat_id IN ({placeholders})", list(chat_ids)
+        ).fetchall()
+        return {chat_id: ConversationState.from_tuple(marshal.loads(data)) for chat_id, data in rows}
+
+    def items(self):
+        rows = self._conn().execute("SELECT chat_id, data FROM spill").fetchall()
+        return [(chat_id, ConversationState.from_tuple(marshal.loads(data))) for chat_id, data in rows]
+
+
+class EvictingStateStore(StateStore):
+    """Состояния в памяти с выселением простаивающих чатов на диск
+
+    Горячие чаты лежат в OrderedDict в порядке последнего обращения.
+    Чаты, молчащие дольше idle_ttl (по полю last_message_time), и все,
+    что не влезает в max_hot, выгружаются в SpillFile. При следующем
+    сообщении состояние прозрачно поднимается обратно.
+    """
+
+    def __init__(self, spill_path, idle_ttl=1800, max_hot=100000, evict_batch=1000, evict_interval=1.0):
+        super().__init__()
+        self.idle_ttl = idle_ttl
+        self.max_hot = max_hot
+        self.evict_batch = evict_batch
+        self.evict_interval = evict_interval
+        self._next_evict = 0.0
+        self._hot = OrderedDict()
+        self._hot_lock = threading.Lock()
+
+        # Выгруженные состояния живут не дольше процесса, как и горячие
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(spill_path + suffix):
+                os.remove(spill_path + suffix)
+        self._spill = SpillFile(spill_path)
+        self.evictions = 0
+        self.rehydrations = 0
+
+    def get(self, chat_id):
+        with self._hot_lock:
+            state = self._hot.get(chat_id)
+            if state is not None:
+                self._hot.move_to_end(chat_id)
+                return state
+
+            state = self._spill.take(chat_id)
+            if state is not None:
+                self._hot[chat_id] = state
+                self.rehydrations += 1
+            return state
+
+    def _put(self, chat_id, state, before):
+        if before is UNKNOWN:
+            old = self.get(chat_id)
+            before = None if old is None else old.stage
+        with self._hot_lock:
+            self._hot[chat_id] = state
+            self._hot.move_to_end(chat_id)
+            overflow = len(self._hot) > self.max_hot
+        self._count(before, state.stage)
+
+        # Выселяем пачками не чаще evict_interval, чтобы не писать на диск на каждый put
+        now = time.monotonic()
+        if overflow or now >= self._next_evict:
+            self._next_evict = now + self.evict_interval
+            while self.evict() == self.evict_batch:
+                pass
+
+    def delete(self, chat_id):
+        with self._hot_lock:
+            old = self._hot.pop(chat_id, None)
+            if old is None:
+                old = self._spill.take(chat_id)
+        if old is not None:
+            self._count(old.stage, None)
+
+    def items(self):
+        with self._hot_lock:
+            return list(self._hot.items()) + self._spill.items()
+
+    def scan(self, after=None, batch=256):
+        with self._hot_lock:
+            hot = list(self._hot)
+        # Чат, выселенный во время обхода, встретится дважды подряд: берем один раз
+        merged = (chat_id for chat_id, _ in itertools.groupby(
+            heapq.merge(ascending_after(hot, after), self._spill.ids_after(after))
+        ))
+        while True:
+            ids = list(itertools.islice(merged, batch))
+            if not ids:
+                return
+            # Чтение для обхода не поднимает чаты с диска и не трогает порядок LRU
+            with self._hot_lock:
+                found = {chat_id: self._hot[chat_id] for chat_id in ids if chat_id in self._hot}
+                found.update(self._spill.peek_many([chat_id for chat_id in ids if chat_id not in found]))
+            for chat_id in ids:
+                state = found.get(chat_id)
+                if state is not None:
+                    yield chat_id, state
+            after = ids[-1]
+
+    def __len__(self):
+        return len(self._hot) + self._spill.count
+
+    def evict(self, now=None):
+        """Выгружает на диск простаивающие чаты и излишек сверх max_hot"""
+        cutoff = (now or time.time()) - self.idle_ttl
+        victims = []
+        busy = []
+        with self._hot_lock:
+            while self._hot and len(victims) < self.evict_batch:
+                chat_id, state = next(iter(self._hot.items()))
+                if len(self._hot) <= self.max_hot and state.last_message_time >= cutoff:
+                    break
+                self._hot.popitem(last=False)
+                # Чат, который сейчас в транзакции, не трогаем
+                lock = self._chat_lock(chat_id)
+                if lock.acquire(blocking=False):
+                    lock.release()
+                    victims.append((chat_id, state))
+                else:
+                    busy.append((chat_id, state))
+            for chat_id, state in busy:
+                self._hot[chat_id] = state
+
+            # Пишем под тем же локом, чтобы get() не увидел чат ни там, ни там
+            if victims:
+                self._spill.write_many(victims)
+                self.evictions += len(victims)
+        return len(victims)
+
+    def stats(self):
+        return {
+            "size": len(self),
+            "stages": self.stage_counts(),
+            "hot": len(self._hot),
+            "spilled": self._spill.count,
+            "evictions": self.evictions,
+            "rehydrations": self.rehydrations
+        }
+
+
+class SqliteStateStore(StateStore):
+    """Состояния в SQLite (WAL), общие для всех воркеров на одной машине
+
+    Чтение идет через кэш с версиями: запрос по первичному ключу
+    возвращает данные, только если версия в базе отличается от
+    закэшированной. Запись выполняется в BEGIN IMMEDIATE под локом чата,
+    поэтому параллельные воркеры не теряют изменения друг друга.
+    Счетчики стадий лежат в conversation_stages и меняются в той же
+    транзакции, что и сам диалог.
+    """
+
+    # SQL-тексты постоянные: sqlite3 кэширует подготовленные выражения
+    SELECT_SQL = (
+        "SELECT version, CASE WHEN version = ? THEN NULL ELSE data END "
+        "FROM conversations WHERE chat_id = ?"
+    )
+    UPSERT_SQL = (
+        "INSERT INTO conversations (chat_id, version, data) VALUES (?, 1, ?) "
+        "ON CONFLICT(chat_id) DO UPDATE SET version = version + 1, data = excluded.data "
+        "RETURNING version"
+    )
+    STAGE_SQL = "UPDATE conversation_stages SET count = count + ? WHERE stage = ?"
+    SCAN_SQL = "SELECT chat_id, data FROM conversations WHERE chat_id > ? ORDER BY chat_id LIMIT ?"
+
+    shared = True
+
+    def __init__(self, path, cache_size=10000):
+        super().__init__()
+        self.path = path
+        self._local = threading.local()
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._cache_lock = threading.Lock()
+
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversations ("
+            "chat_id INTEGER PRIMARY KEY, version INTEGER NOT NULL, data TEXT NOT NULL)"
+        )
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS conversation_stages ("
+                "stage TEXT PRIMARY KEY, count INTEGER NOT NULL)"
+            )
+            if conn.execute("SELECT COUNT(*) FROM conversation_stages").fetchone()[0] == 0:
+                # Счетчиков еще нет: один раз считаем их по уже сохраненным диалогам
+                conn.execute(
+                    "INSERT INTO conversation_stages (stage, count) "
+                    "SELECT COALESCE(json_extract(data, '$.stage'), ?), COUNT(*) FROM conversations GROUP BY 1",
+                    (STAGE_NAMES[0],)
+                )
+                conn.executemany(
+                    "INSERT OR IGNORE INTO conversation_stages (stage, count) VALUES (?, 0)",
+                    [(stage,) for stage in STAGE_NAMES]
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, cached_statements=32)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _cached(self, chat_id):
+        with self._cache_lock:
+            entry = self._cache.get(chat_id)
+            if entry is not None:
+                self._cache.move_to_end(chat_id)
+            return entry
+
+    def _remember(self, chat_id, version, state):
+        with self._cache_lock:
+            self._cache[chat_id] = (version, state)
+            self._cache.move_to_end(chat_id)
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+    def _read(self, conn, chat_id):
+        entry = self._cached(chat_id)
+        row = conn.execute(self.SELECT_SQL, (entry[0] if entry else -1, chat_id)).fetchone()
+        if row is None:
+            return None
+        version, data = row
+        if data is None:
+            return entry[1]
+        state = ConversationState.from_dict(json.loads(data))
+        self._remember(chat_id, version, state)
+        return state
+
+    def _write(self, conn, chat_id, state, before):
+        version, = conn.execute(self.UPSERT_SQL, (chat_id, json.dumps(state.to_dict(), ensure_ascii=False))).fetchone()
+        self._move(conn, before, state.stage)
+        self._remember(chat_id, version, state)
+
+    def _move(self, conn, before, after):
+        if before == after:
+            return
+        if before is not None:
+            conn.execute(self.STAGE_SQL, (-1, before))
+        if after is not None:
+            conn.execute(self.STAGE_SQL, (1, after))
+
+    @contextmanager
+    def _immediate(self, conn, chat_id):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            with self._cache_lock:
+                self._cache.pop(chat_id, None)
+            raise
+
+    def get(self, chat_id):
+        return self._read(self._conn(), chat_id)
+
+    def put(self, chat_id, state):
+        conn = self._conn()
+        with self._immediate(conn, chat_id):
+            row = conn.execute(
+                "SELECT json_extract(data, '$.stage') FROM conversations WHERE chat_id = ?", (chat_id,)
+            ).fetchone()
+            self._write(conn, chat_id, state, row[0] if row else None)
+
+    def delete(self, chat_id):
+        conn = self._conn()
+        with self._immediate(conn, chat_id):
+            row = conn.execute(
+                "DELETE FROM conversations WHERE chat_id = ? RETURNING json_extract(data, '$.stage')", (chat_id,)
+            ).fetchone()
+            if row is not None:
+                self._move(conn, row[0], None)
+        with self._cache_lock:
+            self._cache.pop(chat_id, None)
+
+    def items(self):
+        rows = self._conn().execute("SELECT chat_id, data FROM conversations").fetchall()
+        return [(chat_id, ConversationState.from_dict(json.loads(data))) for chat_id, data in rows]
+
+    def scan(self, after=None, batch=256):
+        conn = self._conn()
+        after = MIN_CHAT_ID if after is None else after
+        while True:
+            rows = conn.execute(self.SCAN_SQL, (after, batch)).fetchall()
+            if not rows:
+                return
+            for chat_id, data in rows:
+                yield chat_id, ConversationState.from_dict(json.loads(data))
+            after = rows[-1][0]
+
+    def stage_counts(self):
+        return dict(self._conn().execute("SELECT stage, count FROM conversation_stages").fetchall())
+
+    def __len__(self):
+        return self._conn().execute("SELECT COALESCE(SUM(count), 0) FROM conversation_stages").fetchone()[0]
+
+    @contextmanager
+    def transaction(self, chat_id, factory):
+        conn = self._conn()
+        with self._chat_lock(chat_id), self._immediate(conn, chat_id):
+            state = self._read(conn, chat_id)
+            before = None if state is None else state.stage
+            if state is None:
+                state = factory()
+            yield state
+            self._write(conn, chat_id, state, before)
+
+
+class PostgresStateStore(StateStore):
+    """Состояния в Postgres (DATABASE_URL), с настоящей блокировкой строки чата
+
+    Счетчики стадий лежат в conversation_stages и меняются в той же
+    транзакции, что и сам диалог.
+    """
+
+    SELECT_SQL = (
+        "SELECT version, CASE WHEN version = %s THEN NULL ELSE data END "
+        "FROM conversations WHERE chat_id = %s"
+    )
+    UPSERT_SQL = (
+        "INSERT INTO conversations (chat_id, version, data) VALUES (%s, 1, %s) "
+        "ON CONFLICT (chat_id) DO UPDATE SET version = conversations.version + 1, data = EXCLUDED.data "
+        "RETURNING version"
+    )
+    STAGE_SQL = "UPDATE conversation_stages SET count = count + %s WHERE stage = %s"
+    SCAN_SQL = "SELECT chat_id, data FROM conversations WHERE chat_id > %s ORDER BY chat_id LIMIT %s"
+
+    shared = True
+
+    def __init__(self, dsn, pool_size=8, cache_size=10000):
+        super().__init__()
+        try:
+            import psycopg2.pool
+        except ImportError:
+            raise RuntimeError("Для STATE_BACKEND=postgres нужен пакет psycopg2")
+
+        self._pool = psycopg2.pool.ThreadedConnectionPool(1, pool_size, dsn)
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._cache_lock = threading.Lock()
+
+        with self._cursor() as cur:
+            cur.execute(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                "chat_id BIGINT PRIMARY KEY, version BIGINT NOT NULL, data TEXT NOT NULL)"
+            )
+            cur.execute(
+                "CREATE TABLE IF NOT EXISTS conversation_stages ("
+                "stage TEXT PRIMARY KEY, count BIGINT NOT NULL)"
+            )
+            # Воркеры стартуют одновременно: счетчики заполняет только первый
+            cur.execute("LOCK TABLE conversation_stages IN EXCLUSIVE MODE")
+            cur.execute("SELECT COUNT(*) FROM conversation_stages")
+            if cur.fetchone()[0] == 0:
+                cur.execute(
+                    "INSERT INTO conversation_stages (stage, count) "
+                    "SELECT COALESCE(data::json->>'stage', %s), COUNT(*) FROM conversations GROUP BY 1",
+                    (STAGE_NAMES[0],)
+                )
+                cur.executemany(
+                    "INSERT INTO conversation_stages (stage, count) VALUES (%s, 0) ON CONFLICT (stage) DO NOTHING",
+                    [(stage,) for stage in STAGE_NAMES]
+                )
+
+    @contextmanager
+    def _cursor(self):
+        conn = self._pool.getconn()
+        try:
+            with conn:
+                with conn.cursor() as cur:
+                    yield cur
+        finally:
+            self._pool.putconn(conn)
+
+    def _remember(self, chat_id, version, state):
+        with self._cache_lock:
+            self._cache[chat_id] = (version, state)
+            self._cache.move_to_end(chat_id)
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+    def _read(self, cur, chat_id, for_update=False):
+        with self._cache_lock:
+            entry = self._cache.get(chat_id)
+        sql = self.SELECT_SQL + (" FOR UPDATE" if for_update else "")
+        cur.execute(sql, (entry[0] if entry else -1, chat_id))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        version, data = row
+        if data is None:
+            return entry[1]
+        state = ConversationState.from_dict(json.loads(data))
+        self._remember(chat_id, version, state)
+        return state
+
+    def _write(self, cur, chat_id, state, before):
+        cur.execute(self.UPSERT_SQL, (chat_id, json.dumps(state.to_dict(), ensure_ascii=False)))
+        self._remember(chat_id, cur.fetchone()[0], state)
+        self._move(cur, before, state.stage)
+
+    def _move(self, cur, before, after):
+        if before == after:
+            return
+        if before is not None:
+            cur.execute(self.STAGE_SQL, (-1, before))
+        if after is not None:
+            cur.execute(self.STAGE_SQL, (1, after))
+
+    def get(self, chat_id):
+        with self._cursor() as cur:
+            return self._read(cur, chat_id)
+
+    def put(self, chat_id, state):
+        with self._cursor() as cur:
+            cur.execute("SELECT data::json->>'stage' FROM conversations WHERE chat_id = %s FOR UPDATE", (chat_id,))
+            row = cur.fetchone()
+            self._write(cur, chat_id, state, row[0] if row else None)
+
+    def delete(self, chat_id):
+        with self._cursor() as cur:
+            cur.execute("DELETE FROM conversations WHERE chat_id = %s RETURNING data::json->>'stage'", (chat_id,))
+            row = cur.fetchone()
+            if row is not None:
+                self._move(cur, row[0], None)
+        with self._cache_lock:
+            self._cache.pop(chat_id, None)
+
+    def items(self):
+        with self._cursor() as cur:
+            cur.execute("SELECT chat_id, data FROM conversations")
+            return [(chat_id, ConversationState.from_dict(json.loads(data))) for chat_id, data in cur.fetchall()]
+
+    def scan(self, after=None, batch=256):
+        after = MIN_CHAT_ID if after is None else after
+        while True:
+            # Соединение возвращается в пул между порциями
+            with self._cursor() as cur:
+                cur.execute(self.SCAN_SQL, (after, batch))
+                rows = cur.fetchall()
+            if not rows:
+                return
+            for chat_id, data in rows:
+                yield chat_id, ConversationState.from_dict(json.loads(data))
+            after = rows[-1][0]
+
+    def stage_counts(self):
+        with self._cursor() as cur:
+            cur.execute("SELECT stage, count FROM conversation_stages")
+            return dict(cur.fetchall())
+
+    def __len__(self):
+        with self._cursor() as cur:
+            cur.execute("SELECT COALESCE(SUM(count), 0) FROM conversation_stages")
+            return int(cur.fetchone()[0])
+
+    @contextmanager
+    def transaction(self, chat_id, factory):
+        try:
+            with self._cursor() as cur:
+                state = self._read(cur, chat_id, for_update=True)
+                before = None if state is None else state.stage
+                if state is None:
+                    # FOR UPDATE не блокирует несуществующую строку, поэтому
+                    # сначала создаем ее, а затем берем блокировку
+                    cur.execute(
+                        "INSERT INTO conversations (chat_id, version, data) VALUES (%s, 0, %s) "
+                        "ON CONFLICT (chat_id) DO NOTHING RETURNING chat_id",
+                        (chat_id, json.dumps(factory().to_dict(), ensure_ascii=False))
+                    )
+                    created = cur.fetchone() is not None
+                    state = self._read(cur, chat_id, for_update=True)
+                    if not created:
+                        # Чат успел создать другой воркер: его стадия уже посчитана
+                        before = state.stage
+                yield state
+                self._write(cur, chat_id, state, before)
+        except BaseException:
+            with self._cache_lock:
+                self._cache.pop(chat_id, None)
+            raise
+
+
+def running_under_gunicorn():
+    """Процесс - воркер gunicorn (мастер выставляет SERVER_SOFTWARE до fork)"""
+    return os.environ.get('SERVER_SOFTWARE', '').startswith('gunicorn')
+
+
+def create_state_store(backend=None):
+    """Создает хранилище по STATE_BACKEND: memory, sqlite или postgres
+
+    Под gunicorn по умолчанию sqlite: апдейты одного чата попадают в
+    разные воркеры, и состояние в памяти процесса сбрасывало бы стадии.
+    Сколько воркеров запущено, изнутри воркера не узнать, поэтому и с
+    одним воркером выбирается sqlite.
+    """
+    backend = backend or os.environ.get('STATE_BACKEND') or ('sqlite' if running_under_gunicorn() else 'memory')
+
+    if backend == 'memory' and running_under_gunicorn():
+        logger.warning(
+            "⚠️ STATE_BACKEND=memory под gunicorn: состояние своё у каждого воркера, "
+            "с --workers больше 1 стадии диалогов будут сбрасываться"
+        )
+
+    if backend == 'sqlite':
+        path = os.environ.get('STATE_DB_PATH', 'conversations.db')
+        logger.info("🗄️ Состояния диалогов в SQLite: %s", path)
+        return SqliteStateStore(path)
+
+    if backend == 'postgres':
+        logger.info("🗄️ Состояния диалогов в Postgres")
+        return PostgresStateStore(os.environ['DATABASE_URL'])
+
+    idle_ttl = int(os.environ.get('STATE_IDLE_TTL', 1800))
+    if idle_ttl <= 0:
+        return MemoryStateStore()
+
+    spill_path = os.environ.get('STATE_SPILL_PATH') or os.path.join(
+        tempfile.gettempdir(), f"tarot_bot_spill_{os.getpid()}.db"
+    )
+    return EvictingStateStore(
+        spill_path,
+        idle_ttl=idle_ttl,
+        max_hot=int(os.environ.get('STATE_MAX_HOT', 100000))
+    )
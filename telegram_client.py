@@ -0,0 +1,227 @@
+import asyncio
+import os
+import logging
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import TELEGRAM_LATENCY, TELEGRAM_RESPONSES
+from rate_limiter import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_URL = 'https://api.telegram.org'
+
+# Методы Bot API, для которых URL собирается один раз при создании клиента
+METHODS = (
+    'getMe',
+    'sendMessage',
+    'sendChatAction',
+    'setWebhook',
+    'deleteWebhook',
+    'getUpdates',
+)
+
+
+def get_retry_after(response, default=1):
+    """Достает retry_after из ответа 429"""
+    try:
+        return response.json()['parameters']['retry_after']
+    except Exception:
+        return default
+
+
+def observe_call(method, started, status_code):
+    """Метрики вызова Bot API: длительность и результат"""
+    TELEGRAM_LATENCY.observe(time.perf_counter() - started, method)
+    if status_code is None:
+        result = 'exception'
+    elif status_code == 200:
+        result = 'ok'
+    elif status_code == 429:
+        result = 'rate_limited'
+    else:
+        result = 'error'
+    TELEGRAM_RESPONSES.inc(method, result)
+
+
+class TelegramClient:
+    """Клиент Telegram Bot API с keep-alive пулом соединений
+
+    Один экземпляр на процесс: TCP/TLS-соединения к api.telegram.org
+    переиспользуются между запросами, а URL методов построены заранее.
+    Адрес API можно подменить через base_url или TELEGRAM_API_URL,
+    например на локальную заглушку.
+
+    send_message() проходит через RateLimiter: при всплесках отправка
+    ждет своего слота в вызывающем потоке, а ответы 429 ставятся на повтор
+    с учетом retry_after. Это для синхронных ботов; планировщик app.py
+    сам бронирует слот и вызывает send_message_once() в разрешенное время.
+    """
+
+    def __init__(self, token, base_url=None, pool_size=10, timeout=10, rate_limiter=None, max_retries=3):
+        self.base_url = (base_url or os.environ.get('TELEGRAM_API_URL') or DEFAULT_API_URL).rstrip('/')
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.max_retries = max_retries
+        self._prefix = f"{self.base_url}/bot{token}/"
+        self._endpoints = {method: self._prefix + method for method in METHODS}
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+
+    def endpoint(self, method):
+        """Возвращает полный URL метода Bot API"""
+        url = self._endpoints.get(method)
+        if url is None:
+            url = self._endpoints[method] = self._prefix + method
+        return url
+
+    def call(self, method, payload=None, timeout=None):
+        """Вызывает метод Bot API через POST и возвращает requests.Response"""
+        started = time.perf_counter()
+        try:
+            response = self._session.post(
+                self.endpoint(method),
+                json=payload,
+                timeout=timeout or self.timeout
+            )
+        except Exception:
+            observe_call(method, started, None)
+            raise
+        observe_call(method, started, response.status_code)
+        return response
+
+    def get(self, method, params=None, timeout=None):
+        """Вызывает метод Bot API через GET"""
+        return self._session.get(
+            self.endpoint(method),
+            params=params,
+            timeout=timeout or self.timeout
+        )
+
+    def send_message_once(self, chat_id, text, parse_mode='Markdown'):
+        """Один вызов sendMessage без ожидания лимита (слот уже забронирован)"""
+        payload = {'chat_id': chat_id, 'text': text}
+        if parse_mode:
+            payload['parse_mode'] = parse_mode
+        return self.call('sendMessage', payload)
+
+    def send_message(self, chat_id, text, parse_mode='Markdown'):
+        """Отправляет сообщение, дожидаясь лимита в вызывающем потоке"""
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire(chat_id)
+            response = self.send_message_once(chat_id, text, parse_mode)
+            if response.status_code != 429 or attempt == self.max_retries:
+                return response
+
+            retry_after = get_retry_after(response)
+            logger.warning("⏳ 429 для чата %s, повтор через %s сек", chat_id, retry_after)
+            self.rate_limiter.penalize(chat_id, retry_after)
+        return response
+
+    def send_chat_action(self, chat_id, action='typing'):
+        """Показывает статус вроде 'печатает'"""
+        return self.call('sendChatAction', {'chat_id': chat_id, 'action': action}, timeout=5)
+
+    def set_webhook(self, url):
+        """Устанавливает webhook"""
+        return self.call('setWebhook', {'url': url})
+
+    def delete_webhook(self):
+        """Удаляет webhook"""
+        return self.call('deleteWebhook')
+
+    def get_updates(self, offset=None, limit=100, timeout=50, allowed_updates=None):
+        """Long polling: ждет апдейты до timeout секунд"""
+        payload = {'limit': limit, 'timeout': timeout}
+        if offset is not None:
+            payload['offset'] = offset
+        if allowed_updates is not None:
+            payload['allowed_updates'] = allowed_updates
+        # HTTP-таймаут должен пережить серверное ожидание
+        return self.call('getUpdates', payload, timeout=timeout + 10)
+
+    def get_me(self):
+        """Информация о боте"""
+        return self.get('getMe')
+
+    def close(self):
+        """Закрывает все соединения пула"""
+        self._session.close()
+
+
+class AsyncTelegramClient:
+    """Неблокирующий клиент Bot API для asyncio-режима (нужен httpx)
+
+    Те же заранее построенные URL, keep-alive пул и RateLimiter, но
+    ожидание слота и повторы после 429 идут через asyncio.sleep.
+    """
+
+    def __init__(self, token, base_url=None, pool_size=100, timeout=10, rate_limiter=None, max_retries=3):
+        try:
+            import httpx
+        except ImportError:
+            raise RuntimeError("Для asyncio-режима нужен пакет httpx")
+
+        self.base_url = (base_url or os.environ.get('TELEGRAM_API_URL') or DEFAULT_API_URL).rstrip('/')
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.max_retries = max_retries
+        self._prefix = f"{self.base_url}/bot{token}/"
+        self._endpoints = {method: self._prefix + method for method in METHODS}
+        self._client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        )
+
+    def endpoint(self, method):
+        url = self._endpoints.get(method)
+        if url is None:
+            url = self._endpoints[method] = self._prefix + method
+        return url
+
+    async def call(self, method, payload=None, timeout=None):
+        """Вызывает метод Bot API через POST и возвращает httpx.Response"""
+        started = time.perf_counter()
+        try:
+            response = await self._client.post(self.endpoint(method), json=payload, timeout=timeout or self.timeout)
+        except Exception:
+            observe_call(method, started, None)
+            raise
+        observe_call(method, started, response.status_code)
+        return response
+
+    async def send_message(self, chat_id, text, parse_mode='Markdown'):
+        """Отправляет сообщение"""
+        payload = {'chat_id': chat_id, 'text': text}
+        if parse_mode:
+            payload['parse_mode'] = parse_mode
+
+        for attempt in range(self.max_retries + 1):
+            wait = self.rate_limiter.ready_in(chat_id)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            delay = self.rate_limiter.reserve(chat_id)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            response = await self.call('sendMessage', payload)
+            if response.status_code != 429 or attempt == self.max_retries:
+                return response
+
+            retry_after = get_retry_after(response)
+            logger.warning("⏳ 429 для чата %s, повтор через %s сек", chat_id, retry_after)
+            self.rate_limiter.penalize(chat_id, retry_after)
+        return response
+
+    async def send_chat_action(self, chat_id, action='typing'):
+        return await self.call('sendChatAction', {'chat_id': chat_id, 'action': action}, timeout=5)
+
+    async def set_webhook(self, url):
+        return await self.call('setWebhook', {'url': url})
+
+    async def aclose(self):
+        await self._client.aclose()
@@ -0,0 +1,251 @@
+"""Таблицы шаблонов ответов
+
+Все варианты ответов собраны здесь один раз при импорте: каждый шаблон
+проверяется (известные подстановки, непустые наборы) и превращается в
+неизменяемый Template. Генераторы ответов выбирают вариант по индексу
+и подставляют имя только в выбранный шаблон.
+
+Набор можно переопределить JSON-файлом из TEMPLATES_PATH: ключи те же,
+что в DEFAULT_TEMPLATES, значения - списки строк с подстановкой {name}.
+"""
+import json
+import os
+import string
+import zlib
+from types import MappingProxyType
+
+from keyword_matcher import PROBLEM_TYPES
+
+# Единственная подстановка в шаблонах - имя пользователя
+PLACEHOLDERS = frozenset({'name'})
+
+DEFAULT_TEMPLATES = {
+    'greeting': [
+        "привет, {name} ✨",
+        "здравствуй, {name}",
+        "{name}, приветствую",
+    ],
+    'greeting_prompt': [
+        "расскажи, что привело тебя сегодня",
+        "что на душе",
+        "чем могу помочь",
+    ],
+
+    # Эмпатичные ответы по типам
+    'empathy.отношения': [
+        "понимаю, {name}... сердечные вопросы всегда такие глубокие",
+        "ой, {name}, отношения... это всегда про самое важное",
+        "чувствую, {name}, как это важно для тебя",
+    ],
+    'empathy.работа': [
+        "{name}, рабочие вопросы часто бывают очень напряженными",
+        "понимаю, {name}... работа действительно может выматывать",
+        "чувствую напряжение, {name}",
+    ],
+    'empathy.деньги': [
+        "{name}, финансовые темы часто связаны с безопасностью",
+        "понимаю твою озабоченность, {name}",
+        "{name}, деньги... это всегда про свободу и возможности",
+    ],
+    'empathy.здоровье': [
+        "{name}, здоровье - это основа",
+        "чувствую твою заботу о себе, {name}",
+        "понимаю, {name}, как это важно",
+    ],
+    'empathy.выбор': [
+        "{name}, стоять на распутье... это всегда непросто",
+        "чувствую твои сомнения, {name}",
+        "{name}, моменты выбора часто определяют многое",
+    ],
+    'empathy.общая': [
+        "слышу тебя, {name}",
+        "понимаю, {name}",
+        "чувствую, как это беспокоит тебя, {name}",
+    ],
+
+    # Вопросы для углубления
+    'question.отношения': [
+        "что самое важное для тебя в этих отношениях",
+        "чего не хватает для полного счастья",
+        "что твое сердце чувствует в этой ситуации",
+    ],
+    'question.работа': [
+        "что самое сложное в этой ситуации",
+        "как это влияет на твое состояние каждый день",
+        "что бы ты хотел изменить в первую очередь",
+    ],
+    'question.деньги': [
+        "как эта ситуация влияет на твою свободу",
+        "чего ты боишься больше всего",
+        "что изменится, если деньги перестанут быть проблемой",
+    ],
+    'question.здоровье': [
+        "как это влияет на твою повседневную жизнь",
+        "что говорит тебе твое тело",
+        "какой поддержки тебе не хватает",
+    ],
+    'question.выбор': [
+        "что подсказывает твоя интуиция",
+        "чего ты боишься в каждом из вариантов",
+        "какой выбор сделало бы твое сердце, если бы не было страха",
+    ],
+    'question.общая': [
+        "что самое тяжелое в этом для тебя",
+        "как долго это с тобой",
+        "что бы хотелось изменить",
+    ],
+
+    'offer': [
+        "{name}, иногда полезно посмотреть на ситуацию с другой стороны\nкарты таро могут стать таким проводником",
+        "знаешь, {name}, карты часто помогают увидеть то, что скрыто\nхочешь попробовать такой диалог",
+        "{name}, у меня есть чувство\nчто здесь есть важные подсказки для тебя\nкарты могут помочь их расшифровать",
+    ],
+    'offer_explanation': [
+        "это не гадание, а разговор с собой через язык символов",
+        "это как посмотреть на ситуацию через чистое зеркало",
+        "карты помогают увидеть то, что мы часто не замечаем в суете",
+    ],
+
+    # Серия: отправляются все сообщения по порядку
+    'value': [
+        "хорошо, {name} 💫\nтогда я создам для тебя персональный расклад",
+        "буду работать с твоей ситуацией очень внимательно",
+        "стоимость - 1490 рублей\nно для тебя, {name}, сделаю за 990",
+        "это не просто оплата\nа энергообмен и твоя готовность к изменениям",
+    ],
+    'comfort': [
+        "всё в твоем ритме, {name}",
+        "не торопись с решением",
+        "посиди с этим ощущением, {name}",
+    ],
+    'price_ready': [
+        "{name}, готов сделать этот шаг к ясности",
+    ],
+    'value_nudge': [
+        "{name}, как тебе такая инвестиция в себя",
+    ],
+    'ready_nudge': [
+        "{name}, всё в твоем темпе",
+    ],
+    'payment_intro': [
+        "чувствую твою решимость, {name} ✨",
+        "этот шаг изменит многое для тебя",
+    ],
+    'payment_link': [
+        "держи ссылку для оплаты",
+        "https://yoomoney.ru/to/4100111234567890",  # ЗАМЕНИТЕ!
+    ],
+    'payment_already_sent': [
+        "ссылка уже отправлена, проверь сообщения выше",
+    ],
+    # Серия: отправляются все сообщения по порядку
+    'gratitude': [
+        "благодарю, {name} 🙏",
+        "энергия пошла",
+        "начинаю работать с картами для твоего расклада",
+        "займет немного времени\nно оно того стоит\nотдохни, скоро вернусь с ответами",
+    ],
+    'payment_reminder': [
+        "я здесь, {name}\nжду, когда будешь готов",
+        "всё в твоем ритме\nссылка ждет тебя",
+    ],
+    'working_update': [
+        "карты уже говорят...\nчто-то важное про твой путь",
+        "вижу интересные связи\nто, что было скрыто",
+        "{name}, это глубже, чем кажется",
+    ],
+    'restart': [
+        "{name}, расскажи, что происходит",
+    ],
+}
+
+# Наборы, без которых генераторы ответов не работают
+REQUIRED_KEYS = frozenset(
+    ['greeting', 'greeting_prompt', 'offer', 'offer_explanation', 'value', 'comfort',
+     'price_ready', 'value_nudge', 'ready_nudge', 'payment_intro', 'payment_link',
+     'payment_already_sent', 'gratitude', 'payment_reminder', 'working_update', 'restart']
+    + [f"empathy.{t}" for t in PROBLEM_TYPES + ('общая',)]
+    + [f"question.{t}" for t in PROBLEM_TYPES + ('общая',)]
+)
+
+_formatter = string.Formatter()
+
+
+class Template:
+    """Один проверенный вариант ответа
+
+    hash - стабильный между процессами хеш id, по нему чат помнит,
+    какие варианты уже получал.
+    """
+    __slots__ = ('id', 'hash', 'text', 'personal')
+
+    def __init__(self, template_id, text):
+        self.id = template_id
+        self.hash = zlib.crc32(template_id.encode())
+        self.text = text
+        # Шаблоны без {name} отдаются как есть, без format()
+        self.personal = any(field is not None for _, field, _, _ in _formatter.parse(text))
+
+    def render(self, name):
+        if self.personal:
+            return self.text.format(name=name)
+        return self.text
+
+    def __repr__(self):
+        return f"Template({self.id!r})"
+
+
+class TemplateSet(tuple):
+    """Набор вариантов одного ответа с заранее посчитанными хешами"""
+
+    def __new__(cls, templates):
+        self = super().__new__(cls, templates)
+        self.hashes = tuple(template.hash for template in self)
+        return self
+
+
+def compile_templates(raw):
+    """Проверяет наборы шаблонов и собирает неизменяемую таблицу
+
+    Ошибка в шаблоне (неизвестная подстановка, пустой набор, нет
+    обязательного набора) выбрасывает ValueError при загрузке, а не
+    посреди диалога.
+    """
+    missing = REQUIRED_KEYS - raw.keys()
+    if missing:
+        raise ValueError(f"Нет наборов шаблонов: {', '.join(sorted(missing))}")
+
+    table = {}
+    for key, variants in raw.items():
+        if not variants:
+            raise ValueError(f"Пустой набор шаблонов: {key}")
+        compiled = []
+        for index, text in enumerate(variants):
+            try:
+                fields = {field for _, field, _, _ in _formatter.parse(text) if field is not None}
+            except ValueError as e:
+                raise ValueError(f"Шаблон {key}[{index}]: {e}") from None
+            unknown = fields - PLACEHOLDERS
+            if unknown:
+                raise ValueError(f"Шаблон {key}[{index}]: неизвестные подстановки {sorted(unknown)}")
+            compiled.append(Template(f"{key}.{index}", text))
+        table[key] = TemplateSet(compiled)
+    return MappingProxyType(table)
+
+
+def load_templates(path=None):
+    """Таблица по умолчанию, поверх которой накладывается JSON из path"""
+    raw = dict(DEFAULT_TEMPLATES)
+    path = path or os.environ.get('TEMPLATES_PATH')
+    if path:
+        with open(path, encoding='utf-8') as f:
+            raw.update(json.load(f))
+    return compile_templates(raw)
+
+
+TEMPLATES = load_templates()
+
+
+def render_all(key, name):
+    """Серия сообщений: все шаблоны набора по порядку"""
+    return [template.render(name) for template in TEMPLATES[key]]
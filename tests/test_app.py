@@ -0,0 +1,73 @@
+import importlib
+import os
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def core(tmp_path_factory):
+    # app настраивается окружением при импорте: все файлы - во временном каталоге
+    tmp = tmp_path_factory.mktemp('app')
+    os.environ.update({
+        'BOT_TOKEN': 'test',
+        'TELEGRAM_API_URL': 'http://127.0.0.1:9',
+        'STATE_BACKEND': 'memory',
+        'OUTBOX_PATH': str(tmp / 'outbox.db'),
+        'DEDUP_PATH': str(tmp / 'updates.dedup'),
+        'METRICS_DIR': str(tmp / 'metrics'),
+        'LOG_LEVEL': 'OFF',
+    })
+    os.environ.pop('RECORD_TRAFFIC', None)
+    return importlib.import_module('app')
+
+
+def test_start_in_burst_does_not_swallow_problem(core):
+    problem = 'у меня проблема на работе, начальник придирается'
+    responses, applied = core.handle_user_message(101, 'Аня', [(1, '/start'), (2, problem)])
+    state = core.conversation_store.get(101)
+    assert applied == 2
+    assert state['greeted']
+    assert state['problem'] == problem
+    assert state['stage'] == 'problem_understood'
+    # Приветствие и ответ на проблему
+    assert len(responses) == 4
+
+
+def test_command_is_not_joined_into_text(core):
+    core.handle_user_message(102, 'Аня', [(10, '/start')])
+    problem = 'у меня проблема с деньгами'
+    responses, applied = core.handle_user_message(102, 'Аня', [(11, problem), (12, '/help')])
+    state = core.conversation_store.get(102)
+    assert applied == 12
+    assert state['problem'] == problem
+    assert responses
+
+
+def test_applied_updates_are_skipped(core):
+    core.handle_user_message(103, 'Аня', [(20, '/start')])
+    assert core.handle_user_message(103, 'Аня', [(20, '/start')]) == ([], None)
+
+
+def test_failed_burst_returns_messages_to_outbox(core, monkeypatch):
+    core.outbox.add('msg:30', 104, '["Аня", "привет", 30]', 0, core.MESSAGE)
+
+    def fail(*args):
+        raise RuntimeError('хранилище недоступно')
+
+    monkeypatch.setattr(core, 'handle_user_message', fail)
+    with pytest.raises(RuntimeError):
+        core.flush_burst(104, None)
+    # Следующая серия чата снова видит сообщение
+    assert [key for key, _ in core.outbox.claim_messages(104)] == ['msg:30']
+
+
+def test_update_id_order_holds_only_within_dedup_window(core):
+    state = core.new_conversation_state()
+    state['last_update_id'] = 1000
+    state['last_message_time'] = core.time.time()
+    assert not core.advance_update_id(state, 999)
+
+    # Telegram начал update_id заново после долгой тишины
+    state['last_message_time'] = core.time.time() - 8 * 86400
+    assert core.advance_update_id(state, 5)
+    assert state['last_update_id'] == 5
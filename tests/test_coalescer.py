@@ -0,0 +1,79 @@
+import threading
+
+import pytest
+
+from coalescer import BurstCoalescer
+from conftest import wait_for
+from scheduler import DeliveryScheduler
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = DeliveryScheduler(workers=2, name='test-coalescer')
+    yield scheduler
+    scheduler.shutdown()
+
+
+def make_coalescer(scheduler, hold, quiet):
+    flushed = []
+    lock = threading.Lock()
+
+    def flush(chat_id, burst):
+        with lock:
+            flushed.append((chat_id, burst.user_name, list(burst.messages)))
+
+    return BurstCoalescer(scheduler, flush, hold=hold, quiet=quiet), flushed
+
+
+def test_burst_is_flushed_once_with_all_messages(scheduler):
+    coalescer, flushed = make_coalescer(scheduler, hold=0.05, quiet=0.01)
+    for update_id, text in enumerate(['привет', 'у меня', 'вопрос'], 1):
+        coalescer.add(7, 'Аня', text, update_id)
+    assert coalescer.pending() == 1
+
+    assert wait_for(lambda: flushed)
+    assert wait_for(lambda: coalescer.pending() == 0)
+    assert flushed == [(7, 'Аня', [(1, 'привет'), (2, 'у меня'), (3, 'вопрос')])]
+    assert coalescer.stats()['flushes'] == 1
+
+
+def test_chats_are_coalesced_separately(scheduler):
+    coalescer, flushed = make_coalescer(scheduler, hold=0.02, quiet=0.01)
+    coalescer.add(1, 'A', 'раз', 1)
+    coalescer.add(2, 'B', 'два', 2)
+    coalescer.add(1, 'A', 'три', 3)
+    assert wait_for(lambda: len(flushed) == 2)
+    assert sorted(flushed) == [(1, 'A', [(1, 'раз'), (3, 'три')]), (2, 'B', [(2, 'два')])]
+
+
+def test_late_message_extends_burst_by_quiet(scheduler):
+    coalescer, flushed = make_coalescer(scheduler, hold=0.0, quiet=0.1)
+    coalescer.add(1, 'A', 'раз', 1)
+    coalescer.add(1, 'A', 'два', 2)
+    # Срок сдвинулся вперед: старый таймер отменен, а не сработал
+    assert coalescer.stats()['rescheduled'] == 1
+    assert wait_for(lambda: flushed)
+    assert flushed == [(1, 'A', [(1, 'раз'), (2, 'два')])]
+
+
+def test_message_after_flush_opens_new_burst(scheduler):
+    coalescer, flushed = make_coalescer(scheduler, hold=0.01, quiet=0.01)
+    coalescer.add(1, 'A', 'раз', 1)
+    assert wait_for(lambda: len(flushed) == 1)
+    coalescer.add(1, 'A', 'два', 2)
+    assert wait_for(lambda: len(flushed) == 2)
+    assert [messages for _, _, messages in flushed] == [[(1, 'раз')], [(2, 'два')]]
+
+
+def test_hold_callable_is_called_once_per_burst(scheduler):
+    holds = []
+
+    def hold():
+        holds.append(1)
+        return 0.02
+
+    coalescer, flushed = make_coalescer(scheduler, hold=hold, quiet=0.0)
+    for update_id in range(5):
+        coalescer.add(1, 'A', 'текст', update_id)
+    assert wait_for(lambda: flushed)
+    assert len(holds) == 1
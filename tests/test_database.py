@@ -0,0 +1,50 @@
+import threading
+
+from database import SqliteDB
+
+
+def test_reads_see_buffered_rows(tmp_path):
+    db = SqliteDB(str(tmp_path / 'readings.db'), commit_interval=60)
+    db.save_reading(1, 'вопрос', {'name': 'Шут'}, 'толкование')
+    db.save_conversation(1, 'user', 'привет')
+    assert [reading['question'] for reading in db.get_user_readings(1)] == ['вопрос']
+    assert [message['content'] for message in db.get_conversation_history(1)] == ['привет']
+    db.flush()
+    assert [reading['question'] for reading in db.get_user_readings(1)] == ['вопрос']
+    assert db.stats()['buffered'] == 0
+
+
+def test_reads_during_group_commits_never_duplicate_or_lose_rows(tmp_path):
+    db = SqliteDB(str(tmp_path / 'readings.db'), commit_interval=0.001)
+    total = 400
+    done = threading.Event()
+    errors = []
+
+    def write():
+        for i in range(total):
+            db.save_reading(1, f"вопрос {i}", {'name': 'Шут'}, 'толкование')
+        done.set()
+
+    def read():
+        seen = 0
+        while not done.is_set() or seen < total:
+            readings = db.get_user_readings_between(1)
+            questions = [reading['question'] for reading in readings]
+            # Строка не может попасть в ответ дважды или пропасть после того, как ее видели
+            if len(set(questions)) != len(questions):
+                errors.append('duplicate')
+            if len(questions) < seen:
+                errors.append('lost')
+            seen = len(questions)
+
+    writer = threading.Thread(target=write)
+    readers = [threading.Thread(target=read) for _ in range(3)]
+    for thread in readers + [writer]:
+        thread.start()
+    for thread in readers + [writer]:
+        thread.join(30)
+    db.flush()
+
+    assert errors == []
+    assert len(db.get_user_readings_between(1)) == total
+    assert db.stats()['commits'] > 1
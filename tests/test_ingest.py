@@ -0,0 +1,67 @@
+import random
+import threading
+import time
+
+from conftest import wait_for
+from ingest import IngestQueue, MailboxQueue
+
+
+def test_mailbox_keeps_chat_order_and_never_runs_chat_twice():
+    seen = {}
+    active = set()
+    overlaps = []
+    lock = threading.Lock()
+
+    def handle(item):
+        chat_id, n = item
+        with lock:
+            if chat_id in active:
+                overlaps.append(chat_id)
+            active.add(chat_id)
+        time.sleep(random.random() * 0.002)
+        with lock:
+            active.discard(chat_id)
+            seen.setdefault(chat_id, []).append(n)
+
+    queue = MailboxQueue(handle, key=lambda item: item[0], workers=8, maxsize=10000, name='test-mailbox')
+    for n in range(50):
+        for chat_id in range(10):
+            assert queue.submit((chat_id, n))
+
+    assert wait_for(lambda: queue.stats()['processed'] == 500)
+    assert overlaps == []
+    assert seen == {chat_id: list(range(50)) for chat_id in range(10)}
+    assert queue.stats()['mailboxes'] == 0
+
+
+def test_reject_policy_refuses_when_full():
+    release = threading.Event()
+    queue = IngestQueue(lambda item: release.wait(5), workers=1, maxsize=2, policy='reject', name='test-reject')
+    assert queue.submit(1)
+    # Первый апдейт уже у воркера: в очереди место для двух
+    assert wait_for(lambda: queue.depth() == 0)
+    assert queue.submit(2)
+    assert queue.submit(3)
+    assert not queue.submit(4)
+    assert queue.stats()['rejected'] == 1
+    release.set()
+
+
+def test_shed_oldest_drops_longest_waiting_chat():
+    release = threading.Event()
+    handled = []
+
+    def handle(item):
+        release.wait(5)
+        handled.append(item)
+
+    queue = MailboxQueue(handle, key=lambda item: item[0], workers=1, maxsize=2, policy='shed_oldest', name='test-shed')
+    queue.submit(('busy', 0))
+    assert wait_for(lambda: queue.depth() == 0)
+    queue.submit(('a', 1))
+    queue.submit(('b', 1))
+    queue.submit(('c', 1))
+    release.set()
+    assert wait_for(lambda: queue.stats()['processed'] == 3)
+    assert handled == [('busy', 0), ('b', 1), ('c', 1)]
+    assert queue.stats()['shed'] == 1
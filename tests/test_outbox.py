@@ -0,0 +1,141 @@
+import multiprocessing
+import os
+import threading
+import time
+
+import pytest
+
+from outbox import MESSAGE, Outbox
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'outbox.db')
+
+
+def claim_range(path, keys, results):
+    outbox = Outbox(path, commit_interval=0.01)
+    results.put([key for key in keys if outbox.claim(key)])
+
+
+def test_claim_sees_buffered_add(path):
+    outbox = Outbox(path, commit_interval=60)
+    outbox.add('a:0', 1, 'текст', time.time())
+    assert outbox.claim('a:0')
+    assert not outbox.claim('a:0')
+    assert not outbox.claim('missing')
+
+
+def test_claim_race_between_threads(path):
+    outbox = Outbox(path, commit_interval=0.01)
+    outbox.add('a:0', 1, 'текст', time.time())
+    outbox.flush()
+    results = []
+    barrier = threading.Barrier(8)
+
+    def claim():
+        barrier.wait()
+        results.append(outbox.claim('a:0'))
+
+    threads = [threading.Thread(target=claim) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results.count(True) == 1
+
+
+def test_claim_race_between_processes(path):
+    keys = [f"k:{i}" for i in range(50)]
+    outbox = Outbox(path, commit_interval=0.01)
+    for key in keys:
+        outbox.add(key, 1, 'текст', time.time())
+    outbox.flush()
+
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    workers = [context.Process(target=claim_range, args=(path, keys, results)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    claimed = [key for _ in workers for key in results.get(timeout=30)]
+    for worker in workers:
+        worker.join()
+    # Каждый ответ отправил ровно один процесс
+    assert sorted(claimed) == sorted(keys)
+
+
+def test_claim_messages_takes_chat_messages_once(path):
+    first = Outbox(path, commit_interval=60)
+    second = Outbox(path, commit_interval=60)
+    first.add('msg:1', 7, '["A", "раз", 1]', time.time(), MESSAGE)
+    second.add('msg:2', 7, '["A", "два", 2]', time.time(), MESSAGE)
+    second.add('msg:3', 8, '["B", "чужой", 3]', time.time(), MESSAGE)
+    first.add('1:0', 7, 'ответ', time.time())
+    second.flush()
+
+    # Сообщения чата, принятые другим процессом, тоже достаются первому
+    assert [key for key, _ in first.claim_messages(7)] == ['msg:1', 'msg:2']
+    assert second.claim_messages(7) == []
+    assert [key for key, _ in second.claim_messages(8)] == ['msg:3']
+    # Ответ - не сообщение: его захватывает только claim()
+    assert first.claim('1:0')
+
+
+def test_adopt_takes_only_dead_owners_entries(path):
+    alive = Outbox(path, commit_interval=60)
+    dead = Outbox(path, commit_interval=60)
+    heir = Outbox(path, commit_interval=60)
+    alive.add('alive:0', 1, 'живой', time.time())
+    dead.add('dead:1', 2, 'второй', time.time() + 10)
+    dead.add('dead:0', 2, 'первый', time.time())
+    dead.add('dead:sent', 2, 'ушел', time.time())
+    assert dead.claim('dead:sent')
+    alive.flush()
+    dead.flush()
+    # Смерть процесса: ядро снимает его flock
+    os.close(dead._owner_fd)
+
+    adopted = heir.adopt()
+    assert [entry[0] for entry in adopted] == ['dead:0', 'dead:1']
+    assert heir.adopt() == []
+    assert alive.adopt() == []
+    assert heir.claim('dead:0')
+    assert alive.claim('alive:0')
+
+
+def test_sent_is_committed(path):
+    outbox = Outbox(path, commit_interval=60)
+    outbox.add('a:0', 1, 'текст', time.time())
+    outbox.add('a:1', 1, 'текст', time.time())
+    assert outbox.claim('a:0')
+    outbox.sent('a:0')
+    outbox.flush()
+    assert outbox.stats()['sent'] == 1
+    # После смерти процесса наследнику достается только неотправленный ответ
+    os.close(outbox._owner_fd)
+    adopted = Outbox(path, commit_interval=60).adopt()
+    assert [entry[0] for entry in adopted] == ['a:1']
+
+
+def test_release_returns_claimed_messages(path):
+    outbox = Outbox(path, commit_interval=60)
+    outbox.add('msg:1', 7, '["A", "раз", 1]', time.time(), MESSAGE)
+    claimed = outbox.claim_messages(7)
+    assert claimed
+    outbox.release([key for key, _ in claimed])
+    assert outbox.claim_messages(7) == claimed
+
+
+def test_sweep_skips_owner_files_not_locked_yet(path):
+    outbox = Outbox(path, commit_interval=60)
+    outbox.add('a:0', 1, 'текст', time.time())
+    outbox.flush()
+    owners = path + '.owners'
+    assert os.listdir(owners) == [outbox.owner]
+    # Соседний процесс создал свой файл, но еще не успел взять замок
+    starting = os.path.join(owners, '.' + 'f' * 32)
+    open(starting, 'w').close()
+
+    assert Outbox(path, commit_interval=60).adopt() == []
+    assert os.path.exists(starting)
+    assert os.path.exists(os.path.join(owners, outbox.owner))
@@ -0,0 +1,105 @@
+import pytest
+
+import polling
+from polling import LongPoller
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class FakeBotAPI:
+    """getUpdates по сценарию: отдает апдейты с update_id >= offset"""
+
+    def __init__(self, update_ids):
+        self.updates = [{"update_id": update_id, "message": {"text": str(update_id)}} for update_id in update_ids]
+        # offset каждого вызова getUpdates
+        self.offsets = []
+
+    def get_updates(self, offset=None, limit=100, timeout=50):
+        self.offsets.append(offset)
+        result = [u for u in self.updates if offset is None or u['update_id'] >= offset]
+        return FakeResponse({"ok": True, "result": result[:limit]})
+
+
+@pytest.fixture
+def offset_path(tmp_path):
+    return str(tmp_path / 'polling.offset')
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    calls = []
+    monkeypatch.setattr(polling.time, 'sleep', calls.append)
+    return calls
+
+
+def test_offset_is_committed_after_batch(offset_path, sleeps):
+    api = FakeBotAPI([10, 11, 12])
+    handled = []
+    poller = LongPoller(api, handled.append, offset_path=offset_path)
+
+    assert poller.poll_once() == 3
+    assert [u['update_id'] for u in handled] == [10, 11, 12]
+    assert poller.offset == 13
+    assert open(offset_path).read() == '13'
+
+    # Следующий запрос идет уже с зафиксированного offset
+    assert poller.poll_once() == 0
+    assert api.offsets == [None, 13]
+    assert sleeps == []
+
+
+def test_offset_survives_restart(offset_path, sleeps):
+    api = FakeBotAPI([10, 11])
+    LongPoller(api, lambda update: True, offset_path=offset_path).poll_once()
+
+    api.updates.append({"update_id": 12, "message": {"text": "12"}})
+    handled = []
+    restarted = LongPoller(api, handled.append, offset_path=offset_path)
+    assert restarted.offset == 12
+
+    assert restarted.poll_once() == 1
+    assert [u['update_id'] for u in handled] == [12]
+    assert api.offsets[-1] == 12
+
+
+def test_overloaded_handler_stops_batch_and_backs_off(offset_path, sleeps):
+    api = FakeBotAPI([10, 11, 12])
+    handled = []
+
+    def handler(update):
+        # Очередь переполнена на втором апдейте
+        if update['update_id'] == 11 and len(handled) < 2:
+            handled.append(update['update_id'])
+            return False
+        handled.append(update['update_id'])
+        return True
+
+    poller = LongPoller(api, handler, offset_path=offset_path, retry_delay=5)
+    assert poller.poll_once() == 1
+    assert poller.offset == 11
+    assert open(offset_path).read() == '11'
+    assert sleeps == [5]
+
+    # Непринятый апдейт запрашивается снова, ничего не теряется
+    assert poller.poll_once() == 2
+    assert api.offsets == [None, 11]
+    assert handled == [10, 11, 11, 12]
+    assert open(offset_path).read() == '13'
+    assert sleeps == [5]
+
+
+def test_nothing_saved_when_first_update_rejected(offset_path, sleeps):
+    api = FakeBotAPI([10])
+    poller = LongPoller(api, lambda update: False, offset_path=offset_path, retry_delay=1)
+
+    assert poller.poll_once() == 0
+    assert poller.offset is None
+    assert sleeps == [1]
+    with pytest.raises(FileNotFoundError):
+        open(offset_path)
@@ -0,0 +1,80 @@
+import pytest
+
+import rate_limiter
+from rate_limiter import RateLimiter, TokenBucket
+
+
+@pytest.fixture
+def limiter(clock, monkeypatch):
+    monkeypatch.setattr(rate_limiter.time, 'monotonic', clock)
+    return RateLimiter(global_rate=30, global_burst=30, chat_rate=1, chat_burst=1, idle_ttl=60, flood_window=1.0)
+
+
+def test_token_bucket_burst_then_rate():
+    bucket = TokenBucket(rate=2, burst=3)
+    now = 10.0
+    for _ in range(3):
+        assert bucket.earliest(now) == now
+        bucket.consume(now)
+    assert bucket.earliest(now) == pytest.approx(now + 0.5)
+
+
+def test_chat_waits_between_messages(limiter, clock):
+    assert limiter.ready_in(1) == 0.0
+    assert limiter.reserve(1) == 0.0
+    assert limiter.ready_in(1) == pytest.approx(1.0)
+    clock.advance(1.0)
+    assert limiter.ready_in(1) == pytest.approx(0.0)
+    assert limiter.reserve(1) == pytest.approx(0.0)
+
+
+def test_ready_in_does_not_reserve(limiter):
+    for _ in range(100):
+        assert limiter.ready_in(1) == 0.0
+    # Ни одного слота не занято: все 30 глобальных свободны
+    assert [limiter.reserve(chat_id) for chat_id in range(30)] == [0.0] * 30
+
+
+def test_global_limit_spreads_reservations(limiter):
+    delays = [limiter.reserve(chat_id) for chat_id in range(32)]
+    assert delays[:30] == [0.0] * 30
+    assert delays[30] == pytest.approx(1 / 30)
+    assert delays[31] == pytest.approx(2 / 30)
+
+
+def test_penalty_blocks_only_that_chat(limiter):
+    limiter.penalize(1, retry_after=5)
+    assert limiter.ready_in(1) == pytest.approx(5.0)
+    assert limiter.ready_in(2) == 0.0
+    assert limiter.reserve(2) == 0.0
+
+
+def test_repeated_penalty_for_one_chat_stays_local(limiter, clock):
+    limiter.penalize(1, retry_after=5)
+    clock.advance(0.5)
+    limiter.penalize(1, retry_after=5)
+    assert limiter.reserve(2) == 0.0
+
+
+def test_penalties_in_different_chats_block_the_bot(limiter, clock):
+    limiter.penalize(1, retry_after=5)
+    clock.advance(0.5)
+    limiter.penalize(2, retry_after=5)
+    # Два чата подряд получили 429: упираемся в общий лимит бота
+    assert limiter.reserve(3) == pytest.approx(5.0)
+
+
+def test_penalties_outside_flood_window_stay_local(limiter, clock):
+    limiter.penalize(1, retry_after=5)
+    clock.advance(2.0)
+    limiter.penalize(2, retry_after=5)
+    assert limiter.reserve(3) == 0.0
+
+
+def test_idle_chat_buckets_are_swept(limiter, clock):
+    for chat_id in range(10):
+        limiter.reserve(chat_id)
+    assert limiter.tracked_chats() == 10
+    clock.advance(61)
+    limiter.reserve(100)
+    assert limiter.tracked_chats() == 1
@@ -0,0 +1,72 @@
+import threading
+import time
+
+import pytest
+
+from conftest import wait_for
+from scheduler import DeliveryScheduler
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = DeliveryScheduler(workers=1, name='test-delivery')
+    yield scheduler
+    scheduler.shutdown()
+
+
+def test_runs_in_due_order(scheduler):
+    calls = []
+    for delay, name in [(0.06, 'c'), (0.02, 'a'), (0.04, 'b')]:
+        scheduler.schedule(delay, calls.append, name)
+    assert wait_for(lambda: len(calls) == 3)
+    assert calls == ['a', 'b', 'c']
+
+
+def test_same_due_keeps_scheduling_order(scheduler):
+    calls = []
+    due = time.monotonic() + 0.02
+    for name in 'abcde':
+        scheduler.schedule_at(due, calls.append, name)
+    assert wait_for(lambda: len(calls) == 5)
+    assert calls == list('abcde')
+
+
+def test_cancelled_entry_does_not_run(scheduler):
+    calls = []
+    kept = scheduler.schedule(0.03, calls.append, 'kept')
+    dropped = scheduler.schedule(0.01, calls.append, 'dropped')
+    assert scheduler.pending() == 2
+
+    assert scheduler.cancel(dropped)
+    assert not scheduler.cancel(dropped)
+    assert scheduler.pending() == 1
+    assert scheduler.next_due() == kept.due
+
+    assert wait_for(lambda: calls == ['kept'])
+    time.sleep(0.03)
+    assert calls == ['kept']
+
+
+def test_cancel_after_run_is_noop(scheduler):
+    done = threading.Event()
+    entry = scheduler.schedule(0, done.set)
+    assert done.wait(5)
+    assert wait_for(lambda: scheduler.pending() == 0)
+    assert not scheduler.cancel(entry)
+    assert scheduler.pending() == 0
+
+
+def test_earlier_entry_wakes_sleeping_worker(scheduler):
+    calls = []
+    scheduler.schedule(5, calls.append, 'late')
+    # Воркер уже спит до 'late': новая ближайшая задача должна его разбудить
+    time.sleep(0.02)
+    scheduler.schedule(0.01, calls.append, 'early')
+    assert wait_for(lambda: calls == ['early'], timeout=1)
+
+
+def test_failing_task_does_not_stop_worker(scheduler):
+    calls = []
+    scheduler.schedule(0, lambda: 1 / 0)
+    scheduler.schedule(0.01, calls.append, 'after')
+    assert wait_for(lambda: calls == ['after'])
@@ -0,0 +1,114 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from rate_limiter import RateLimiter
+from telegram_client import TelegramClient, get_retry_after
+
+
+class StubBotAPI:
+    """Локальный Bot API: записывает вызовы и отвечает по сценарию"""
+
+    def __init__(self):
+        # (путь, тело запроса, порт клиента)
+        self.calls = []
+        # [(код, тело)] по очереди; когда сценарий кончился - {"ok": true}
+        self.script = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                stub.calls.append((self.path, json.loads(body) if body else None, self.client_address[1]))
+                status, data = stub.script.pop(0) if stub.script else (200, {"ok": True, "result": True})
+                reply = json.dumps(data).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(reply)))
+                self.end_headers()
+                self.wfile.write(reply)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def too_many_requests(self, retry_after):
+        self.script.append((429, {
+            "ok": False,
+            "error_code": 429,
+            "description": "Too Many Requests",
+            "parameters": {"retry_after": retry_after}
+        }))
+
+
+@pytest.fixture
+def stub():
+    stub = StubBotAPI()
+    yield stub
+    stub.server.shutdown()
+    stub.server.server_close()
+
+
+@pytest.fixture
+def client(stub):
+    # Лимиты не мешают: проверяется сам клиент
+    limiter = RateLimiter(global_rate=1000, global_burst=1000, chat_rate=1000, chat_burst=1000)
+    return TelegramClient('TOKEN', base_url=stub.url, rate_limiter=limiter, max_retries=2)
+
+
+def test_send_message_endpoint_and_payload(stub, client):
+    response = client.send_message_once(42, 'привет')
+    assert response.status_code == 200
+    assert stub.calls == [('/botTOKEN/sendMessage', {'chat_id': 42, 'text': 'привет', 'parse_mode': 'Markdown'}, stub.calls[0][2])]
+
+    client.send_chat_action(42)
+    assert stub.calls[1][:2] == ('/botTOKEN/sendChatAction', {'chat_id': 42, 'action': 'typing'})
+
+
+def test_base_url_from_environment(stub, monkeypatch):
+    monkeypatch.setenv('TELEGRAM_API_URL', stub.url + '/')
+    client = TelegramClient('TOKEN')
+    assert client.endpoint('getMe') == f"{stub.url}/botTOKEN/getMe"
+    assert client.call('getMe').status_code == 200
+
+
+def test_pooled_session_reuses_connection(stub, client):
+    for i in range(5):
+        client.send_message_once(1, f"сообщение {i}")
+    # Все запросы прошли по одному keep-alive соединению
+    assert len({port for _, _, port in stub.calls}) == 1
+
+
+def test_429_waits_retry_after_and_retries(stub, client):
+    stub.too_many_requests(0.2)
+    started = time.monotonic()
+    response = client.send_message(7, 'текст')
+    assert response.status_code == 200
+    assert time.monotonic() - started >= 0.2
+    assert [payload['text'] for _, payload, _ in stub.calls] == ['текст', 'текст']
+
+
+def test_429_gives_up_after_max_retries(stub, client):
+    for _ in range(5):
+        stub.too_many_requests(0.01)
+    response = client.send_message(7, 'текст')
+    assert response.status_code == 429
+    assert len(stub.calls) == 3
+
+
+def test_get_retry_after_defaults_on_bad_body(stub, client):
+    stub.script.append((429, {"ok": False}))
+    assert get_retry_after(client.send_message_once(1, 'x')) == 1
@@ -0,0 +1,99 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TypingHeartbeat:
+    """Статус 'печатает' для всех чатов процесса на одном таймере
+
+    Telegram держит статус около 5 секунд, поэтому чат из набора
+    печатающих получает sendChatAction каждые interval секунд, пока не
+    вызван end() (ответ отправлен) или не истек max_duration. Один тик
+    раз в tick секунд обходит набор и раздает обновления пулу
+    планировщика; повторный begin() для уже печатающего чата и тик во
+    время незавершенного запроса ничего не отправляют.
+    """
+
+    def __init__(self, send, scheduler, interval=4.5, tick=0.25, max_duration=60.0):
+        self.send = send
+        self.scheduler = scheduler
+        self.interval = interval
+        self.tick = tick
+        self.max_duration = max_duration
+        # chat_id -> [когда отправлен последний статус, когда перестать]
+        self._typing = {}
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._timer = None
+
+        # Метрики
+        self.sent = 0
+        self.deduplicated = 0
+
+    def begin(self, chat_id, duration=None):
+        """Показывает 'печатает' до end() или duration секунд"""
+        now = time.monotonic()
+        expires = now + min(duration or self.max_duration, self.max_duration)
+        with self._lock:
+            entry = self._typing.get(chat_id)
+            if entry is not None:
+                # Уже печатает: только продлеваем
+                entry[1] = max(entry[1], expires)
+                self.deduplicated += 1
+                return
+            self._typing[chat_id] = [now, expires]
+            self._dispatch(chat_id)
+            if self._timer is None:
+                self._timer = self.scheduler.schedule(self.tick, self._on_tick)
+
+    def end(self, chat_id):
+        """Ответ отправлен: больше не обновляем статус"""
+        with self._lock:
+            self._typing.pop(chat_id, None)
+
+    def is_typing(self, chat_id):
+        return chat_id in self._typing
+
+    def stats(self):
+        with self._lock:
+            return {
+                "typing": len(self._typing),
+                "in_flight": len(self._in_flight),
+                "sent": self.sent,
+                "deduplicated": self.deduplicated
+            }
+
+    def _dispatch(self, chat_id):
+        # Вызывается под self._lock
+        if chat_id in self._in_flight:
+            self.deduplicated += 1
+            return
+        self._in_flight.add(chat_id)
+        self.sent += 1
+        self.scheduler.schedule(0, self._send, chat_id)
+
+    def _send(self, chat_id):
+        try:
+            self.send(chat_id)
+        except Exception as e:
+            logger.error("Ошибка sendChatAction: %s", e)
+        finally:
+            with self._lock:
+                self._in_flight.discard(chat_id)
+
+    def _on_tick(self):
+        now = time.monotonic()
+        with self._lock:
+            for chat_id, entry in list(self._typing.items()):
+                if entry[1] <= now:
+                    del self._typing[chat_id]
+                elif now - entry[0] >= self.interval:
+                    entry[0] = now
+                    self._dispatch(chat_id)
+            # Таймер живет, только пока кто-то печатает
+            if self._typing:
+                self._timer = self.scheduler.schedule(self.tick, self._on_tick)
+            else:
+                self._timer = None